@@ -5,9 +5,39 @@ from  baseScene import BaseScene
 class App(BaseScene):
     """由BaseScene派生的3D应用程序类"""
  
+    def prepare(self):
+        """创建坐标轴节点和三个箭头子节点，箭头的变换相对于坐标轴节点"""
+
+        self.axes = self.graph.add()        # 坐标轴节点，移动它时箭头随之移动
+        self.arrows = [
+            (self.graph.add(self.axes).rotate(90, 0, 1, 0).translate(0, 0, 0.8), (1.0, 0.0, 0.0)),     # x轴变z轴，向z轴正方向平移，红色
+            (self.graph.add(self.axes).rotate(-90, 1, 0, 0).translate(0, 0, 0.8), (0.0, 1.0, 0.0)),    # y轴变z轴，向z轴正方向平移，绿色
+            (self.graph.add(self.axes).translate(0, 0, 0.8), (0.0, 0.0, 1.0))                          # 向z轴正方向平移，蓝色
+        ]
+
     def draw(self):
         """绘制模型"""
 
+        self.replay('axes', self.draw_axes)
+
+        glColor(1.0, 1.0, 1.0)              # 设置当前颜色为白色
+        self.replay('wire_cone', lambda: glutWireCone(0.3, 0.6, 10, 5))     # 绘制圆锥（线框）
+
+        for node, color in self.arrows:
+            glPushMatrix()                  # 保存当前矩阵
+            glMultMatrixf(node.world)       # 乘以节点缓存的世界矩阵
+            glColor(*color)                 # 设置当前颜色
+            self.draw_arrow()               # 绘制圆锥（实体）
+            glPopMatrix()                   # 恢复保存的矩阵
+
+    def draw_arrow(self):
+        """绘制坐标轴箭头，三个箭头共用一个录制，颜色在录制外设置"""
+
+        self.replay('arrow', lambda: glutSolidCone(0.02, 0.2, 30, 30))
+
+    def draw_axes(self):
+        """绘制坐标轴"""
+
         glBegin(GL_LINES)                   # 开始绘制线段
         glColor(1.0, 0.0, 0.0)              # 设置当前颜色为红色
         glVertex(-1.0, 0.0, 0.0)            # 设置线段顶点（x轴负方向）
@@ -20,29 +50,6 @@ class App(BaseScene):
         glVertex(0.0, 0.0, 0.8)             # 设置线段顶点（z轴正方向）
         glEnd()                             # 结束绘制线段
 
-        glColor(1.0, 1.0, 1.0)              # 设置当前颜色为白色
-        glutWireCone(0.3, 0.6, 10, 5)       # 绘制圆锥（线框）
-
-        glPushMatrix()                      # 保存当前矩阵
-        glRotate(90, 0, 1, 0)               # 绕向量(0,1,0)即y轴旋转90度
-        glTranslate(0, 0, 0.8)              # x轴变z轴，向z轴正方向平移
-        glColor(1.0, 0.0, 0.0)              # 设置当前颜色为红色
-        glutSolidCone(0.02, 0.2, 30, 30)    # 绘制圆锥（实体）
-        glPopMatrix()                       # 恢复保存的矩阵
-
-        glPushMatrix()                      # 保存当前矩阵
-        glRotate(-90, 1, 0, 0)              # 绕向量(1,0,0)即x轴旋转-90度
-        glTranslate(0, 0, 0.8)              # y轴变z轴，向z轴正方向平移
-        glColor(0.0, 1.0, 0.0)              # 设置当前颜色为绿色
-        glutSolidCone(0.02, 0.2, 30, 30)    # 绘制圆锥（实体）
-        glPopMatrix()                       # 恢复保存的矩阵
-
-        glPushMatrix()                      # 保存当前矩阵
-        glTranslate(0, 0, 0.8)              # 向z轴正方向平移
-        glColor(0.0, 0.0, 1.0)              # 设置当前颜色为蓝色
-        glutSolidCone(0.02, 0.2, 30, 30)    # 绘制圆锥（实体）
-        glPopMatrix()                       # 恢复保存的矩阵
-
 if __name__ == '__main__':
     app = App(hax='y')
     app.show()
@@ -1,8 +1,10 @@
 
 import numpy as np
 from OpenGL.GL import *
-from OpenGL.arrays import vbo
 from  baseScene import BaseScene
+from geometry import Geometry
+import batching
+import culling
 
 class App(BaseScene):
     """由BaseScene派生的3D应用程序类"""
@@ -11,7 +13,9 @@ class App(BaseScene):
         """构造函数"""
 
         BaseScene.__init__(self, **kwds)    # 调用基类构造函数
-        self.models = list()                # 模型列表，保存模型的VBO
+        self.models = list()                # 模型列表，保存模型的几何体
+        self.batches = list()               # 合并后的模型批次，每种顶点格式一个
+        self.culler = None                  # 视椎体剔除，culler.drawn和culler.culled为每帧绘制和剔除的模型数
 
     def prepare(self):
         """顶点数据预处理"""
@@ -45,41 +49,33 @@ class App(BaseScene):
             [4, 7, 3, 0]  # v4-v0-v3-v7 (left)
         ], dtype=np.int32)
 
-        vs_triangle = vbo.VBO(vertices_triangle)
-        vs_cube = vbo.VBO(vertices_cube)
-        idx_cube = vbo.VBO(indices_cube, target=GL_ELEMENT_ARRAY_BUFFER)
+        triangle = Geometry(GL_TRIANGLES, vao=self.use_vao)
+        triangle.interleave(vertices_triangle, GL_C3F_V3F)   # 混合数组类型：颜色+顶点
+
+        cube = Geometry(GL_QUADS, vao=self.use_vao)
+        cube.interleave(vertices_cube, GL_C3F_V3F)
+        cube.elements(indices_cube)
 
         self.models.append({
-            'gltype':   GL_TRIANGLES,       # 图元类型 
-            'atype':    GL_C3F_V3F,         # 混合数组类型
-            'vbo_vs':   vs_triangle,        # 顶点vbo
-            'n_vs':     len(vs_triangle),   # 顶点数量
-            'vbo_idx':  None,               # 索引vbo
-            'n_idx':    None                # 索引长度
+            'geometry': triangle            # 几何体
         })
 
         self.models.append({
-            'gltype':   GL_QUADS,           # 图元类型 
-            'atype':    GL_C3F_V3F,         # 混合数组类型
-            'vbo_vs':   vs_cube,            # 顶点vbo
-            'n_vs':     len(vs_cube),       # 顶点数量
-            'vbo_idx':  idx_cube,           # 索引vbo
-            'n_idx':    indices_cube.size   # 索引长度
+            'geometry': cube                # 几何体
         })
 
+        # 顶点格式相同的模型合并到一个VBO和一个索引VBO中，在VAO中记录顶点数组布局
+        self.batches = batching.merge(self.models, vao=self.use_vao)
+
+        # 计算各模型的包围盒并组织为BVH，每帧只绘制与视椎体相交的模型
+        self.culler = culling.Culler(self.models, self.graph)
+
     def draw(self):
         """绘制模型。可在派生类中重写此方法"""
 
-        for m in self.models:
-            m['vbo_vs'].bind() # 绑定当前顶点VBO
-            glInterleavedArrays(m['atype'], 0, None) # 根据数组类型分离顶点混合数组
-            if m['vbo_idx']: # 如果存在索引VBO
-                m['vbo_idx'].bind() # 帮顶当前索引VBO
-                glDrawElements(m['gltype'], m['n_idx'], GL_UNSIGNED_INT, None)
-                m['vbo_idx'].unbind() # 解绑当前索引VBO
-            else:
-                glDrawArrays(m['gltype'], 0, m['n_vs'])
-            m['vbo_vs'].unbind() # 解绑当前顶点VBO
+        self.culler.update(culling.current_vpmat()) # 剔除视椎体外的模型
+        for batch in self.batches:
+            batch.draw(self.culler.select(batch.members)) # 绑定VAO，每种图元类型调用一次绘制函数
 
 if __name__ == '__main__':
     app = App(hax='y', azim=-30, elev=10)
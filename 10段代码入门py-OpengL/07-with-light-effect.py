@@ -25,6 +25,9 @@ class App(BaseScene):
         glLightfv(GL_LIGHT1, GL_SPECULAR, (0.2,0.2,0.2,1.0))                # 光源中的反射光
         glLightfv(GL_LIGHT1, GL_POSITION, (-2.0,20.0,-1.0,1.0))             # 光源位置
 
+        self.sphere = self.graph.add().translate(-1, 0, 0)                  # 球的节点
+        self.cube = self.graph.add().translate(1, 0, 0)                     # 六面体的节点
+
     def draw(self):
         """绘制模型。可在派生类中重写此方法"""
 
@@ -32,8 +35,8 @@ class App(BaseScene):
         glEnable(GL_LIGHTING) # 启用光照
         glEnable(GL_LIGHT0) # 开启的灯光0：光线偏绿色，从下向上照射
         glPushMatrix() # 保存当前矩阵
-        glTranslate(-1, 0, 0) # 平移
-        glutSolidSphere(1, 180, 90) # 绘制球
+        glMultMatrixf(self.sphere.world) # 乘以节点的世界矩阵
+        self.replay('sphere', lambda: glutSolidSphere(1, 180, 90)) # 绘制球
         glPopMatrix() # 恢复保存的矩阵
         glPopAttrib() # 恢复当前全部环境设置
 
@@ -41,8 +44,8 @@ class App(BaseScene):
         glEnable(GL_LIGHTING) # 启用光照
         glEnable(GL_LIGHT1) # 开启的灯光1：稍暗淡，从上向下照射
         glPushMatrix() # 保存当前矩阵
-        glTranslate(1, 0, 0) # 平移
-        glutSolidCube(1) # 绘制六面体
+        glMultMatrixf(self.cube.world) # 乘以节点的世界矩阵
+        self.replay('cube', lambda: glutSolidCube(1)) # 绘制六面体
         glPopMatrix() # 恢复保存的矩阵
         glPopAttrib() # 恢复当前全部环境设置
 
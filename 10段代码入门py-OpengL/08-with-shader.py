@@ -4,7 +4,7 @@ import numpy as np
 from OpenGL.GL import *
 from OpenGL.GLUT import *
 from OpenGL.arrays import vbo
-from OpenGL.GL import shaders
+import shadercache
 
 PROGRAM = None
 VERTICES = None
@@ -36,9 +36,7 @@ def prepare():
         } 
     """
 
-    vshader = shaders.compileShader(vshader_src, GL_VERTEX_SHADER)
-    fshader = shaders.compileShader(fshader_src, GL_FRAGMENT_SHADER)
-    PROGRAM = shaders.compileProgram(vshader, fshader)
+    PROGRAM = shadercache.compile_program(vshader_src, fshader_src)
     VERTICES = vbo.VBO(np.array([[0, 1, 0], [-1, -1, 0], [1, -1, 0]], dtype=np.float32))
     COLORS = vbo.VBO(np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float32))
 
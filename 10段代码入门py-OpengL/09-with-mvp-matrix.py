@@ -1,12 +1,13 @@
 """着色器中的MVP矩阵"""
 
 import numpy as np
-from PIL import Image
 from OpenGL.GL import *
 from OpenGL.GLUT import *
 from OpenGL.arrays import vbo
-from OpenGL.GL import shaders
+import shadercache
 from  baseScene import BaseScene
+import meshes
+import meshopt
 
 class Scene(BaseScene):
     """由BaseScene派生的三维场景类"""
@@ -58,31 +59,6 @@ class Scene(BaseScene):
             [0, 0, -2 * self.near * self.far * rd, 0]
         ], dtype=np.float32)
 
-    def create_texture_2d(self, texture_file):
-        """创建纹理对象"""
-
-        im = np.array(Image.open(texture_file))
-        im_h, im_w = im.shape[:2]
-        im_mode = GL_LUMINANCE if im.ndim == 2 else (GL_RGB, GL_RGBA)[im.shape[-1]-3]
-
-        tid = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, tid)
-
-        if (im.size/im_h)%4 == 0:
-            glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
-        else:
-            glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
-        
-        glTexImage2D(GL_TEXTURE_2D, 0, im_mode, im_w, im_h, 0, im_mode, GL_UNSIGNED_BYTE, im)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-        glGenerateMipmap(GL_TEXTURE_2D)
-        glBindTexture(GL_TEXTURE_2D, 0)
-
-        return tid
-
     def prepare(self):
         """准备模型数据"""
     
@@ -113,33 +89,16 @@ class Scene(BaseScene):
             } 
         """
 
-        vs = np.array([
-            [-1,  1,  1], [ 1,  1,  1], [ 1, -1,  1], [-1, -1,  1], 
-            [-1,  1, -1], [ 1,  1, -1], [ 1, -1, -1], [-1, -1, -1]
-        ], dtype=np.float32)
-
-        indices = np.array([
-            0, 3, 2, 1, # v0-v1-v2-v3 (front)
-            4, 0, 1, 5, # v4-v5-v1-v0 (top)
-            3, 7, 6, 2, # v3-v2-v6-v7 (bottom)
-            7, 4, 5, 6, # v5-v4-v7-v6 (back)
-            1, 2, 6, 5, # v1-v5-v6-v2 (right)
-            4, 7, 3, 0  # v4-v0-v3-v7 (left)
-        ], dtype=np.int32)
-
-        vertices = vs[indices]
+        mesh = meshes.cube(size=2)
 
-        texcoord = np.array([
-            [0,0], [0,1], [1,1], [1,0], [0,0], [0,1], [1,1], [1,0], [0,0], [0,1], [1,1], [1,0],   
-            [0,0], [0,1], [1,1], [1,0], [0,0], [0,1], [1,1], [1,0], [0,0], [0,1], [1,1], [1,0]
-        ], dtype=np.float32)
-
-        vshader = shaders.compileShader(vshader_src, GL_VERTEX_SHADER)
-        fshader = shaders.compileShader(fshader_src, GL_FRAGMENT_SHADER)
-        self.program = shaders.compileProgram(vshader, fshader)
+        self.program = shadercache.compile_program(vshader_src, fshader_src)
 
-        self.vertices = vbo.VBO(vertices)
-        self.texcoord = vbo.VBO(texcoord)
+        self.vertices = vbo.VBO(mesh['vertices'])
+        self.texcoord = vbo.VBO(mesh['texcoords'])
+        indices = meshopt.downcast(mesh['indices'])                 # 顶点数不超过0xFFFF时使用16位索引
+        self.indices = vbo.VBO(indices, target=GL_ELEMENT_ARRAY_BUFFER)
+        self.index_type = GL_UNSIGNED_SHORT if indices.itemsize == 2 else GL_UNSIGNED_INT
+        self.n = len(indices)
         self.texture = self.create_texture_2d('res/flower.jpg')
  
     def draw(self):
@@ -169,16 +128,19 @@ class Scene(BaseScene):
         glUniformMatrix4fv(loc, 1, GL_FALSE, self.mmat, None)
  
         loc = glGetUniformLocation(self.program, 'u_Texture')
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.texture)
+        self.texture.bind(0)
         glUniform1i(loc, 0)
 
-        glDrawArrays(GL_QUADS, 0, 24)
+        self.indices.bind()
+        glDrawElements(GL_TRIANGLES, self.n, self.index_type, None)
+        self.indices.unbind()
+
         glUseProgram(0)
 
     def render(self):
         """重绘事件函数"""
 
+        self.update_textures() # 上传后台解码完成的纹理
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT) # 清除屏幕及深度缓存
         self.draw() # 绘制模型
         glutSwapBuffers() # 交换缓冲区
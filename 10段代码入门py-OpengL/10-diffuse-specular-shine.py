@@ -3,9 +3,10 @@
 import numpy as np
 from OpenGL.GL import *
 from OpenGL.GLUT import *
-from OpenGL.arrays import vbo
-from OpenGL.GL import shaders
 from scene import Scene
+import meshes
+import lod
+from program import ShaderProgram
 
 class App(Scene):
     """由BaseScene派生的3D应用程序类"""
@@ -76,56 +77,19 @@ class App(Scene):
             } 
         """
 
-        # 生成地球的顶点，东西方向和南北方向精度为2°
-        rows, cols, r = 90, 180, 1
-        gv, gu = np.mgrid[0.5*np.pi:-0.5*np.pi:complex(0,rows), 0:2*np.pi:complex(0,cols)]
-        xs = r * np.cos(gv)*np.cos(gu)
-        ys = r * np.cos(gv)*np.sin(gu)
-        zs = r * np.sin(gv)
-        vs = np.dstack((xs, ys, zs)).reshape(-1, 3)
-        vs = np.float32(vs)
-
-        # 生成三角面的索引
-        idx = np.arange(rows*cols).reshape(rows, cols)
-        idx_a, idx_b, idx_c, idx_d = idx[:-1,:-1], idx[1:,:-1], idx[:-1, 1:], idx[1:,1:]
-        indices = np.int32(np.dstack((idx_a, idx_b, idx_c, idx_c, idx_b, idx_d)).ravel())
-
-        # 生成法向量
-        primitive = vs[indices]
-        a = primitive[::3]
-        b = primitive[1::3]
-        c = primitive[2::3]
-        normal = np.repeat(np.cross(b-a, c-a), 3, axis=0)
-
-        idx_arg = np.argsort(indices)
-        rise = np.where(np.diff(indices[idx_arg])==1)[0]+1
-        rise = np.hstack((0, rise, len(indices)))
- 
-        tmp = np.zeros((rows*cols, 3), dtype=np.float32)
-        for i in range(rows*cols):
-            tmp[i] = np.sum(normal[idx_arg[rise[i]:rise[i+1]]], axis=0)
-
-        normal = tmp.reshape(rows,cols,-1)
-        normal[:,0] += normal[:,-1]
-        normal[:,-1] = normal[:,0]
-        normal[0] = normal[0,0]
-        normal[-1] = normal[-1,0]
-    
-        # 生成纹理坐标
-        u, v = np.linspace(0, 1, cols), np.linspace(0, 1, rows)
-        texcoord = np.float32(np.dstack(np.meshgrid(u, v)).reshape(-1, 2))
-        
         # 生成着色器程序
-        vshader = shaders.compileShader(vshader_src, GL_VERTEX_SHADER)
-        fshader = shaders.compileShader(fshader_src, GL_FRAGMENT_SHADER)
-        self.program = shaders.compileProgram(vshader, fshader)
-
-        # 创建VBO和纹理对象
-        self.vertices = vbo.VBO(vs)
-        self.normal = vbo.VBO(normal)
-        self.texcoord = vbo.VBO(texcoord)
-        self.indices = vbo.VBO(indices, target=GL_ELEMENT_ARRAY_BUFFER)
-        self.n = len(indices)
+        self.program = ShaderProgram(vshader_src, fshader_src)
+
+        # 生成地球的4种分辨率（最精细的一层东西方向和南北方向精度为2°，三角形和顶点按顶点缓存重排，结果缓存在磁盘上），共享一组VBO
+        # 顶点属性量化后交错存放在一个VBO中：half顶点坐标、10位法向量和16位纹理坐标，每个顶点16字节
+        self.earth = lod.LodMesh(meshes.sphere,
+            [{'rows':12, 'cols':24}, {'rows':23, 'cols':45}, {'rows':46, 'cols':90}, {'rows':90, 'cols':180}],
+            self.program, {'a_Position':'vertices', 'a_Normal':'normals', 'a_Texcoord':'texcoords'}, vao=self.use_vao, r=1, optimize=True,
+            formats='auto')
+        self.geometry = self.earth.geometry
+        self.level = None                                           # 当前细节层次
+
+        # 创建纹理对象
         # self.texture = self.create_texture_2d('res/earth.jpg')
         self.texture = self.create_texture_2d('res/earth2.jpg')
         # self.texture = self.create_texture_2d('res/earth.png')
@@ -143,73 +107,34 @@ class App(Scene):
     def draw(self):
         """绘制模型。可在派生类中重写此方法"""
 
-        glUseProgram(self.program)
-    
-        loc = glGetAttribLocation(self.program, 'a_Position')
-        self.vertices.bind()
-        glVertexAttribPointer(loc, 3, GL_FLOAT, GL_FALSE, 3*4, self.vertices)
-        glEnableVertexAttribArray(loc)
-        self.vertices.unbind()
-     
-        loc = glGetAttribLocation(self.program, 'a_Normal')
-        self.normal.bind()
-        glVertexAttribPointer(loc, 3, GL_FLOAT, GL_FALSE, 3*4, self.normal)
-        glEnableVertexAttribArray(loc)
-        self.normal.unbind()
-
-        loc = glGetAttribLocation(self.program, 'a_Texcoord')
-        self.texcoord.bind()
-        glVertexAttribPointer(loc, 2, GL_FLOAT, GL_FALSE, 2*4, self.texcoord)
-        glEnableVertexAttribArray(loc)
-        self.texcoord.unbind()
-
-        loc = glGetUniformLocation(self.program, 'u_ProjMatrix')
-        glUniformMatrix4fv(loc, 1, GL_FALSE, self.get_pmat(), None)
-
-        loc = glGetUniformLocation(self.program, 'u_ViewMatrix')
-        glUniformMatrix4fv(loc, 1, GL_FALSE, self.get_vmat(), None)
-
-        loc = glGetUniformLocation(self.program, 'u_ModelMatrix')
-        glUniformMatrix4fv(loc, 1, GL_FALSE, self.mmat, None)
-
-        loc = glGetUniformLocation(self.program, 'u_CamPos')
-        glUniform3f(loc, *self.cam)
-
-        loc = glGetUniformLocation(self.program, 'u_Texture')
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.texture)
-        glUniform1i(loc, 0)
-
-        loc = glGetUniformLocation(self.program, 'u_LightDir')
-        glUniform3f(loc, *self.light_dir)
-
-        loc = glGetUniformLocation(self.program, 'u_LightColor')
-        glUniform3f(loc, *self.light_color)
-
-        loc = glGetUniformLocation(self.program, 'u_AmbientColor')
-        glUniform3f(loc, *self.ambient)
-
-        loc = glGetUniformLocation(self.program, 'u_Shiny')
-        glUniform1f(loc, self.shiny)
-
-        loc = glGetUniformLocation(self.program, 'u_Specular')
-        glUniform1f(loc, self.specular)
+        self.program.use()
 
-        loc = glGetUniformLocation(self.program, 'u_Diffuse')
-        glUniform1f(loc, self.diffuse)
+        self.program['u_ProjMatrix'] = self.get_pmat()
+        self.program['u_ViewMatrix'] = self.get_vmat()
+        self.program['u_ModelMatrix'] = self.node.world
+        self.program['u_CamPos'] = self.cam
 
-        loc = glGetUniformLocation(self.program, 'u_Pellucid')
-        glUniform1f(loc, self.pellucid)
+        self.texture.bind(0)
+        self.program['u_Texture'] = 0
 
-        self.indices.bind()
-        glDrawElements(GL_TRIANGLES, self.n, GL_UNSIGNED_INT, None)
-        self.indices.unbind()
+        self.program['u_LightDir'] = self.light_dir
+        self.program['u_LightColor'] = self.light_color
+        self.program['u_AmbientColor'] = self.ambient
+        self.program['u_Shiny'] = self.shiny
+        self.program['u_Specular'] = self.specular
+        self.program['u_Diffuse'] = self.diffuse
+        self.program['u_Pellucid'] = self.pellucid
 
-        glUseProgram(0)
+        # 按地球在屏幕上的投影直径选择细节层次
+        size = lod.screen_size(self.node.world[3, :3], self.earth.radius, self.get_vmat(), self.get_pmat(), self.csize[0])
+        self.level = self.earth.select(size, self.level)
+        self.earth.draw(self.level)
+        self.program.unuse()
 
     def render(self):
         """重绘事件函数"""
 
+        self.update_textures() # 上传后台解码完成的纹理
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT) # 清除屏幕及深度缓存
         self.draw() # 绘制模型
         glutSwapBuffers() # 交换缓冲区
@@ -1,35 +1,67 @@
 
 """深度缓冲区和深度测试"""
 
-import numpy as np
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from OpenGL.GLUT import *
+from camera import Camera
+import textures
+import recorder
+from scenegraph import SceneGraph
+from scheduler import FrameScheduler
+
+def _camera_attr(name, doc, readonly=False):
+    """返回转发到self.camera同名属性的特性"""
+
+    getter = lambda self: getattr(self.camera, name)
+    setter = None if readonly else lambda self, value: setattr(self.camera, name, value)
+
+    return property(getter, setter, doc=doc)
 
 class BaseScene:
     """基于OpenGl.GLUT的三维场景类"""
 
+    haxis = _camera_attr('haxis', '高度轴')
+    oecs = _camera_attr('oecs', '视点坐标系ECS原点')
+    near = _camera_attr('near', '相机与视椎体前端面的距离')
+    far = _camera_attr('far', '相机与视椎体后端面的距离')
+    fovy = _camera_attr('fovy', '相机水平视野角度')
+    dist = _camera_attr('dist', '相机与ECS原点的距离')
+    azim = _camera_attr('azim', '方位角')
+    elev = _camera_attr('elev', '高度角')
+    aspect = _camera_attr('aspect', '画布宽高比')
+    cam = _camera_attr('cam', '相机位置', readonly=True)
+    up = _camera_attr('up', '指向相机上方的单位向量', readonly=True)
+
     def __init__(self, **kwds):
         """构造函数"""
 
         self.csize = kwds.get('size', (960, 640))       # 画布分辨率
         self.bg = kwds.get('bg', [0.0, 0.0, 0.0])       # 背景色
-        self.haxis = kwds.get('haxis', 'y').lower()     # 高度轴
-        self.oecs = kwds.get('oecs', [0.0, 0.0, 0.0])   # 视点坐标系ECS原点
-        self.near = kwds.get('near', 2.0)               # 相机与视椎体前端面的距离
-        self.far = kwds.get('far', 1000.0)              # 相机与视椎体后端面的距离
-        self.fovy = kwds.get('fovy', 40.0)              # 相机水平视野角度
-        self.dist = kwds.get('dist', 5.0)               # 相机与ECS原点的距离
-        self.azim = kwds.get('azim', 0.0)               # 方位角
-        self.elev = kwds.get('elev', 0.0)               # 高度角
- 
-        self.aspect = self.csize[0]/self.csize[1]       # 画布宽高比
-        self.cam = None                                 # 相机位置
-        self.up = None                                  # 指向相机上方的单位向量
-        self._update_cam_and_up()                       # 计算相机位置和指向相机上方的单位向量
+        self.use_vao = kwds.get('vao', True)            # 几何体是否使用VAO，False时每帧重新设置顶点属性
+        self.async_textures = kwds.get('async_textures', True)  # 是否在后台线程中解码纹理图像
+        self.record = kwds.get('record', 'vbo')         # 立即模式绘制的录制方式：'vbo'、'list'（显示列表）或None（不录制）
+        self.recordings = dict()                        # replay()的录制缓存：键 -> recorder.Recording
+        self.graph = SceneGraph()                       # 场景图，节点的世界矩阵保存在连续数组中
+        self.scheduler = FrameScheduler(lambda: glutPostRedisplay(), kwds.get('fps', 60.0))  # 帧调度器：合并重绘请求，fps为帧率上限，0表示由垂直同步限制
+
+        # 相机：参数改变时才重新计算相机位置和视点、投影矩阵，BaseScene的同名属性均转发到相机
+        self.camera = Camera(
+            haxis = kwds.get('haxis', 'y'),             # 高度轴
+            oecs = kwds.get('oecs', [0.0, 0.0, 0.0]),   # 视点坐标系ECS原点
+            near = kwds.get('near', 2.0),               # 相机与视椎体前端面的距离
+            far = kwds.get('far', 1000.0),              # 相机与视椎体后端面的距离
+            fovy = kwds.get('fovy', 40.0),              # 相机水平视野角度
+            dist = kwds.get('dist', 5.0),               # 相机与ECS原点的距离
+            azim = kwds.get('azim', 0.0),               # 方位角
+            elev = kwds.get('elev', 0.0),               # 高度角
+            aspect = self.csize[0]/self.csize[1]        # 画布宽高比
+        )
 
         self.left_down = False                          # 左键按下
         self.mouse_pos = (0, 0)                         # 鼠标位置
+        self.pending_drag = [0, 0]                      # 两帧之间累加的拖拽位移（像素）
+        self.pending_wheel = [0, 0]                     # 两帧之间累加的滚轮前滚、后滚次数
 
         # 保存相机初始姿态（视野、方位角、高度角和距离）
         self.home = {'fovy':self.fovy, 'azim':self.azim, 'elev':self.elev, 'dist':self.dist}
@@ -37,29 +69,7 @@ class BaseScene:
     def _update_cam_and_up(self, oecs=None, dist=None, azim=None, elev=None):
         """根据当前ECS原点位置、距离、方位角、仰角等参数，重新计算相机位置和up向量"""
 
-        if not oecs is None:
-            self.oecs = [*oecs,]
- 
-        if not dist is None:
-            self.dist = dist
- 
-        if not azim is None:
-            self.azim = (azim+180)%360 - 180
- 
-        if not elev is None:
-            self.elev = (elev+180)%360 - 180
- 
-        up = 1.0 if -90 <= self.elev <= 90 else -1.0
-        azim, elev  = np.radians(self.azim), np.radians(self.elev)
-        d = self.dist * np.cos(elev)
-
-        if self.haxis == 'z':
-            azim -= 0.5 * np.pi
-            self.cam = [d*np.cos(azim)+self.oecs[0], d*np.sin(azim)+self.oecs[1], self.dist*np.sin(elev)+self.oecs[2]]
-            self.up = [0.0, 0.0, up]
-        else:
-            self.cam = [d*np.sin(azim)+self.oecs[0], self.dist*np.sin(elev)+self.oecs[1], d*np.cos(azim)+self.oecs[2]]
-            self.up = [0.0, up, 0.0]
+        self.camera.update(oecs=oecs, dist=dist, azim=azim, elev=elev)
 
     def reshape(self, w, h):
         """改变窗口大小事件函数"""
@@ -68,7 +78,7 @@ class BaseScene:
         self.aspect = self.csize[0]/self.csize[1] if self.csize[1] > 0 else 1e4
         glViewport(0, 0, self.csize[0], self.csize[1])
  
-        glutPostRedisplay()
+        self.request_redraw()
 
     def click(self, btn, state, x, y):
         """鼠标按键和滚轮事件函数"""
@@ -80,35 +90,90 @@ class BaseScene:
             else: # 弹起
                 self.left_down = False 
         elif btn == 2 and state ==1: # 右键弹起，恢复相机初始姿态
+            self.pending_drag, self.pending_wheel = [0, 0], [0, 0]
             self._update_cam_and_up(dist=self.home['dist'], azim=self.home['azim'], elev=self.home['elev'])
             self.fovy = self.home['fovy']
         elif btn == 3 and state == 0: # 滚轮前滚
-            self.fovy *= 0.95
+            self.pending_wheel[0] += 1
         elif btn == 4 and state == 0: # 滚轮后滚
-            self.fovy += (180 - self.fovy) / 180
+            self.pending_wheel[1] += 1
         
-        glutPostRedisplay()
+        self.request_redraw()
 
     def drag(self, x, y):
-        """鼠标拖拽事件函数"""
+        """鼠标拖拽事件函数：只累加位移，下一帧开始时由apply_input()一次性更新相机"""
         
-        dx, dy = x - self.mouse_pos[0], y - self.mouse_pos[1]
+        self.pending_drag[0] += x - self.mouse_pos[0]
+        self.pending_drag[1] += y - self.mouse_pos[1]
         self.mouse_pos = (x, y)
-
-        azim = self.azim - (180*dx/self.csize[0]) * (self.up[2] if self.haxis == 'z' else self.up[1])
-        elev = self.elev + 90*dy/self.csize[1]
-        self._update_cam_and_up(azim=azim, elev=elev)
         
-        glutPostRedisplay()
+        self.request_redraw()
+
+    def apply_input(self):
+        """每帧开始时调用：将两帧之间累加的拖拽位移和滚轮次数一次性应用到相机"""
+
+        dx, dy = self.pending_drag
+        if dx or dy:
+            azim = self.azim - (180*dx/self.csize[0]) * (self.up[2] if self.haxis == 'z' else self.up[1])
+            elev = self.elev + 90*dy/self.csize[1]
+            self._update_cam_and_up(azim=azim, elev=elev)
+
+        forward, backward = self.pending_wheel
+        if forward: # 每次前滚视野缩小5%
+            self.fovy *= 0.95 ** forward
+        if backward: # 每次后滚视野向180度增大1/180
+            self.fovy = 180 - (180 - self.fovy) * (179/180) ** backward
+
+        self.pending_drag, self.pending_wheel = [0, 0], [0, 0]
+
+    def request_redraw(self):
+        """请求重绘，由帧调度器合并两帧之间的多次请求并限制帧率"""
+
+        self.scheduler.request()
+
+    def create_texture_2d(self, texture_file, **kwds):
+        """创建纹理对象，返回textures.Texture。由共享的纹理管理器去重，重复加载同一文件时不再解码和上传"""
+
+        kwds.setdefault('asynchronous', self.async_textures)
+        return textures.load(texture_file, **kwds)
+
+    def update_textures(self):
+        """每帧开始时调用：上传后台解码完成的纹理，仍有纹理未就绪时请求下一帧重绘"""
+
+        texmgr = textures.manager()
+        if texmgr.loading:
+            texmgr.update()
+            if texmgr.loading:
+                self.request_redraw()
 
     def prepare(self):
         """GL初始化后、开始绘制前的预处理。可在派生类中重写此方法"""
 
         pass
 
+    def replay(self, key, func, *args):
+        """首次调用时录制func(*args)中的立即模式绘制，此后以录制的VBO或显示列表重放"""
+
+        if self.record is None:
+            func(*args)
+            return
+
+        rec = self.recordings.get(key)
+        if rec is None:
+            rec = recorder.Recording(self.record, vao=self.use_vao)
+            rec.record(func, *args)                             # 录制失败时不保存，下一帧重新录制
+            self.recordings[key] = rec
+        else:
+            rec.draw()
+
     def draw(self):
         """绘制模型。可在派生类中重写此方法"""
 
+        self.replay('triangles', self._draw_triangles)
+
+    def _draw_triangles(self):
+        """以立即模式绘制两个三角形"""
+
         glBegin(GL_TRIANGLES)                   # 开始绘制三角形
         glColor(1.0, 0.0, 0.0)                  # 设置当前颜色为红色
         glVertex(0.0, 1.0, 0.5)                 # 设置顶点
@@ -130,6 +195,9 @@ class BaseScene:
     def render(self):
         """重绘事件函数"""
 
+        # 上传后台解码完成的纹理
+        self.update_textures()
+
         # 清除屏幕及深度缓存
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
@@ -151,6 +219,20 @@ class BaseScene:
         # 交换缓冲区
         glutSwapBuffers()
 
+    def display(self):
+        """GLUT重绘事件函数：应用累加的输入后调用render()，并由帧调度器记录帧时间"""
+
+        self.scheduler.begin_frame()
+        self.apply_input()
+        self.render()
+        self.scheduler.end_frame()
+
+    def render_offscreen(self, n_frames=1, size=None, **kwds):
+        """不创建窗口，在离屏上下文中渲染n_frames帧，返回shape=(n_frames,高,宽,3)的uint8数组，参数见offscreen.render"""
+
+        import offscreen
+        return offscreen.render(self, n_frames, size, **kwds)
+
     def show(self):
         """显示"""
 
@@ -170,7 +252,9 @@ class BaseScene:
 
         self.prepare() # GL初始化后、开始绘制前的预处理
 
-        glutDisplayFunc(self.render) # 绑定重绘事件函数
+        self.scheduler.start(glutTimerFunc) # 此后过早的重绘请求由定时器推迟到下一个帧间隔
+
+        glutDisplayFunc(self.display) # 绑定重绘事件函数
         glutReshapeFunc(self.reshape) # 绑定窗口大小改变事件函数
         glutMouseFunc(self.click) # 绑定鼠标按键和滚轮事件函数
         glutMotionFunc(self.drag) # 绑定鼠标拖拽事件函数
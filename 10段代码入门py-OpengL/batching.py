@@ -0,0 +1,237 @@
+"""静态批处理：将顶点格式相同的静态模型合并到一个VBO和一个索引VBO中
+
+merge(models)按顶点格式（固定管线混合数组类型，或着色器属性的位置和分量数）对模型分组，
+每组生成一个StaticBatch：各模型的顶点依次拼接为一个混合VBO，索引加上所在模型的顶点偏移
+后拼接为一个索引VBO。模型按纹理和图元类型稳定排序，使同一组的索引连续，draw()对每个
+（纹理, 图元类型）组合只绑定一次纹理、调用一次glDrawElements，每帧的缓冲区切换次数和
+Python循环次数与模型数量无关。draw(visible)只绘制部分模型时，每组以一次
+glMultiDrawElements绘制其中可见模型的索引范围。
+
+模型是与demo中self.models相同的字典：'geometry'为尚未调用prepare()的Geometry对象（合并
+后不再需要单独的VAO），可选的'texture'和'ttype'为纹理对象和纹理类型。
+"""
+
+import time
+import ctypes
+import numpy as np
+from OpenGL.GL import *
+from geometry import Geometry
+
+def vertex_format(geometry):
+    """返回几何体的顶点格式，格式相同的几何体才能合并"""
+
+    if geometry.interleaved:
+        return ('interleaved', geometry.interleaved[1])
+
+    return ('attribs',) + tuple((loc, size) for loc, buf, size, dtype, normalized, stride, offset, divisor in geometry.attribs)
+
+def _vertices(geometry):
+    """返回几何体的顶点数组，着色器属性按属性顺序拼接为一个float32混合数组"""
+
+    if geometry.interleaved:
+        return geometry.interleaved[0].data.reshape(len(geometry.interleaved[0].data), -1)
+
+    columns = list()
+    for loc, buf, size, dtype, normalized, stride, offset, divisor in geometry.attribs:
+        if dtype != GL_FLOAT or divisor or offset or buf.data.ndim != 2:
+            raise ValueError('只能合并以独立float32数组提供的逐顶点属性')
+        columns.append(np.asarray(buf.data, dtype=np.float32))
+
+    return np.hstack(columns)
+
+def _indices(geometry, n):
+    """返回几何体的索引数组，没有索引的几何体生成顺序索引"""
+
+    if geometry.indices is None:
+        return np.arange(n, dtype=np.uint32)
+
+    return np.asarray(geometry.indices.data, dtype=np.uint32).ravel()
+
+class StaticBatch:
+    """顶点格式相同的一批静态模型"""
+
+    def __init__(self, models, program=None, vao=True):
+        """构造函数
+
+        models      - 模型字典列表，顶点格式须相同
+        program     - ShaderProgram对象，模型使用着色器属性时用于设置属性位置
+        vao         - 是否使用VAO
+        """
+
+        key = lambda m: (id(m.get('texture')), m['geometry'].gltype)
+        order = sorted(range(len(models)), key=lambda i: key(models[i]))   # 稳定排序，同组模型保持原有顺序
+        first = models[order[0]]['geometry']
+
+        vertices, indices, base = list(), list(), 0
+        for i in order:
+            v = _vertices(models[i]['geometry'])
+            vertices.append(v)
+            indices.append(_indices(models[i]['geometry'], len(v)) + base)  # 索引加上该模型的顶点偏移
+            base += len(v)
+        counts = {i:len(item) for i, item in zip(order, indices)}
+
+        vertices = np.vstack(vertices).astype(np.float32)
+        indices = np.concatenate(indices)
+        if base <= 0xFFFF:
+            indices = indices.astype(np.uint16)
+
+        self.geometry = Geometry(first.gltype, program, vao=vao)
+        if first.interleaved:
+            self.geometry.interleave(vertices, first.interleaved[1])
+        else:
+            vbo_ = self.geometry.attrib(first.attribs[0][0], vertices, first.attribs[0][2], stride=vertices.strides[0])
+            column = first.attribs[0][2]
+            for loc, buf, size, dtype, normalized, stride, offset, divisor in first.attribs[1:]:
+                self.geometry.attrib(loc, vbo_, size, stride=vertices.strides[0], offset=column*4)
+                column += size
+        self.geometry.elements(indices)
+        self.geometry.prepare()
+
+        # 每个模型在索引VBO中的范围，按原模型顺序：(组序号, 字节偏移量, 索引数)
+        self.ranges = [None] * len(models)
+        # 每组：(纹理, 纹理类型, 图元类型, 字节偏移量, 索引数)
+        self.groups = list()
+        offset = 0
+        for i in order:
+            m = models[i]
+            group = (m.get('texture'), m.get('ttype', GL_TEXTURE_2D), m['geometry'].gltype)
+            if not self.groups or self.groups[-1][:3] != group:
+                self.groups.append(group + (offset*indices.itemsize, 0))
+            self.groups[-1] = self.groups[-1][:4] + (self.groups[-1][4] + counts[i],)
+            self.ranges[i] = (len(self.groups)-1, offset*indices.itemsize, counts[i])
+            offset += counts[i]
+
+        self.vertex_count = base                                # 顶点总数
+        self.members = np.arange(len(models))                   # 各模型在场景模型列表中的序号，由merge()设置
+        self.index_count = indices.size                         # 索引总数
+
+    def _bind_texture(self, group):
+        """绑定组的纹理"""
+
+        if group[0] is not None:
+            group[0].bind()
+
+    def _unbind_texture(self, group):
+        """解绑组的纹理"""
+
+        if group[0] is not None:
+            glBindTexture(group[1], 0)
+
+    def draw(self, visible=None):
+        """绘制全部模型，或只绘制visible（模型序号的可迭代对象）中的模型"""
+
+        geometry = self.geometry
+        geometry.bind()
+
+        if visible is None:
+            for group in self.groups:
+                self._bind_texture(group)
+                glDrawElements(group[2], group[4], geometry.index_type, ctypes.c_void_p(group[3]))
+                self._unbind_texture(group)
+        else:
+            ranges = dict()
+            for i in visible:
+                ranges.setdefault(self.ranges[i][0], list()).append(self.ranges[i][1:])
+            for g, items in sorted(ranges.items()):
+                group = self.groups[g]
+                items = np.array(items, dtype=np.uintp)
+                self._bind_texture(group)
+                glMultiDrawElements(group[2], items[:, 1].astype(np.int32), geometry.index_type, items[:, 0], len(items))
+                self._unbind_texture(group)
+
+        geometry.unbind()
+
+    def delete(self):
+        """删除VAO和VBO"""
+
+        self.geometry.delete()
+
+def merge(models, program=None, vao=True):
+    """按顶点格式将模型合并为若干StaticBatch，返回列表"""
+
+    formats = dict()
+    for i, m in enumerate(models):
+        formats.setdefault(vertex_format(m['geometry']), list()).append(i)
+
+    batches = list()
+    for members in formats.values():
+        batch = StaticBatch([models[i] for i in members], program, vao)
+        batch.members = np.array(members)
+        batches.append(batch)
+
+    return batches
+
+def benchmark(counts=(10, 100, 1000), frames=50):
+    """对比逐模型绘制和合并后绘制n个六面体时每帧的GL调用数、缓冲区绑定次数和CPU耗时"""
+
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+    from OpenGL.arrays import vbo
+    import geometry as geometry_module
+    import gltrace
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(320, 240)
+    glutCreateWindow('Batching benchmark')
+    glutHideWindow()
+
+    corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float32)
+    quads = np.array([[0, 1, 3, 2], [4, 6, 7, 5], [0, 4, 5, 1], [2, 3, 7, 6], [0, 2, 6, 4], [1, 5, 7, 3]], dtype=np.int32)
+    rng = np.random.default_rng(0)
+
+    def make_models(n):
+        models = list()
+        for i in range(n):
+            vertices = np.hstack((rng.uniform(0, 1, (8, 3)), corners*0.02 + rng.uniform(-0.9, 0.9, 3))).astype(np.float32)
+            geom = Geometry(GL_QUADS)
+            geom.interleave(vertices, GL_C3F_V3F)
+            geom.elements(quads)
+            models.append({'geometry':geom})
+        return models
+
+    def run(draw):
+        tracer = gltrace.Tracer()
+        tracer.install([vars(geometry_module), globals(), vars(vbo.get_implementation())])
+        tracer.begin_frame()
+        draw()
+        tracer.end_frame()
+        tracer.uninstall()
+        calls = sum(item[0] for item in tracer.frames[0].values())
+        binds = sum(tracer.frames[0].get(name, [0])[0] for name in ('glBindBuffer', 'glBindVertexArray'))
+
+        t = list()
+        for i in range(frames):
+            t0 = time.perf_counter()
+            draw()
+            t.append(time.perf_counter() - t0)
+        glFinish()
+
+        return calls, binds, np.median(t)
+
+    print('%8s %-8s %10s %12s %12s' % ('模型数', '方式', 'GL调用', '缓冲区绑定', 'CPU(ms)'))
+    for n in counts:
+        models = make_models(n)
+        for m in models:
+            m['geometry'].prepare()
+
+        def loop():
+            for m in models:
+                m['geometry'].draw()
+
+        batches = merge(make_models(n))
+        def batched():
+            for batch in batches:
+                batch.draw()
+
+        for name, draw in (('逐模型', loop), ('合并', batched)):
+            calls, binds, t = run(draw)
+            print('%8d %-8s %10d %12d %12.3f' % (n, name, calls, binds, t*1e3))
+
+        for m in models:
+            m['geometry'].delete()
+        for batch in batches:
+            batch.delete()
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,263 @@
+"""带脏标记的相机"""
+
+import math
+import time
+import struct
+import tracemalloc
+import numpy as np
+
+_VEC3 = struct.Struct('3f')
+_MAT4 = struct.Struct('16f')
+
+class Camera:
+    """相机
+
+    保存相机姿态（ECS原点、距离、方位角、高度角）和投影参数（视野、宽高比、前后端面距离）。
+    任一参数改变时只设置脏标记，读取相机位置、视点矩阵、投影矩阵或二者之积时才重新计算，
+    结果写入预先分配的float32数组，可直接传给glUniformMatrix4fv，每帧不再创建新数组。
+    矩阵按OpenGL列主序存储，与scene.Scene原来的get_vmat和get_pmat返回值布局相同。
+    """
+
+    _VIEW = ('haxis', 'oecs', 'dist', 'azim', 'elev')       # 影响视点矩阵的参数
+    _PROJ = ('fovy', 'aspect', 'near', 'far')               # 影响投影矩阵的参数
+
+    def __init__(self, **kwds):
+        """构造函数"""
+
+        self._oecs = np.zeros(3, dtype=np.float32)          # 视点坐标系ECS原点
+        self._cam = np.zeros(3, dtype=np.float32)           # 相机位置
+        self._up = np.zeros(3, dtype=np.float32)            # 指向相机上方的单位向量
+        self._vmat = np.eye(4, dtype=np.float32)            # 视点矩阵
+        self._pmat = np.eye(4, dtype=np.float32)            # 投影矩阵
+        self._vpmat = np.eye(4, dtype=np.float32)           # 视点矩阵和投影矩阵之积
+
+        self._view_dirty = True                             # 视点矩阵需要重新计算
+        self._proj_dirty = True                             # 投影矩阵需要重新计算
+        self._vp_dirty = True                               # 二者之积需要重新计算
+        self.version = 0                                    # 每次重新计算矩阵后加1
+
+        self.haxis = kwds.get('haxis', 'y').lower()         # 高度轴
+        self.oecs = kwds.get('oecs', [0.0, 0.0, 0.0])       # 视点坐标系ECS原点
+        self.dist = kwds.get('dist', 5.0)                   # 相机与ECS原点的距离
+        self.azim = kwds.get('azim', 0.0)                   # 方位角
+        self.elev = kwds.get('elev', 0.0)                   # 高度角
+        self.fovy = kwds.get('fovy', 40.0)                  # 相机水平视野角度
+        self.aspect = kwds.get('aspect', 1.5)               # 画布宽高比
+        self.near = kwds.get('near', 2.0)                   # 相机与视椎体前端面的距离
+        self.far = kwds.get('far', 1000.0)                  # 相机与视椎体后端面的距离
+
+    def __setattr__(self, name, value):
+        """修改相机参数时设置对应的脏标记"""
+
+        if name == 'oecs':
+            if not np.array_equal(self._oecs, value):
+                self._oecs[:] = value
+                self._view_dirty = self._vp_dirty = True
+            return
+
+        if name in Camera._VIEW or name in Camera._PROJ:
+            if self.__dict__.get(name) == value:
+                return
+            if name in Camera._VIEW:
+                self._view_dirty = True
+            else:
+                self._proj_dirty = True
+            self._vp_dirty = True
+
+        object.__setattr__(self, name, value)
+
+    @property
+    def oecs(self):
+        """视点坐标系ECS原点"""
+
+        return self._oecs
+
+    def update(self, oecs=None, dist=None, azim=None, elev=None):
+        """修改相机姿态，方位角和高度角规范到[-180, 180)区间"""
+
+        if not oecs is None:
+            self.oecs = oecs
+
+        if not dist is None:
+            self.dist = dist
+
+        if not azim is None:
+            self.azim = (azim+180)%360 - 180
+
+        if not elev is None:
+            self.elev = (elev+180)%360 - 180
+
+    def _update_view(self):
+        """重新计算相机位置、up向量和视点矩阵"""
+
+        up = 1.0 if -90 <= self.elev <= 90 else -1.0
+        azim, elev = math.radians(self.azim), math.radians(self.elev)
+        d = self.dist * math.cos(elev)
+        ox, oy, oz = _VEC3.unpack_from(self._oecs)
+
+        if self.haxis == 'z':
+            azim -= 0.5 * math.pi
+            camX, camY, camZ = d*math.cos(azim)+ox, d*math.sin(azim)+oy, self.dist*math.sin(elev)+oz
+            upX, upY, upZ = 0.0, 0.0, up
+        else:
+            camX, camY, camZ = d*math.sin(azim)+ox, self.dist*math.sin(elev)+oy, d*math.cos(azim)+oz
+            upX, upY, upZ = 0.0, up, 0.0
+
+        fX, fY, fZ = ox-camX, oy-camY, oz-camZ
+        n = math.sqrt(fX*fX + fY*fY + fZ*fZ) or 1.0
+        fX, fY, fZ = fX/n, fY/n, fZ/n
+
+        sX, sY, sZ = fY*upZ - fZ*upY, fZ*upX - fX*upZ, fX*upY - fY*upX
+        n = math.sqrt(sX*sX + sY*sY + sZ*sZ) or 1.0
+        sX, sY, sZ = sX/n, sY/n, sZ/n
+
+        uX, uY, uZ = sY*fZ - sZ*fY, sZ*fX - sX*fZ, sX*fY - sY*fX
+
+        # 直接写入预分配数组的内存，不产生临时数组
+        _VEC3.pack_into(self._cam, 0, camX, camY, camZ)
+        _VEC3.pack_into(self._up, 0, upX, upY, upZ)
+        _MAT4.pack_into(self._vmat, 0,
+            sX, uX, -fX, 0.0,
+            sY, uY, -fY, 0.0,
+            sZ, uZ, -fZ, 0.0,
+            -(sX*camX + sY*camY + sZ*camZ), -(uX*camX + uY*camY + uZ*camZ), fX*camX + fY*camY + fZ*camZ, 1.0
+        )
+
+        self._view_dirty = False
+        self.version += 1
+
+    def _update_proj(self):
+        """重新计算投影矩阵"""
+
+        right = math.tan(math.radians(self.fovy/2)) * self.near
+        left = -right
+        top = right/self.aspect
+        bottom = left/self.aspect
+        rw, rh, rd = 1/(right-left), 1/(top-bottom), 1/(self.far-self.near)
+
+        _MAT4.pack_into(self._pmat, 0,
+            2 * self.near * rw, 0.0, 0.0, 0.0,
+            0.0, 2 * self.near * rh, 0.0, 0.0,
+            (right+left) * rw, (top+bottom) * rh, -(self.far+self.near) * rd, -1.0,
+            0.0, 0.0, -2 * self.near * self.far * rd, 0.0
+        )
+
+        self._proj_dirty = False
+        self.version += 1
+
+    @property
+    def cam(self):
+        """相机位置"""
+
+        if self._view_dirty:
+            self._update_view()
+        return self._cam
+
+    @property
+    def up(self):
+        """指向相机上方的单位向量"""
+
+        if self._view_dirty:
+            self._update_view()
+        return self._up
+
+    @property
+    def vmat(self):
+        """视点矩阵"""
+
+        if self._view_dirty:
+            self._update_view()
+        return self._vmat
+
+    @property
+    def pmat(self):
+        """投影矩阵"""
+
+        if self._proj_dirty:
+            self._update_proj()
+        return self._pmat
+
+    @property
+    def vpmat(self):
+        """视点矩阵和投影矩阵之积，即着色器中的u_ProjMatrix * u_ViewMatrix"""
+
+        if self._vp_dirty:
+            np.dot(self.vmat, self.pmat, out=self._vpmat)
+            self._vp_dirty = False
+        return self._vpmat
+
+def _legacy_matrices(cam, oecs, up, fovy, aspect, near, far):
+    """原scene.Scene中每帧由嵌套列表创建视点矩阵和投影矩阵的算法，仅供性能对比"""
+
+    camX, camY, camZ = cam
+    oecsX, oecsY, oecsZ = oecs
+    upX, upY, upZ = up
+
+    f = np.array([oecsX-camX, oecsY-camY, oecsZ-camZ], dtype=np.float64)
+    f /= np.linalg.norm(f)
+    s = np.array([f[1]*upZ - f[2]*upY, f[2]*upX - f[0]*upZ, f[0]*upY - f[1]*upX], dtype=np.float64)
+    s /= np.linalg.norm(s)
+    u = np.cross(s, f)
+
+    vmat = np.array([
+        [s[0], u[0], -f[0], 0],
+        [s[1], u[1], -f[1], 0],
+        [s[2], u[2], -f[2], 0],
+        [- s[0]*camX - s[1]*camY - s[2]*camZ,
+        - u[0]*camX - u[1]*camY - u[2]*camZ,
+        f[0]*camX + f[1]*camY + f[2]*camZ, 1]
+    ], dtype=np.float32)
+
+    right = np.tan(np.radians(fovy/2)) * near
+    left = -right
+    top = right/aspect
+    bottom = left/aspect
+    rw, rh, rd = 1/(right-left), 1/(top-bottom), 1/(far-near)
+
+    pmat = np.array([
+        [2 * near * rw, 0, 0, 0],
+        [0, 2 * near * rh, 0, 0],
+        [(right+left) * rw, (top+bottom) * rh, -(far+near) * rd, -1],
+        [0, 0, -2 * near * far * rd, 0]
+    ], dtype=np.float32)
+
+    return vmat, pmat
+
+def benchmark(frames=10000):
+    """对比每帧重建矩阵和带脏标记的相机在相机静止、转动时每帧的耗时和临时内存分配"""
+
+    def legacy(camera, orbit):
+        if orbit:
+            camera.update(azim=camera.azim+0.1)
+        _legacy_matrices(camera.cam.tolist(), camera.oecs.tolist(), camera.up.tolist(),
+            camera.fovy, camera.aspect, camera.near, camera.far)
+
+    def cached(camera, orbit):
+        if orbit:
+            camera.update(azim=camera.azim+0.1)
+        camera.vmat, camera.pmat
+
+    print('%-10s %-6s %12s %16s' % ('方式', '相机', '每帧(us)', '每帧临时分配(B)'))
+    for orbit in (False, True):
+        for name, func in (('每帧重建', legacy), ('脏标记', cached)):
+            camera = Camera(haxis='z')
+            func(camera, orbit)
+
+            t0 = time.perf_counter()
+            for i in range(frames):
+                func(camera, orbit)
+            t = (time.perf_counter() - t0) / frames
+
+            peak = 0
+            tracemalloc.start()
+            for i in range(100):
+                tracemalloc.reset_peak()
+                current = tracemalloc.get_traced_memory()[0]
+                func(camera, orbit)
+                peak += tracemalloc.get_traced_memory()[1] - current
+            tracemalloc.stop()
+
+            print('%-10s %-6s %12.2f %16.0f' % (name, '转动' if orbit else '静止', t*1e6, peak/100))
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,390 @@
+"""包围盒层次结构（BVH）和视椎体剔除
+
+prepare()时为每个模型计算轴对齐包围盒（AABB），按模型的场景图节点变换到世界坐标系后组织为
+BVH。每帧由视点矩阵和投影矩阵之积（Camera.vpmat）提取视椎体的6个平面，按层遍历BVH：每层的
+全部节点以一次NumPy运算与6个平面比较，完全在视椎体外的子树被剔除，完全在视椎体内的子树整体
+接受，与平面相交的叶节点再逐个检测其中的模型，最后得到可见模型的序号数组。
+
+模型移动后（场景图节点的世界矩阵被更新）只重新计算这些模型的包围盒，并自下而上逐层调整
+（refit）受影响的BVH节点；调整后全部节点的表面积之和超过构建时的rebuild_ratio倍时，说明
+包围盒重叠过多，重新构建整个BVH。
+
+固定管线场景由gluPerspective设置投影矩阵（fovy为垂直视野角度），与Camera.pmat（fovy为水平视野
+角度）不同，应以current_vpmat()读取实际使用的矩阵；着色器场景使用Camera.vpmat。
+
+    culler = Culler(self.models, self.graph)        # prepare()中
+    culler.update(current_vpmat())                  # 每帧，返回可见模型的序号
+    batch.draw(culler.select(batch.members))        # 只绘制可见模型
+    culler.drawn, culler.culled                     # 绘制和剔除的模型数
+"""
+
+import time
+import numpy as np
+from OpenGL.GL import *
+from vertexformat import decode
+
+def aabb(vertices):
+    """返回顶点数组（N,3）的轴对齐包围盒(最小角, 最大角)"""
+
+    vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 3)
+    return vertices.min(axis=0), vertices.max(axis=0)
+
+def geometry_aabb(geometry):
+    """返回几何体的包围盒：混合数组取最后3列（V3F），着色器属性取第一个属性（量化的属性先解码）"""
+
+    if geometry.interleaved:
+        data = geometry.interleaved[0].data
+        return aabb(data.reshape(len(data), -1)[:, -3:])
+
+    loc, buf, size, dtype, normalized, stride, offset, divisor = geometry.attribs[0]
+    if dtype != GL_FLOAT:
+        return aabb(decode(buf.data, size, dtype, normalized, stride, offset)[:, :3])
+
+    data = np.asarray(buf.data, dtype=np.float32)
+    data = data.reshape(len(data), -1)
+    column = offset // data.itemsize
+
+    return aabb(data[:, column:column+3])
+
+def transform_boxes(lo, hi, matrices):
+    """以(N,4,4)矩阵（与相机矩阵相同的约定）变换N个包围盒，返回世界坐标系中的(最小角, 最大角)"""
+
+    center, extent = (lo + hi) / 2, (hi - lo) / 2
+    rot = matrices[:, :3, :3]
+    center = np.einsum('ni,nij->nj', center, rot) + matrices[:, 3, :3]
+    extent = np.einsum('ni,nij->nj', extent, np.abs(rot))
+
+    return center - extent, center + extent
+
+def frustum_planes(vpmat):
+    """由视点矩阵和投影矩阵之积提取视椎体的6个平面(a,b,c,d)，法向量指向视椎体内部并已单位化"""
+
+    m = np.asarray(vpmat, dtype=np.float64)
+    x, y, z, w = m[:, 0], m[:, 1], m[:, 2], m[:, 3]         # 每列对应一个裁剪坐标分量
+    planes = np.stack((w+x, w-x, w+y, w-y, w+z, w-z))
+
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+def current_vpmat():
+    """返回固定管线当前的模型视点矩阵与投影矩阵之积"""
+
+    return np.dot(glGetFloatv(GL_MODELVIEW_MATRIX), glGetFloatv(GL_PROJECTION_MATRIX))
+
+def _classify(lo, hi, planes):
+    """返回各包围盒是否完全在视椎体外、是否完全在视椎体内"""
+
+    center, extent = (lo + hi) / 2, (hi - lo) / 2
+    d = center @ planes[:, :3].T + planes[:, 3]             # 中心到各平面的有向距离
+    r = extent @ np.abs(planes[:, :3]).T                    # 包围盒在各平面法向量上的投影半径
+
+    return (d + r < 0).any(axis=1), (d - r >= 0).all(axis=1)
+
+def box_visible(lo, hi, planes):
+    """逐个检测包围盒，返回与视椎体相交或在其内部的布尔数组"""
+
+    return ~_classify(lo, hi, planes)[0]
+
+def _expand(first, count):
+    """返回各区间[first, first+count)依次拼接后的序号数组"""
+
+    total = int(count.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+
+    starts = np.repeat(first - np.cumsum(count) + count, count)
+    return starts + np.arange(total)
+
+class BVH:
+    """包围盒层次结构，节点按层（广度优先）存放在数组中"""
+
+    def __init__(self, lo, hi, leaf_size=8, rebuild_ratio=2.0):
+        """构造函数
+
+        lo, hi          - (N,3)的包围盒最小角和最大角
+        leaf_size       - 叶节点最多包含的包围盒数
+        rebuild_ratio   - 调整后节点表面积之和超过构建时的此倍数时重新构建
+        """
+
+        self.leaf_size = leaf_size
+        self.rebuild_ratio = rebuild_ratio
+        self.rebuilds = 0                                       # 构建次数
+        self.refits = 0                                         # 调整次数
+        self.tested = 0                                         # 最近一次查询检测的包围盒数（节点和模型）
+
+        self.build(lo, hi)
+
+    def build(self, lo, hi):
+        """由包围盒自顶向下构建BVH：沿中心点分布最广的轴按中位数划分"""
+
+        self.lo = np.array(lo, dtype=np.float32).reshape(-1, 3)    # 各模型的包围盒
+        self.hi = np.array(hi, dtype=np.float32).reshape(-1, 3)
+        n = len(self.lo)
+        centers = (self.lo + self.hi) / 2
+        order = np.arange(n)                                    # 叶节点按顺序引用的模型序号
+
+        first, count, parent, depth = [0], [n], [-1], [0]
+        left = [-1]                                             # 左子节点，叶节点为-1；右子节点为left+1
+        i = 0
+        while i < len(first):
+            f, c = first[i], count[i]
+            if c > self.leaf_size:
+                items = order[f:f+c]
+                cen = centers[items]
+                axis = np.argmax(cen.max(axis=0) - cen.min(axis=0))
+                half = c // 2
+                order[f:f+c] = items[np.argpartition(cen[:, axis], half)]
+                left[i] = len(first)
+                for cf, cc in ((f, half), (f+half, c-half)):
+                    first.append(cf)
+                    count.append(cc)
+                    parent.append(i)
+                    depth.append(depth[i] + 1)
+                    left.append(-1)
+            i += 1
+
+        self.order = order
+        self.first = np.array(first, dtype=np.int64)            # 各节点子树在order中的区间
+        self.count = np.array(count, dtype=np.int64)
+        self.parent = np.array(parent, dtype=np.int64)
+        self.left = np.array(left, dtype=np.int64)
+        self.node_lo = np.zeros((len(first), 3), dtype=np.float32)     # 各节点的包围盒
+        self.node_hi = np.zeros((len(first), 3), dtype=np.float32)
+
+        bounds = np.searchsorted(depth, np.arange(depth[-1] + 2))  # 广度优先存放，同层节点连续
+        self.levels = [np.arange(bounds[d], bounds[d+1]) for d in range(len(bounds) - 1)]
+
+        leaves = np.flatnonzero(self.left < 0)
+        self.leaf_of = np.empty(n, dtype=np.int64)              # 各模型所在的叶节点
+        self.leaf_of[order[_expand(self.first[leaves], self.count[leaves])]] = np.repeat(leaves, self.count[leaves])
+
+        self._refit(np.ones(len(first), dtype=bool))
+        self.area = self._area()                                # 构建时全部节点的表面积之和
+        self.rebuilds += 1
+
+    def _area(self):
+        """全部节点的表面积之和"""
+
+        e = np.maximum(self.node_hi - self.node_lo, 0).astype(np.float64)
+        return float((e[:, 0]*e[:, 1] + e[:, 1]*e[:, 2] + e[:, 2]*e[:, 0]).sum() * 2)
+
+    def _refit(self, dirty):
+        """自下而上逐层重新计算dirty中节点的包围盒，父节点随之更新"""
+
+        if len(self.order) == 0:
+            return
+
+        for level in reversed(self.levels):
+            sel = level[dirty[level]]
+            if len(sel) == 0:
+                continue
+
+            leaf = self.left[sel] < 0
+            leaves, inner = sel[leaf], sel[~leaf]
+            leaves = leaves[self.count[leaves] > 0]
+            if len(leaves):
+                items = self.order[_expand(self.first[leaves], self.count[leaves])]
+                starts = np.cumsum(self.count[leaves]) - self.count[leaves]   # 各叶节点的模型在items中的起点
+                self.node_lo[leaves] = np.minimum.reduceat(self.lo[items], starts)
+                self.node_hi[leaves] = np.maximum.reduceat(self.hi[items], starts)
+            if len(inner):
+                a, b = self.left[inner], self.left[inner] + 1
+                self.node_lo[inner] = np.minimum(self.node_lo[a], self.node_lo[b])
+                self.node_hi[inner] = np.maximum(self.node_hi[a], self.node_hi[b])
+
+            parents = self.parent[sel]
+            dirty[parents[parents >= 0]] = True
+
+    def update(self, indices, lo, hi):
+        """更新部分模型的包围盒：调整受影响的节点，必要时重新构建"""
+
+        self.lo[indices] = lo
+        self.hi[indices] = hi
+
+        dirty = np.zeros(len(self.first), dtype=bool)
+        dirty[self.leaf_of[indices]] = True
+        self._refit(dirty)
+        self.refits += 1
+
+        if self._area() > self.area * self.rebuild_ratio:
+            self.build(self.lo, self.hi)
+
+    def query(self, planes):
+        """返回与视椎体相交或在其内部的模型序号（升序）"""
+
+        if len(self.order) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        accepted, partial_leaves, tested = list(), list(), 0
+        frontier = np.zeros(1, dtype=np.int64)
+        while len(frontier):
+            outside, inside = _classify(self.node_lo[frontier], self.node_hi[frontier], planes)
+            tested += len(frontier)
+            accepted.append(frontier[~outside & inside])        # 整个子树可见
+            partial = frontier[~outside & ~inside]
+            leaf = self.left[partial] < 0
+            partial_leaves.append(partial[leaf])
+            inner = self.left[partial[~leaf]]
+            frontier = np.concatenate((inner, inner + 1))
+
+        accepted = np.concatenate(accepted)
+        leaves = np.concatenate(partial_leaves)
+        items = self.order[_expand(self.first[leaves], self.count[leaves])]
+        visible = box_visible(self.lo[items], self.hi[items], planes)
+        self.tested = tested + len(items)
+
+        return np.sort(np.concatenate((self.order[_expand(self.first[accepted], self.count[accepted])], items[visible])))
+
+class Culler:
+    """场景模型的视椎体剔除"""
+
+    def __init__(self, models, graph=None, leaf_size=8):
+        """构造函数
+
+        models      - 模型字典列表：'geometry'为Geometry对象，可选的'aabb'为局部坐标系中的
+                      (最小角, 最大角)，可选的'node'为场景图节点（没有节点的模型是静止的）
+        graph       - 模型节点所在的场景图
+        leaf_size   - BVH叶节点最多包含的模型数
+        """
+
+        boxes = [m.get('aabb') or geometry_aabb(m['geometry']) for m in models]
+        self.local_lo = np.array([b[0] for b in boxes], dtype=np.float32).reshape(-1, 3)   # 局部坐标系中的包围盒
+        self.local_hi = np.array([b[1] for b in boxes], dtype=np.float32).reshape(-1, 3)
+        self.nodes = np.array([m['node'].index if m.get('node') is not None else -1 for m in models], dtype=np.int64)
+        self.graph = graph
+
+        self.total = len(models)                                # 模型数
+        self.drawn = self.total                                 # 最近一次剔除后可见的模型数
+        self.culled = 0                                         # 最近一次剔除掉的模型数
+        self.visible = np.arange(self.total)                    # 可见模型的序号
+        self.mask = np.ones(self.total, dtype=bool)             # 各模型是否可见
+
+        self._version = None if graph is None else graph.version
+        self.bvh = BVH(*self._world_boxes(np.arange(self.total)), leaf_size=leaf_size)
+
+    def _world_boxes(self, indices):
+        """返回部分模型在世界坐标系中的包围盒"""
+
+        lo, hi = self.local_lo[indices].copy(), self.local_hi[indices].copy()
+        moving = self.nodes[indices] >= 0
+        if moving.any():
+            self.graph.update()
+            matrices = self.graph.world[self.nodes[indices][moving]]
+            lo[moving], hi[moving] = transform_boxes(lo[moving], hi[moving], matrices)
+
+        return lo, hi
+
+    def _sync(self):
+        """场景图更新后调整移动过的模型的包围盒"""
+
+        if self.graph is None:
+            return
+
+        previous = self._version
+        self.graph.update()
+        if self.graph.version == previous:
+            return
+
+        self._version = self.graph.version
+        if self.graph.version == previous + 1:                  # 只错过一次更新，移动过的节点即最近一次更新的节点
+            moved = np.flatnonzero(np.isin(self.nodes, self.graph.updated))
+        else:
+            moved = np.flatnonzero(self.nodes >= 0)
+        if len(moved):
+            self.bvh.update(moved, *self._world_boxes(moved))
+
+    def update(self, vpmat):
+        """以视点矩阵和投影矩阵之积剔除模型，返回可见模型的序号（升序）"""
+
+        self._sync()
+        self.visible = self.bvh.query(frustum_planes(vpmat))
+        self.mask[:] = False
+        self.mask[self.visible] = True
+        self.drawn = len(self.visible)
+        self.culled = self.total - self.drawn
+
+        return self.visible
+
+    def select(self, members):
+        """返回members（模型序号数组，如StaticBatch.members）中可见模型在members中的位置，全部可见时返回None"""
+
+        mask = self.mask[members]
+        return None if mask.all() else np.flatnonzero(mask)
+
+def benchmark(n=20000, moved=0.01, repeat=20):
+    """n个随机分布的六面体：对比逐个检测和BVH剔除的耗时、剔除数量，模型移动后调整与重新构建BVH的耗时，
+    以及全部绘制与只绘制可见模型的耗时"""
+
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+    from camera import Camera
+    from geometry import Geometry
+    import batching
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(320, 240)
+    glutCreateWindow('Culling benchmark')
+    glutHideWindow()
+    glViewport(0, 0, 320, 240)
+
+    rng = np.random.default_rng(0)
+    camera = Camera(dist=150.0, fovy=40.0, aspect=320/240, azim=30.0, elev=20.0)
+    planes = frustum_planes(camera.vpmat)
+
+    corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float32)
+    quads = np.array([[0, 1, 3, 2], [4, 6, 7, 5], [0, 4, 5, 1], [2, 3, 7, 6], [0, 2, 6, 4], [1, 5, 7, 3]], dtype=np.int32)
+    models = list()
+    for center in rng.uniform(-300, 300, (n, 3)):
+        vertices = np.hstack((rng.uniform(0.2, 1, (8, 3)), corners + center)).astype(np.float32)
+        geom = Geometry(GL_QUADS)
+        geom.interleave(vertices, GL_C3F_V3F)
+        geom.elements(quads)
+        models.append({'geometry':geom})
+
+    def timed(func):
+        t = list()
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            func()
+            t.append(time.perf_counter() - t0)
+        return np.median(t)
+
+    culler = Culler(models)
+    lo, hi = culler.bvh.lo.copy(), culler.bvh.hi.copy()
+    brute = np.flatnonzero(box_visible(lo, hi, planes))
+    visible = culler.update(camera.vpmat)
+    assert np.array_equal(brute, visible)
+
+    print('模型数：%d，可见：%d，剔除：%d，BVH节点：%d' % (n, culler.drawn, culler.culled, len(culler.bvh.first)))
+    print('%-16s %12s %12s' % ('操作', '检测包围盒', '耗时(ms)'))
+    print('%-16s %12d %12.3f' % ('逐个检测', n, timed(lambda: box_visible(lo, hi, planes))*1e3))
+    print('%-16s %12d %12.3f' % ('BVH剔除', culler.bvh.tested, timed(lambda: culler.bvh.query(planes))*1e3))
+
+    idx = rng.choice(n, int(n*moved), replace=False)
+    def refit():
+        offset = rng.uniform(-1, 1, (len(idx), 3)).astype(np.float32)
+        culler.bvh.update(idx, lo[idx] + offset, hi[idx] + offset)
+    print('%-16s %12d %12.3f' % ('移动%d个后调整' % len(idx), len(idx), timed(refit)*1e3))
+    print('%-16s %12d %12.3f' % ('重新构建', n, timed(lambda: culler.bvh.build(lo, hi))*1e3))
+
+    batch = batching.merge(models)[0]
+    glMatrixMode(GL_PROJECTION)
+    glLoadMatrixf(camera.vpmat)
+    glMatrixMode(GL_MODELVIEW)
+    glLoadIdentity()
+
+    def draw(visible):
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        batch.draw(visible)
+        glFinish()
+
+    t_all = timed(lambda: draw(None))
+    t_culled = timed(lambda: draw(culler.select(batch.members)))
+    print()
+    print('%-16s %12s %12s' % ('绘制', '模型数', '耗时(ms)'))
+    print('%-16s %12d %12.3f' % ('全部绘制', n, t_all*1e3))
+    print('%-16s %12d %12.3f' % ('剔除后绘制', culler.drawn, t_culled*1e3))
+    batch.delete()
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,231 @@
+"""十个示例场景的帧时间基准测试
+
+在离屏上下文中逐个加载示例，按脚本转动相机（方位角转一周，高度角在±30°之间摆动），
+渲染固定帧数，报告每个场景prepare()的耗时、帧时间的p50/p95/p99，以及每次draw()在
+Python主线程中消耗的CPU时间。每个场景在独立的子进程中运行，避免前一个示例遗留的
+GL状态（如07开启的光照）和模块全局变量影响后一个示例。
+
+结果以JSON保存，可用--compare与另一次提交的结果对比：
+    python framebench.py --out before.json
+    python framebench.py --out after.json --compare before.json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import platform
+import subprocess
+import offscreen                                                # 须在导入OpenGL之前导入，以选择离屏平台
+import numpy as np
+from OpenGL.GL import glFinish, glViewport, glGetString, GL_RENDERER, GL_VERSION
+
+DEMOS = (                                                       # (示例文件, 与其__main__相同的构造参数)
+    ('01-simplegl.py', {}),
+    ('02-cam-lookup.py', {}),
+    ('03-gl-oop.py', {'haxis':'y'}),
+    ('04-inherit-base.py', {'haxis':'y'}),
+    ('05-vbo-vio.py', {'haxis':'y', 'azim':-30, 'elev':10}),
+    ('06-with-texture.py', {'haxis':'y'}),
+    ('07-with-light-effect.py', {'haxis':'y'}),
+    ('08-with-shader.py', {}),
+    ('09-with-mvp-matrix.py', {'haxis':'y'}),
+    ('10-diffuse-specular-shine.py', {'haxis':'z'})
+)
+
+class _FunctionScene:
+    """将以模块级函数编写的示例（01、02、08）包装为场景对象"""
+
+    def __init__(self, module, size):
+        """构造函数"""
+
+        self.module = module                                    # 示例模块
+        self.csize = size                                       # 画布分辨率
+        self.bg = [0.0, 0.0, 0.0]                               # 背景色
+
+    def prepare(self):
+        if hasattr(self.module, 'prepare'):
+            self.module.prepare()
+
+    def reshape(self, w, h):
+        if hasattr(self.module, 'reshape'):
+            self.module.reshape(w, h)
+        else:
+            glViewport(0, 0, w, h)
+
+    def draw(self):
+        self.module.draw()
+
+    def render(self):
+        self.draw()
+
+    def orbit(self, azim, elev):
+        """以鼠标拖拽事件转动相机（02），其余示例没有相机"""
+
+        m = self.module
+        if hasattr(m, 'drag'):
+            m.mouse_pos = (0, 0)
+            m.drag(int(round(-(azim - m.azim) * m.csize[0] / 180)), int(round((elev - m.elev) * m.csize[1] / 90)))
+
+def _load_scene(filename, kwds, size):
+    """加载示例，返回场景对象。优先选择App、Scene、BaseScene类，否则包装模块级函数"""
+
+    from program import _load_demo
+
+    module = _load_demo(filename, 'framebench_demo')
+    for name in ('App', 'Scene', 'BaseScene'):
+        cls = vars(module).get(name)
+        if isinstance(cls, type) and cls.__module__ == module.__name__:
+            return cls(size=size, **kwds)
+
+    return _FunctionScene(module, size)
+
+def _orbit(scene, i, frames):
+    """第i帧的相机姿态：方位角匀速转一周，高度角按正弦在±30°之间摆动"""
+
+    t = i / frames
+    azim, elev = -180 + 360*t, 30*math.sin(2*math.pi*t)
+
+    if hasattr(scene, '_update_cam_and_up'):
+        scene._update_cam_and_up(azim=azim, elev=elev)
+    elif hasattr(scene, 'orbit'):
+        scene.orbit(azim, elev)
+
+def _percentiles(values):
+    """返回p50、p95、p99和平均值"""
+
+    p50, p95, p99 = np.percentile(values, (50, 95, 99))
+    return {'p50':float(p50), 'p95':float(p95), 'p99':float(p99), 'mean':float(np.mean(values))}
+
+def run_scene(filename, kwds=None, frames=120, size=(640, 480), warmup=5):
+    """在当前进程中测试一个示例，返回结果字典（时间单位为毫秒）"""
+
+    scene = _load_scene(filename, kwds or {}, size)
+    offscreen.context(size)                                     # 创建上下文的耗时不计入prepare()
+
+    t0 = time.perf_counter()
+    offscreen.prepare(scene, size)
+    glFinish()
+    t_prepare = time.perf_counter() - t0
+
+    draw, draw_cpu = scene.draw, list()
+    def timed_draw(*args):
+        c0 = time.thread_time()                                 # 主线程CPU时间，不含llvmpipe光栅化线程
+        draw(*args)
+        draw_cpu.append(time.thread_time() - c0)
+    scene.draw = timed_draw
+
+    frame_times = list()
+    with offscreen._NoGlut(scene):
+        for i in range(warmup + frames):
+            _orbit(scene, i, frames)
+            t0 = time.perf_counter()
+            scene.render()
+            glFinish()
+            frame_times.append(time.perf_counter() - t0)
+
+    frame_ms = np.array(frame_times[warmup:]) * 1e3
+    draw_ms = np.array(draw_cpu[warmup:]) * 1e3
+
+    return {
+        'scene':        filename,
+        'frames':       frames,
+        'prepare_ms':   t_prepare * 1e3,
+        'frame_ms':     _percentiles(frame_ms),
+        'draw_cpu_ms':  _percentiles(draw_ms),
+        'fps':          1e3 / float(np.mean(frame_ms))
+    }
+
+def _git_commit():
+    """返回当前提交的哈希，不在git仓库中时返回None"""
+
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_all(frames=120, size=(640, 480), demos=DEMOS):
+    """在子进程中依次测试全部示例，返回结果字典"""
+
+    results = list()
+    for filename, kwds in demos:
+        cmd = [sys.executable, os.path.abspath(__file__), '--scene', filename, '--frames', str(frames),
+            '--size', '%dx%d' % size, '--kwds', json.dumps(kwds)]
+        proc = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        lines = proc.stdout.strip().splitlines()
+        if proc.returncode != 0 or not lines:
+            results.append({'scene':filename, 'error':(proc.stderr.strip().splitlines() or ['exit %d' % proc.returncode])[-1]})
+        else:
+            results.append(json.loads(lines[-1]))
+
+    return {
+        'commit':       _git_commit(),
+        'time':         time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python':       platform.python_version(),
+        'renderer':     _renderer(),
+        'size':         list(size),
+        'frames':       frames,
+        'scenes':       results
+    }
+
+def _renderer():
+    """返回离屏上下文的渲染器字符串"""
+
+    offscreen.context((16, 16))
+    return ' / '.join((glGetString(name) or b'').decode() for name in (GL_RENDERER, GL_VERSION))
+
+def report(result, baseline=None):
+    """打印结果表格。提供baseline时增加p50帧时间和draw() CPU时间相对基线的变化"""
+
+    base = {item['scene']:item for item in baseline['scenes'] if 'error' not in item} if baseline else {}
+
+    print('%s  %s  %dx%d  %d帧' % (result['commit'] or '-', result['renderer'], result['size'][0], result['size'][1], result['frames']))
+    print('%-30s %10s %8s %8s %8s %12s %16s' % ('场景', 'prepare(ms)', 'p50(ms)', 'p95(ms)', 'p99(ms)', 'draw CPU(ms)', '相对基线p50/CPU'))
+    for item in result['scenes']:
+        if 'error' in item:
+            print('%-30s 失败：%s' % (item['scene'], item['error']))
+            continue
+
+        f, d = item['frame_ms'], item['draw_cpu_ms']
+        change = ''
+        if item['scene'] in base:
+            b = base[item['scene']]
+            change = '%+.0f%% / %+.0f%%' % (100*(f['p50']/b['frame_ms']['p50']-1), 100*(d['mean']/b['draw_cpu_ms']['mean']-1))
+        print('%-30s %10.1f %8.2f %8.2f %8.2f %12.3f %16s' % (item['scene'], item['prepare_ms'], f['p50'], f['p95'], f['p99'], d['mean'], change))
+
+def main():
+    """命令行入口"""
+
+    parser = argparse.ArgumentParser(description='示例场景帧时间基准测试')
+    parser.add_argument('--frames', type=int, default=120, help='每个场景渲染的帧数')
+    parser.add_argument('--size', default='640x480', help='画布大小')
+    parser.add_argument('--out', help='保存结果的JSON文件')
+    parser.add_argument('--compare', help='作为基线对比的JSON文件')
+    parser.add_argument('--scene', help=argparse.SUPPRESS)     # 子进程：只测试一个示例，输出一行JSON
+    parser.add_argument('--kwds', default='{}', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    size = tuple(int(v) for v in args.size.lower().split('x'))
+
+    if args.scene:
+        print(json.dumps(run_scene(args.scene, json.loads(args.kwds), args.frames, size)))
+        sys.stdout.flush()
+        os._exit(0)                                             # 跳过解释器退出时的清理，避免GL对象在上下文销毁后析构
+
+    result = run_all(args.frames, size)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fp:
+            baseline = json.load(fp)
+
+    report(result, baseline)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as fp:
+            json.dump(result, fp, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
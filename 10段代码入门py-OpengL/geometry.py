@@ -0,0 +1,229 @@
+"""使用顶点数组对象（VAO）记录顶点属性布局的几何体"""
+
+import time
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.arrays import vbo
+from program import ShaderProgram
+import meshes
+import meshopt
+
+class Geometry:
+    """几何体
+
+    在prepare()中将顶点属性指针、启用状态和索引缓冲区记录到VAO中，此后draw()只需
+    绑定VAO并调用一次绘制函数。vao=False时保留旧的绘制方式，每次draw()都重新绑定
+    VBO并设置顶点属性指针，用于性能对比或不支持VAO的环境。divisor大于0的属性为实例
+    属性，draw(instances=n)以一次实例化绘制调用绘制n个实例。
+    """
+
+    def __init__(self, gltype=GL_TRIANGLES, program=None, vao=True):
+        """构造函数
+
+        gltype      - 图元类型
+        program     - ShaderProgram对象，用于按名称查找属性位置
+        vao         - 是否使用VAO
+        """
+
+        self.gltype = gltype                # 图元类型
+        self.program = program              # 着色器程序
+        self.use_vao = vao                  # 是否使用VAO
+        self.vao = None                     # 顶点数组对象
+        self.attribs = list()               # 着色器顶点属性：(位置, VBO, 分量数, 数据类型, 是否归一化, 步长, 偏移量, 实例除数)
+        self.interleaved = None             # 固定管线混合数组：(VBO, 混合数组类型)
+        self.indices = None                 # 索引VBO
+        self.index_type = GL_UNSIGNED_INT   # 索引数据类型
+        self.count = 0                      # 顶点数量或索引长度
+
+    def attrib(self, loc, data, size=None, dtype=GL_FLOAT, normalized=False, stride=0, offset=0, divisor=0):
+        """添加着色器顶点属性
+
+        loc         - 属性位置，或属性名称（须在构造函数中提供program）
+        data        - 顶点数组或已创建的VBO（多个属性共享同一混合VBO时）
+        size        - 每个顶点的分量数，默认为数组的列数
+        divisor     - 实例除数，0为逐顶点属性，n为每n个实例取一个值
+        """
+
+        if isinstance(loc, str):
+            loc = self.program.attrib(loc)
+
+        if not isinstance(data, vbo.VBO):
+            data = np.ascontiguousarray(data)
+            size = data.shape[-1] if size is None else size
+            stride = stride or data.strides[0]
+            if self.indices is None and not self.attribs and divisor == 0:
+                self.count = len(data)
+            data = vbo.VBO(data)
+
+        if loc >= 0: # 被编译器优化掉的属性不需要设置
+            self.attribs.append((loc, data, size, dtype, normalized, stride, offset, divisor))
+
+        return data
+
+    def interleave(self, data, atype):
+        """设置固定管线使用的混合数组，atype为GL_C3F_V3F、GL_T2F_V3F等混合数组类型"""
+
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        self.interleaved = (vbo.VBO(data), atype)
+        if self.indices is None:
+            self.count = len(data)
+
+    def elements(self, indices, downcast=True):
+        """设置索引数组。downcast为True时，最大索引小于0xFFFF的索引数组转换为uint16（GL_UNSIGNED_SHORT）"""
+
+        indices = meshopt.downcast(indices) if downcast else np.ascontiguousarray(indices)
+        self.index_type = {1:GL_UNSIGNED_BYTE, 2:GL_UNSIGNED_SHORT, 4:GL_UNSIGNED_INT}[indices.itemsize]
+        self.indices = vbo.VBO(indices, target=GL_ELEMENT_ARRAY_BUFFER)
+        self.count = indices.size
+
+    def _setup(self):
+        """绑定VBO并设置顶点属性指针"""
+
+        if self.interleaved:
+            self.interleaved[0].bind()
+            glInterleavedArrays(self.interleaved[1], 0, None)
+            self.interleaved[0].unbind()
+
+        for loc, buf, size, dtype, normalized, stride, offset, divisor in self.attribs:
+            buf.bind()
+            glVertexAttribPointer(loc, size, dtype, normalized, stride, buf+offset)
+            glEnableVertexAttribArray(loc)
+            if divisor:
+                glVertexAttribDivisor(loc, divisor)
+            buf.unbind()
+
+    def prepare(self):
+        """创建VAO，记录顶点属性布局和索引缓冲区"""
+
+        if not self.use_vao:
+            return
+
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
+        self._setup()
+        if self.indices is not None:
+            self.indices.bind() # 索引缓冲区的绑定状态保存在VAO中
+        glBindVertexArray(0)
+
+    def _draw_call(self, count, instances):
+        """调用绘制函数，instances不为None时实例化绘制"""
+
+        if instances is None:
+            if self.indices is not None:
+                glDrawElements(self.gltype, count, self.index_type, None)
+            else:
+                glDrawArrays(self.gltype, 0, count)
+        elif self.indices is not None:
+            glDrawElementsInstanced(self.gltype, count, self.index_type, None, instances)
+        else:
+            glDrawArraysInstanced(self.gltype, 0, count, instances)
+
+    def bind(self):
+        """绑定VAO（不使用VAO时设置顶点属性指针并绑定索引缓冲区），用于以其他方式发出绘制调用"""
+
+        if self.vao:
+            glBindVertexArray(self.vao)
+        else:
+            self._setup()
+            if self.indices is not None:
+                self.indices.bind()
+
+    def unbind(self):
+        """解绑VAO或索引缓冲区"""
+
+        if self.vao:
+            glBindVertexArray(0)
+        else:
+            if self.indices is not None:
+                self.indices.unbind()
+            for item in self.attribs: # 不使用VAO时除数是全局状态，恢复为0以免影响其他几何体
+                if item[7]:
+                    glVertexAttribDivisor(item[0], 0)
+
+    def draw(self, count=None, instances=None):
+        """绘制几何体，instances为实例数（须有divisor大于0的实例属性）"""
+
+        self.bind()
+        self._draw_call(self.count if count is None else count, instances)
+        self.unbind()
+
+    def delete(self):
+        """删除VAO和VBO"""
+
+        if self.vao:
+            glDeleteVertexArrays(1, [self.vao])
+            self.vao = None
+
+        buffers = [item[1] for item in self.attribs]
+        buffers += [self.interleaved[0]] if self.interleaved else []
+        buffers += [self.indices] if self.indices is not None else []
+        for buf in {id(buf):buf for buf in buffers}.values(): # 多个属性可能共享同一VBO
+            buf.delete()
+
+def benchmark(n=500, frames=100):
+    """对比n个几何体每帧使用VAO和逐帧设置顶点属性的CPU耗时"""
+
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(320, 240)
+    glutCreateWindow('Geometry benchmark')
+    glutHideWindow()
+
+    vshader_src = """
+        #version 330 core
+        in vec4 a_Position;
+        in vec3 a_Normal;
+        in vec2 a_Texcoord;
+        out vec4 v_Color;
+
+        void main() {
+            gl_Position = vec4(a_Position.xyz * 0.01, 1.0);
+            v_Color = vec4(abs(a_Normal), a_Texcoord.x);
+        }
+    """
+
+    fshader_src = """
+        #version 330 core
+        in vec4 v_Color;
+
+        void main() {
+            gl_FragColor = v_Color;
+        }
+    """
+
+    program = ShaderProgram(vshader_src, fshader_src)
+    mesh = meshes.cube()
+
+    print('%8s %-8s %12s %12s' % ('几何体数', '方式', '每帧(ms)', '每次绘制(us)'))
+    for use_vao in (False, True):
+        models = list()
+        for i in range(n):
+            geom = Geometry(GL_TRIANGLES, program, vao=use_vao)
+            geom.attrib('a_Position', mesh['vertices'])
+            geom.attrib('a_Normal', mesh['normals'])
+            geom.attrib('a_Texcoord', mesh['texcoords'])
+            geom.elements(mesh['indices'])
+            geom.prepare()
+            models.append(geom)
+
+        t = list()
+        for i in range(frames+5):
+            t0 = time.perf_counter()
+            program.use()
+            for geom in models:
+                geom.draw()
+            program.unuse()
+            t.append(time.perf_counter()-t0)
+        glFinish()
+
+        t = np.median(t[5:]) # 去掉预热帧
+        print('%8d %-8s %12.2f %12.1f' % (n, 'VAO' if use_vao else '逐帧设置', t*1e3, t/n*1e6))
+
+        for geom in models:
+            geom.delete()
+
+if __name__ == '__main__':
+    benchmark()
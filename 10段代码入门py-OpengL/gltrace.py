@@ -0,0 +1,284 @@
+"""可选的GL调用跟踪
+
+Tracer.attach(scene)将场景类及辅助模块（geometry、program、textures等）中引用的OpenGL.GL
+函数替换为跟踪函数，逐帧统计每个函数的调用次数和耗时，并检测冗余的状态设置，例如连续
+两次绑定同一纹理、同一程序或同一VAO。结果可打印为表格，或保存为Chrome跟踪事件格式的
+JSON文件（在chrome://tracing或Perfetto中打开）。detach()恢复原函数。
+
+命令行（离屏运行）：python gltrace.py 10-diffuse-specular-shine.py --frames 10 --chrome trace.json
+检查跟踪是否完整：python gltrace.py --check（示例10的首帧须统计到矩阵和向量uniform的上传）
+"""
+
+import sys
+
+if __name__ == '__main__':
+    import offscreen                                            # 须在导入OpenGL之前选择离屏平台
+
+import json
+import time
+import types
+import argparse
+import OpenGL.GL
+from OpenGL.GL import *
+from OpenGL.arrays import vbo
+
+GL_NAMES = frozenset(name for name in dir(OpenGL.GL) if name.startswith('gl') and callable(getattr(OpenGL.GL, name)))
+HELPER_MODULES = ('baseScene', 'scene', 'geometry', 'program', 'textures', 'texfile', 'shadercache', 'batching', 'instancing', 'recorder', 'culling', 'lod', 'meshbuild', 'streambuf')
+
+def scene_namespaces(scene):
+    """返回场景类各方法所在模块及辅助模块的全局变量字典，以及VBO实现对象的属性字典"""
+
+    namespaces, attrs = dict(), [attr for cls in type(scene).__mro__ for attr in vars(cls).values()]
+    for attr in attrs + list(vars(scene).values()):
+        if isinstance(attr, types.ModuleType):
+            namespaces[id(vars(attr))] = vars(attr)
+        elif callable(attr) and hasattr(attr, '__globals__'):
+            namespaces[id(attr.__globals__)] = attr.__globals__
+    for name in HELPER_MODULES:
+        if name in sys.modules:
+            namespaces[id(vars(sys.modules[name]))] = vars(sys.modules[name])
+    namespaces['vbo'] = vars(vbo.get_implementation())         # VBO.bind()等通过实现对象调用GL函数
+
+    return list(namespaces.values())
+
+def _int(value):
+    """将GL对象名或枚举值转换为可比较的整数"""
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+def _state_key(name, args, state):
+    """返回调用所设置的状态键和值，不设置可跟踪状态的调用返回None"""
+
+    if name == 'glUseProgram':
+        return ('program',), _int(args[0])
+    if name == 'glBindVertexArray':
+        return ('vao',), _int(args[0])
+    if name == 'glBindBuffer':
+        return ('buffer', _int(args[0])), _int(args[1])
+    if name == 'glActiveTexture':
+        return ('active_texture',), _int(args[0])
+    if name == 'glBindTexture':
+        return ('texture', state.get(('active_texture',), GL_TEXTURE0), _int(args[0])), _int(args[1])
+    if name == 'glBindFramebuffer':
+        return ('framebuffer', _int(args[0])), _int(args[1])
+    if name in ('glEnable', 'glDisable'):
+        return ('cap', _int(args[0])), name == 'glEnable'
+
+    return None
+
+class Tracer:
+    """GL调用跟踪器"""
+
+    def __init__(self, events=False):
+        """构造函数
+
+        events      - 是否记录每次调用的起止时间，用于保存Chrome跟踪文件
+        """
+
+        self.frames = list()                    # 每帧一个字典：函数名 -> [调用次数, 耗时(秒), 冗余次数]
+        self.setup = dict()                     # 帧以外（如prepare()）的调用统计
+        self.redundant = list()                 # 冗余调用示例：(帧序号, 函数名, 参数)
+        self.events = list() if events else None   # (函数名, 开始时间, 结束时间, 帧序号, 是否冗余)
+        self.frame_times = list()               # 每帧的(开始时间, 结束时间)
+
+        self._state = dict()                    # 跟踪到的GL状态
+        self._current = None                    # 当前帧的统计字典
+        self._frame_start = 0.0
+        self._saved = list()                    # 被替换的(命名空间, 名称, 原函数)
+        self._wrappers = dict()                 # 函数名 -> 跟踪函数
+        self._t0 = time.perf_counter()
+
+    def _wrap(self, name, func):
+        """返回跟踪函数：计时、计数并检测冗余状态设置"""
+
+        perf_counter = time.perf_counter
+
+        def traced(*args, **kwds):
+            t0 = perf_counter()
+            try:
+                return func(*args, **kwds)
+            finally:
+                self._record(name, args, t0, perf_counter())
+
+        traced.__name__ = name
+        traced.__wrapped__ = func
+
+        return traced
+
+    def _record(self, name, args, t0, t1):
+        """记录一次调用"""
+
+        stats = self.setup if self._current is None else self._current
+        item = stats.get(name)
+        if item is None:
+            item = stats[name] = [0, 0.0, 0]
+        item[0] += 1
+        item[1] += t1 - t0
+
+        redundant = False
+        key = _state_key(name, args, self._state)
+        if key is not None:
+            k, v = key
+            if k in self._state and self._state[k] == v:
+                redundant = True
+                item[2] += 1
+                if len(self.redundant) < 1000:
+                    self.redundant.append((len(self.frames), name, tuple(_int(a) for a in args)))
+            self._state[k] = v
+
+        if self.events is not None:
+            self.events.append((name, t0, t1, len(self.frames), redundant))
+
+    def install(self, namespaces):
+        """将各命名空间（模块全局变量字典等）中的GL函数替换为跟踪函数"""
+
+        for ns in namespaces:
+            for name in GL_NAMES.intersection(ns):
+                func = ns[name]
+                if getattr(func, '__wrapped__', None) is not None and func in self._wrappers.values():
+                    continue
+                if name not in self._wrappers:
+                    self._wrappers[name] = self._wrap(name, func)
+                self._saved.append((ns, name, func))
+                ns[name] = self._wrappers[name]
+
+    def uninstall(self):
+        """恢复全部被替换的函数"""
+
+        for ns, name, func in reversed(self._saved):
+            ns[name] = func
+        self._saved = list()
+
+    def begin_frame(self):
+        """开始一帧。未被跟踪的代码也可能改变GL状态，因此每帧重新开始跟踪状态"""
+
+        self._state = dict()
+        self._current = dict()
+        self._frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """结束一帧"""
+
+        self.frames.append(self._current)
+        self.frame_times.append((self._frame_start, time.perf_counter()))
+        self._current = None
+
+    def attach(self, scene):
+        """跟踪场景及辅助模块中的GL调用，并将scene.render()的每次调用作为一帧"""
+
+        self.install(scene_namespaces(scene))
+
+        render = scene.render
+        def traced_render(*args, **kwds):
+            self.begin_frame()
+            try:
+                return render(*args, **kwds)
+            finally:
+                self.end_frame()
+
+        scene.render = traced_render
+        self._scene = scene
+
+        return self
+
+    def detach(self):
+        """恢复场景和全部被替换的函数"""
+
+        self.uninstall()
+        scene = getattr(self, '_scene', None)
+        if scene is not None and 'render' in vars(scene):
+            del scene.render
+        self._scene = None
+
+    def summary(self):
+        """返回每个函数平均每帧的(调用次数, 耗时us, 冗余次数)，按调用次数降序排列"""
+
+        n = max(len(self.frames), 1)
+        total = dict()
+        for frame in self.frames:
+            for name, (calls, t, redundant) in frame.items():
+                item = total.setdefault(name, [0, 0.0, 0])
+                item[0] += calls
+                item[1] += t
+                item[2] += redundant
+
+        rows = [(name, calls/n, t/n*1e6, redundant/n) for name, (calls, t, redundant) in total.items()]
+        return sorted(rows, key=lambda row: (-row[1], row[0]))
+
+    def report(self, frames=True):
+        """打印每帧的调用次数、GL耗时和冗余次数，以及各函数平均每帧的统计"""
+
+        if frames:
+            print('%6s %10s %12s %10s' % ('帧', '调用次数', 'GL耗时(us)', '冗余次数'))
+            for i, frame in enumerate(self.frames):
+                calls = sum(item[0] for item in frame.values())
+                t = sum(item[1] for item in frame.values())
+                redundant = sum(item[2] for item in frame.values())
+                print('%6d %10d %12.1f %10d' % (i, calls, t*1e6, redundant))
+            print()
+
+        print('%-28s %12s %14s %12s' % ('函数', '每帧调用', '每帧耗时(us)', '每帧冗余'))
+        for name, calls, t, redundant in self.summary():
+            print('%-28s %12.1f %14.1f %12.1f' % (name, calls, t, redundant))
+
+        if self.redundant:
+            print()
+            print('冗余状态设置示例：')
+            for i, name, args in self.redundant[:10]:
+                print('  第%d帧 %s%s' % (i, name, args))
+
+    def save_chrome_trace(self, path):
+        """保存为Chrome跟踪事件格式的JSON文件"""
+
+        if self.events is None:
+            raise ValueError('创建Tracer时须指定events=True')
+
+        us = lambda t: (t - self._t0) * 1e6
+        events = [{'name':'frame %d' % i, 'cat':'frame', 'ph':'X', 'ts':us(t0), 'dur':(t1-t0)*1e6, 'pid':0, 'tid':0}
+            for i, (t0, t1) in enumerate(self.frame_times)]
+        events += [{'name':name, 'cat':'redundant' if redundant else 'gl', 'ph':'X', 'ts':us(t0), 'dur':(t1-t0)*1e6,
+            'pid':0, 'tid':0, 'args':{'frame':i}} for name, t0, t1, i, redundant in self.events]
+
+        with open(path, 'w', encoding='utf-8') as fp:
+            json.dump({'traceEvents':events, 'displayTimeUnit':'ms'}, fp)
+
+def main():
+    """命令行入口：离屏渲染示例并跟踪GL调用"""
+
+    import offscreen
+    from program import _load_demo
+
+    parser = argparse.ArgumentParser(description='跟踪示例场景每帧的GL调用')
+    parser.add_argument('demo', nargs='?', default='10-diffuse-specular-shine.py', help='示例文件，如10-diffuse-specular-shine.py')
+    parser.add_argument('--frames', type=int, default=5, help='跟踪的帧数')
+    parser.add_argument('--size', default='640x480', help='画布大小')
+    parser.add_argument('--haxis', default='y', help='高度轴')
+    parser.add_argument('--chrome', help='保存Chrome跟踪事件JSON文件')
+    parser.add_argument('--check', action='store_true', help='检查首帧是否统计到uniform上传（经program的ShaderProgram赋值）')
+    args = parser.parse_args()
+
+    size = tuple(int(v) for v in args.size.lower().split('x'))
+    app = offscreen.find_scene_class(_load_demo(args.demo))(haxis=args.haxis, size=size)
+
+    tracer = Tracer(events=bool(args.chrome))
+    offscreen.prepare(app, size)
+    tracer.attach(app)
+    offscreen.render(app, args.frames, size)
+    tracer.detach()
+
+    if args.check:
+        first = tracer.frames[0]
+        missing = [name for name in ('glUniformMatrix4fv', 'glUniform3fv') if name not in first]
+        assert not missing, '首帧未统计到%s' % ', '.join(missing)
+        print('首帧uniform调用：%s' % ', '.join('%s x%d' % (name, first[name][0]) for name in sorted(first) if name.startswith('glUniform')))
+        return
+
+    tracer.report()
+    if args.chrome:
+        tracer.save_chrome_trace(args.chrome)
+
+if __name__ == '__main__':
+    main()
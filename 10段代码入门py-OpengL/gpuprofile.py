@@ -0,0 +1,320 @@
+"""基于GL_TIME_ELAPSED查询的GPU耗时分析
+
+GpuProfiler.scope(name)以一个计时查询包围一段GL命令。查询结果要等GPU执行完这些命令才能
+读取，立即读取会使CPU等待GPU、破坏流水线，因此查询对象循环使用：每帧结束时把本帧的查询
+放入待读队列，之后每帧开始时只读取已经可用（GL_QUERY_RESULT_AVAILABLE）的查询，从不
+等待；待读的帧超过max_pending时丢弃最旧的一帧。各范围的GPU耗时通常滞后1～3帧得到。
+
+attach(scene)自动为场景添加范围：glClear为'clear'，每次绘制调用（glDrawElements、
+glBegin/glEnd、glutSolidSphere等）为'draw 序号 函数名'，glutSwapBuffers为'swap'，并将
+scene.render()的每次调用作为一帧。GL_TIME_ELAPSED查询不能嵌套，已有范围时内层范围不计时；
+整帧的GPU耗时'frame'由帧首尾的两个GL_TIMESTAMP查询相减得到，不占用范围。
+
+llvmpipe等软件光栅化器把光栅化推迟到刷新命令时成批执行，各绘制范围主要反映顶点处理和
+命令准备的耗时，光栅化的耗时计入'swap'和'frame'；上下文的首个计时查询在llvmpipe上返回无效的
+大数值，此类结果被忽略并计入invalid。
+
+命令行（离屏运行）：python gpuprofile.py 10-diffuse-specular-shine.py --frames 120 --every 30
+"""
+
+if __name__ == '__main__':
+    import offscreen                                            # 须在导入OpenGL之前选择离屏平台
+
+import time
+import ctypes
+import argparse
+import contextlib
+import collections
+from OpenGL.GL import *
+from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v as _glGetQueryObjectui64v
+from gltrace import scene_namespaces
+
+DRAW_FUNCS = ('glDrawArrays', 'glDrawElements', 'glDrawArraysInstanced', 'glDrawElementsInstanced',
+    'glDrawRangeElements', 'glMultiDrawArrays', 'glMultiDrawElements', 'glCallList', 'glCallLists',
+    'glutSolidSphere', 'glutWireSphere', 'glutSolidCone', 'glutWireCone', 'glutSolidCube', 'glutWireCube')
+MAX_NS = 10**10                                                 # 超过10秒的结果视为无效（llvmpipe上下文的首个查询）
+
+class GpuProfiler:
+    """GPU计时查询的环形缓冲"""
+
+    def __init__(self, every=0, max_pending=8, history=300):
+        """构造函数
+
+        every       - 每隔多少帧向标准输出打印一次汇总，0表示不打印
+        max_pending - 最多等待读取的帧数
+        history     - 保留最近多少帧的结果
+        """
+
+        self.every = every
+        self.max_pending = max_pending
+        self.frames = collections.deque(maxlen=history)         # 已读取的帧：(帧序号, {范围名称: 耗时ms})
+        self.latest = dict()                                    # 最近读取的一帧中各范围的耗时(ms)
+        self.frame_index = -1                                   # 当前帧序号
+        self.dropped = 0                                        # 因等待过久被丢弃的帧数
+        self.invalid = 0                                        # 驱动返回无效结果的查询数
+
+        self._free = {GL_TIME_ELAPSED:list(), GL_TIMESTAMP:list()}  # 可复用的查询对象，查询对象首次使用后类型不能改变
+        self._pending = collections.deque()                     # 等待读取的帧：(帧序号, [(范围名称, 查询对象)], 帧首尾的时间戳查询)
+        self._current = None                                    # 当前帧的查询列表，不在帧内时为None
+        self._stamp = None                                      # 当前帧开始时的时间戳查询
+        self._active = None                                     # 正在计时的范围名称
+        self._draws = 0                                         # 当前帧的绘制调用序号
+        self._began = False                                     # glBegin时是否开始了范围
+        self._sums = dict()                                     # 汇总：范围名称 -> [帧数, 总耗时ms, 最大耗时ms]
+        self._result = ctypes.c_uint64(0)
+        self._saved = list()
+
+    def _query(self, target=GL_TIME_ELAPSED):
+        """取一个空闲的查询对象"""
+
+        free = self._free[target]
+        if not free:
+            free.extend(int(q) for q in glGenQueries(16))
+        return free.pop()
+
+    def begin(self, name):
+        """开始一个范围。已有范围正在计时或不在帧内时返回False"""
+
+        if self._active is not None or self._current is None:
+            return False
+
+        q = self._query()
+        glBeginQuery(GL_TIME_ELAPSED, q)
+        self._active = name
+        self._current.append((name, q))
+
+        return True
+
+    def end(self):
+        """结束当前范围"""
+
+        glEndQuery(GL_TIME_ELAPSED)
+        self._active = None
+
+    @contextlib.contextmanager
+    def scope(self, name):
+        """以GPU计时查询包围with语句块中的GL命令"""
+
+        started = self.begin(name)
+        try:
+            yield
+        finally:
+            if started:
+                self.end()
+
+    def begin_frame(self):
+        """开始一帧：先读取已经可用的查询结果"""
+
+        self.collect()
+        self.frame_index += 1
+        self._current = list()
+        self._draws = 0
+        self._stamp = self._query(GL_TIMESTAMP)
+        glQueryCounter(self._stamp, GL_TIMESTAMP)
+
+    def end_frame(self):
+        """结束一帧，本帧的查询进入待读队列"""
+
+        if self._active is not None:
+            self.end()
+        stamp = self._query(GL_TIMESTAMP)
+        glQueryCounter(stamp, GL_TIMESTAMP)
+        self._pending.append((self.frame_index, self._current, (self._stamp, stamp)))
+        self._current = None
+
+        while len(self._pending) > self.max_pending:
+            self._release(*self._pending.popleft()[1:])
+            self.dropped += 1
+
+        if self.every and (self.frame_index + 1) % self.every == 0:
+            self.report()
+
+    def _release(self, queries, stamps):
+        """回收查询对象"""
+
+        self._free[GL_TIME_ELAPSED].extend(q for name, q in queries)
+        self._free[GL_TIMESTAMP].extend(stamps)
+
+    def _value(self, q):
+        """读取查询结果(ns)，调用前须确认结果可用"""
+
+        _glGetQueryObjectui64v(q, GL_QUERY_RESULT, ctypes.byref(self._result))
+        return self._result.value
+
+    def collect(self):
+        """读取全部已经可用的查询结果，不等待GPU。返回读取的帧数"""
+
+        n = 0
+        while self._pending:
+            index, queries, stamps = self._pending[0]
+            if not glGetQueryObjectiv(stamps[1], GL_QUERY_RESULT_AVAILABLE):
+                break                                           # 查询按顺序完成，帧末的时间戳可用即全部可用
+
+            times = dict()
+            for name, q in queries + [('frame', None)]:
+                ns = self._value(stamps[1]) - self._value(stamps[0]) if q is None else self._value(q)
+                if ns > MAX_NS:
+                    self.invalid += 1
+                    continue
+                times[name] = times.get(name, 0.0) + ns * 1e-6
+
+            self._pending.popleft()
+            self._release(queries, stamps)
+            self._record(index, times)
+            n += 1
+
+        return n
+
+    def _record(self, index, times):
+        """保存一帧的结果并累加到汇总"""
+
+        self.frames.append((index, times))
+        self.latest = times
+        for name, t in times.items():
+            item = self._sums.get(name)
+            if item is None:
+                item = self._sums[name] = [0, 0.0, 0.0]
+            item[0] += 1
+            item[1] += t
+            item[2] = max(item[2], t)
+
+    def summary(self, reset=True):
+        """返回各范围的(名称, 帧数, 平均耗时ms, 最大耗时ms)，reset为True时清空汇总"""
+
+        rows = [(name, n, total/n, peak) for name, (n, total, peak) in self._sums.items()]
+        if reset:
+            self._sums = dict()
+
+        return rows
+
+    def report(self, reset=True):
+        """向标准输出打印自上次汇总以来各范围的GPU耗时"""
+
+        rows = self.summary(reset)
+        latency = self.frame_index - self.frames[-1][0] if self.frames else 0
+        print('GPU耗时（第%d帧，结果滞后%d帧，丢弃%d帧）' % (self.frame_index, latency, self.dropped))
+        print('%-32s %8s %12s %12s' % ('范围', '帧数', '平均(ms)', '最大(ms)'))
+        for name, n, mean, peak in rows:
+            print('%-32s %8d %12.3f %12.3f' % (name, n, mean, peak))
+
+    def finish(self):
+        """等待GPU完成并读取全部待读的查询，仅用于结束分析时"""
+
+        glFinish()
+        while self._pending and self.collect() == 0:
+            time.sleep(0.001)
+
+    def _wrap(self, name, func):
+        """返回以范围包围原函数的函数"""
+
+        if name == 'glClear':
+            def scoped(*args, **kwds):
+                with self.scope('clear'):
+                    return func(*args, **kwds)
+        elif name == 'glutSwapBuffers':
+            def scoped(*args, **kwds):
+                with self.scope('swap'):
+                    return func(*args, **kwds)
+        elif name == 'glBegin':                                 # glBegin/glEnd之间不能开始查询
+            def scoped(*args, **kwds):
+                self._draws += 1
+                self._began = self.begin('draw %d %s' % (self._draws, name))
+                return func(*args, **kwds)
+        elif name == 'glEnd':
+            def scoped(*args, **kwds):
+                result = func(*args, **kwds)
+                if self._began:
+                    self._began = False
+                    self.end()
+                return result
+        else:
+            def scoped(*args, **kwds):
+                self._draws += 1
+                with self.scope('draw %d %s' % (self._draws, name)):
+                    return func(*args, **kwds)
+
+        scoped.__wrapped__ = func
+        return scoped
+
+    def attach(self, scene):
+        """为场景的清屏、绘制调用和交换缓冲区添加范围，并将scene.render()的每次调用作为一帧"""
+
+        names = ('glClear', 'glutSwapBuffers', 'glBegin', 'glEnd') + DRAW_FUNCS
+        for ns in scene_namespaces(scene):
+            for name in names:
+                if name in ns and getattr(ns[name], '__wrapped__', None) is None:
+                    self._saved.append((ns, name, ns[name]))
+                    ns[name] = self._wrap(name, ns[name])
+
+        render = scene.render
+        def profiled_render(*args, **kwds):
+            self.begin_frame()
+            try:
+                return render(*args, **kwds)
+            finally:
+                self.end_frame()
+
+        scene.render = profiled_render
+        self._scene = scene
+
+        return self
+
+    def detach(self):
+        """恢复场景和全部被替换的函数"""
+
+        for ns, name, func in reversed(self._saved):
+            ns[name] = func
+        self._saved = list()
+
+        scene = getattr(self, '_scene', None)
+        if scene is not None and 'render' in vars(scene):
+            del scene.render
+        self._scene = None
+
+class _FlushOnSwap:
+    """与offscreen._NoGlut相同地替换依赖GLUT窗口的函数，但离屏渲染没有交换缓冲区，以glFlush代替
+    glutSwapBuffers提交本帧的命令。offscreen在使用时才导入，以免导入本模块时改变OpenGL平台"""
+
+    def __init__(self, scene):
+        import offscreen
+
+        self.noglut = offscreen._NoGlut(scene)
+        self.noglut.SUBSTITUTES = dict(offscreen._NoGlut.SUBSTITUTES, glutSwapBuffers=lambda *args: glFlush())
+
+    def __enter__(self):
+        self.noglut.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.noglut.__exit__(*exc)
+
+def main():
+    """命令行入口：离屏渲染示例并统计各范围的GPU耗时"""
+
+    import offscreen
+    from program import _load_demo
+
+    parser = argparse.ArgumentParser(description='统计示例场景各渲染阶段的GPU耗时')
+    parser.add_argument('demo', help='示例文件，如10-diffuse-specular-shine.py')
+    parser.add_argument('--frames', type=int, default=120, help='渲染帧数')
+    parser.add_argument('--every', type=int, default=30, help='每隔多少帧打印一次汇总')
+    parser.add_argument('--size', default='960x640', help='画布大小')
+    parser.add_argument('--haxis', default='y', help='高度轴')
+    args = parser.parse_args()
+
+    size = tuple(int(v) for v in args.size.lower().split('x'))
+    app = offscreen.find_scene_class(_load_demo(args.demo))(haxis=args.haxis, size=size)
+
+    offscreen.prepare(app, size)
+    with _FlushOnSwap(app):
+        profiler = GpuProfiler(every=args.every).attach(app)
+        for i in range(args.frames):
+            app.render()
+        profiler.finish()
+        profiler.detach()
+
+    if profiler.summary(reset=False):
+        profiler.report()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""实例化绘制：以一次绘制调用绘制同一模型的大量副本
+
+InstancedMesh将每个实例的模型矩阵和颜色保存在一个实例VBO中（每个实例20个float：
+4x4模型矩阵按行存放，与相机矩阵的约定相同，即每行对应着色器中mat4的一列；其后为RGBA
+颜色），通过实例除数为1的顶点属性传给着色器，draw()只调用一次glDrawElementsInstanced。
+实例数据可以是(N,4,4)的模型矩阵数组，也可以是位置、缩放和颜色数组（由NumPy批量转换为
+矩阵）。实例数超过已分配的容量时按2倍扩容，此后更新实例只调用glBufferSubData。
+"""
+
+import time
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.arrays import vbo
+from program import ShaderProgram
+from geometry import Geometry
+import meshes
+
+VSHADER = """
+    #version 330 core
+
+    in vec4 a_Position;
+    in vec3 a_Normal;
+    in mat4 a_ModelMatrix;
+    in vec4 a_Color;
+    uniform mat4 u_ProjMatrix;
+    uniform mat4 u_ViewMatrix;
+    uniform vec3 u_LightDir;
+    uniform vec3 u_AmbientColor;
+    out vec4 v_Color;
+
+    void main() {
+        gl_Position = u_ProjMatrix * u_ViewMatrix * a_ModelMatrix * a_Position;
+        vec3 normal = normalize(mat3(a_ModelMatrix) * a_Normal);
+        float diffuse = max(0.0, dot(normalize(-u_LightDir), normal));
+        v_Color = vec4(a_Color.rgb * min(u_AmbientColor + diffuse, vec3(1.0)), a_Color.a);
+    }
+"""
+
+FSHADER = """
+    #version 330 core
+
+    in vec4 v_Color;
+
+    void main() {
+        gl_FragColor = v_Color;
+    }
+"""
+
+_FLOATS = 20                                                    # 每个实例的float数：模型矩阵16个、颜色4个
+
+class InstancedMesh:
+    """实例化绘制的网格"""
+
+    def __init__(self, mesh, gltype=GL_TRIANGLES, capacity=1024, vao=True):
+        """构造函数
+
+        mesh        - meshes中生成器返回的网格字典（vertices、normals、indices）
+        gltype      - 图元类型
+        capacity    - 初始实例容量
+        vao         - 是否使用VAO
+        """
+
+        self.program = ShaderProgram(VSHADER, FSHADER)
+        self.data = np.zeros((capacity, _FLOATS), dtype=np.float32)    # 实例数据，前count行有效
+        self.count = 0                                          # 实例数
+
+        self.light_dir = np.array([-1, -1, -1], dtype=np.float32)     # 光线照射方向
+        self.ambient = np.array([0.3, 0.3, 0.3], dtype=np.float32)    # 环境光颜色
+
+        self.buffer = vbo.VBO(self.data, usage=GL_DYNAMIC_DRAW)
+        self.geometry = Geometry(gltype, self.program, vao=vao)
+        self.geometry.attrib('a_Position', mesh['vertices'])
+        self.geometry.attrib('a_Normal', mesh['normals'])
+        self.geometry.elements(mesh['indices'])
+
+        loc = self.program.attrib('a_ModelMatrix')              # mat4属性占用连续4个位置，每个位置一列
+        for i in range(4):
+            self.geometry.attrib(loc+i, self.buffer, 4, stride=_FLOATS*4, offset=16*i, divisor=1)
+        self.geometry.attrib('a_Color', self.buffer, 4, stride=_FLOATS*4, offset=64, divisor=1)
+        self.geometry.prepare()
+
+    def _reserve(self, n):
+        """确保容量不小于n，扩容时重新分配VBO（缓冲区对象不变，VAO中记录的属性指针仍然有效）"""
+
+        if n <= len(self.data):
+            return
+
+        capacity = max(n, 2*len(self.data))
+        data = np.zeros((capacity, _FLOATS), dtype=np.float32)
+        data[:self.count] = self.data[:self.count]
+        self.data = data
+        self.buffer.set_array(self.data)
+
+    def _upload(self, n):
+        """将前n个实例上传到实例VBO"""
+
+        self.count = n
+        respecified = not self.buffer.copied                    # 扩容后首次bind()以glBufferData上传整个数组
+        self.buffer.bind()
+        if not respecified:
+            glBufferSubData(GL_ARRAY_BUFFER, 0, self.data[:n].nbytes, self.data[:n])
+        self.buffer.unbind()
+
+    def _colors(self, colors, n):
+        """写入颜色，colors可以是(N,3)、(N,4)数组或单个颜色，默认为白色"""
+
+        if colors is None:
+            self.data[:n, 16:] = 1.0
+        else:
+            colors = np.asarray(colors, dtype=np.float32)
+            channels = colors.shape[-1]
+            self.data[:n, 16:16+channels] = colors
+            if channels == 3:
+                self.data[:n, 19] = 1.0
+
+    def set_matrices(self, matrices, colors=None):
+        """以(N,4,4)的模型矩阵数组设置实例"""
+
+        matrices = np.asarray(matrices, dtype=np.float32).reshape(-1, 16)
+        n = len(matrices)
+        self._reserve(n)
+        self.data[:n, :16] = matrices
+        self._colors(colors, n)
+        self._upload(n)
+
+    def set_instances(self, positions, scales=1.0, colors=None):
+        """以(N,3)的位置数组、缩放（标量、(N,)或(N,3)数组）和颜色设置实例"""
+
+        positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        n = len(positions)
+        self._reserve(n)
+
+        scales = np.broadcast_to(np.asarray(scales, dtype=np.float32).reshape(-1, 1) if np.ndim(scales) == 1
+            else np.asarray(scales, dtype=np.float32), (n, 3))
+        m = self.data[:n, :16]
+        m[:] = 0.0
+        m[:, (0, 5, 10)] = scales                               # 对角线：x、y、z方向的缩放
+        m[:, 12:15] = positions                                 # 最后一行：平移
+        m[:, 15] = 1.0
+        self._colors(colors, n)
+        self._upload(n)
+
+    def draw(self, pmat, vmat):
+        """以一次实例化绘制调用绘制全部实例"""
+
+        if self.count == 0:
+            return
+
+        self.program.use()
+        self.program['u_ProjMatrix'] = pmat
+        self.program['u_ViewMatrix'] = vmat
+        self.program['u_LightDir'] = self.light_dir
+        self.program['u_AmbientColor'] = self.ambient
+        self.geometry.draw(instances=self.count)
+        self.program.unuse()
+
+    def delete(self):
+        """删除VAO、VBO和着色器程序"""
+
+        self.geometry.delete()
+        self.program.delete()
+
+def _loop_program():
+    """逐个实例以uniform变量传递模型矩阵和颜色的着色器程序，对应改造前的逐模型绘制方式"""
+
+    vshader_src = VSHADER.replace('in mat4 a_ModelMatrix;', 'uniform mat4 u_ModelMatrix;').replace('in vec4 a_Color;', 'uniform vec4 u_Color;')
+    vshader_src = vshader_src.replace('a_ModelMatrix', 'u_ModelMatrix').replace('a_Color', 'u_Color')
+    return ShaderProgram(vshader_src, FSHADER)
+
+def benchmark(counts=(1000, 10000, 50000), frames=20):
+    """对比逐个实例调用glDrawElements和一次glDrawElementsInstanced绘制n个六面体的耗时"""
+
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+    from camera import Camera
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(320, 240)
+    glutCreateWindow('Instancing benchmark')
+    glutHideWindow()
+    glViewport(0, 0, 320, 240)
+    glEnable(GL_DEPTH_TEST)
+
+    camera = Camera(dist=120.0, fovy=60.0, aspect=320/240)
+    mesh = meshes.cube(size=0.5)
+    rng = np.random.default_rng(0)
+
+    loop_program = _loop_program()
+    single = Geometry(GL_TRIANGLES, loop_program)
+    single.attrib('a_Position', mesh['vertices'])
+    single.attrib('a_Normal', mesh['normals'])
+    single.elements(mesh['indices'])
+    single.prepare()
+    instanced = InstancedMesh(mesh)
+
+    def timed(draw, n_frames):
+        t = list()
+        for i in range(n_frames):
+            t0 = time.perf_counter()
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            draw()
+            glFinish()
+            t.append(time.perf_counter() - t0)
+        return np.median(t[1:])                                 # 去掉预热帧
+
+    print('%8s %-8s %12s %16s %8s' % ('实例数', '方式', '每帧(ms)', '实例/秒', '加速比'))
+    for n in counts:
+        positions = rng.uniform(-40, 40, (n, 3))
+        colors = rng.uniform(0.2, 1.0, (n, 3))
+        instanced.set_instances(positions, 1.0, colors)
+        matrices = instanced.data[:n, :16].reshape(n, 4, 4).copy()
+        rgba = instanced.data[:n, 16:].copy()
+
+        def loop():
+            loop_program.use()
+            loop_program['u_ProjMatrix'] = camera.pmat
+            loop_program['u_ViewMatrix'] = camera.vmat
+            loop_program['u_LightDir'] = instanced.light_dir
+            loop_program['u_AmbientColor'] = instanced.ambient
+            for i in range(n):
+                loop_program['u_ModelMatrix'] = matrices[i]
+                loop_program['u_Color'] = rgba[i]
+                single.draw()
+            loop_program.unuse()
+
+        t_loop = timed(loop, max(2, min(frames, 20000//n + 1)))
+        t_inst = timed(lambda: instanced.draw(camera.pmat, camera.vmat), frames)
+        print('%8d %-8s %12.2f %16.0f %8s' % (n, '逐个绘制', t_loop*1e3, n/t_loop, ''))
+        print('%8d %-8s %12.2f %16.0f %7.0fx' % (n, '实例化', t_inst*1e3, n/t_inst, t_loop/t_inst))
+
+    single.delete()
+    instanced.delete()
+
+if __name__ == '__main__':
+    benchmark()
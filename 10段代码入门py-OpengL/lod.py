@@ -0,0 +1,182 @@
+"""按距离选择细节层次（LOD）的参数化网格
+
+LodMesh预先以meshes中的生成器生成同一网格的若干分辨率，各层的顶点属性依次拼接到共享的VBO中，
+索引加上所在层的顶点偏移后拼接到一个索引VBO中，draw(level)只绑定一次VAO、以该层的索引范围
+调用一次glDrawElements。以formats指定各属性的编码时，各层的顶点属性由vertexformat.VertexFormat
+量化后交错存放在一个VBO中。
+
+每帧由包围球在屏幕上的投影直径（像素）选择层次：一层有T个三角形时，约一半朝向相机，投影直径为
+s像素的球面上每个三角形的边长约为pixels像素需要s = sqrt(T * pixels**2 / pi)，因此投影直径超过
+某层的这一尺寸时改用更精细的一层。变粗时要求投影直径再缩小hysteresis（比例），避免在阈值附近
+来回切换造成闪烁（popping）。select()接受数组，可一次为大量网格实例选择层次。
+"""
+
+import time
+import ctypes
+import numpy as np
+from OpenGL.GL import *
+from geometry import Geometry
+from vertexformat import VertexFormat
+
+def screen_size(centers, radius, vmat, pmat, width):
+    """返回半径为radius、中心为centers（(3,)或(N,3)）的包围球在宽度为width像素的画布上的投影直径（像素）"""
+
+    centers = np.asarray(centers, dtype=np.float64)
+    z = centers @ vmat[:3, 2] + vmat[3, 2]                  # 视点坐标系中的z，相机前方为负
+    dist = np.maximum(-z, 1e-6)
+
+    return radius * pmat[0, 0] / dist * width
+
+class LodMesh:
+    """多分辨率参数化网格"""
+
+    def __init__(self, generator, levels, program, attribs, gltype=GL_TRIANGLES, vao=True, pixels=6.0, hysteresis=0.2, formats=None, **params):
+        """构造函数
+
+        generator   - meshes中的生成器，如meshes.sphere
+        levels      - 各层的生成器参数（字典），从粗到细排列，如[{'rows':12, 'cols':24}, ...]
+        program     - ShaderProgram对象
+        attribs     - 属性名称到网格数组名称的字典，如{'a_Position':'vertices', 'a_Normal':'normals'}，
+                      第一项须为顶点坐标
+        pixels      - 三角形边长的目标像素数
+        hysteresis  - 变粗时投影直径须再缩小的比例
+        formats     - None（各属性为独立的float32 VBO），vertexformat的编码（如'auto'，用于全部属性），
+                      或属性名称到编码的字典（未列出的属性为'float'）
+        params      - 各层共同的生成器参数，如r=1
+        """
+
+        self.gltype = gltype
+        self.hysteresis = hysteresis
+
+        parts = [generator(**dict(params, **level)) for level in levels]
+        position = next(iter(attribs.values()))
+        counts = [len(mesh['indices'].ravel()) for mesh in parts]
+        bases = np.cumsum([0] + [len(mesh[position]) for mesh in parts])
+
+        indices = np.concatenate([mesh['indices'].ravel().astype(np.uint32) + base for mesh, base in zip(parts, bases)])
+        if bases[-1] <= 0xFFFF:
+            indices = indices.astype(np.uint16)
+
+        self.geometry = Geometry(gltype, program, vao=vao)      # 各层共享的VBO和索引VBO
+        self.format = None                                      # 混合顶点格式，formats为None时不使用
+        if formats is None:
+            for name, key in attribs.items():
+                self.geometry.attrib(name, np.vstack([mesh[key] for mesh in parts]).astype(np.float32))
+        else:
+            if isinstance(formats, str):
+                formats = dict.fromkeys(attribs, formats)
+            self.format = VertexFormat([(name, key, formats.get(name, 'float')) for name, key in attribs.items()])
+            merged = {key: np.vstack([mesh[key] for mesh in parts]) for key in attribs.values()}
+            self.format.attach(self.geometry, self.format.pack(merged))
+        self.geometry.elements(indices)
+        self.geometry.prepare()
+
+        offsets = np.cumsum([0] + counts[:-1]) * indices.itemsize
+        self.levels = [(int(offset), count) for offset, count in zip(offsets, counts)]  # 各层：(索引的字节偏移量, 索引数)
+        self.triangles = np.array(counts) // 3                  # 各层的三角形数
+        self.vertices = np.diff(bases)                          # 各层的顶点数
+        self.radius = float(np.linalg.norm(parts[-1][position], axis=1).max())  # 包围球半径（以原点为中心）
+        self.thresholds = np.sqrt(self.triangles * pixels**2 / np.pi)           # 各层适用的最大投影直径
+
+    def level_for(self, size):
+        """不考虑滞后，返回投影直径为size像素时的层次"""
+
+        return np.searchsorted(self.thresholds[:-1], size)      # 比投影直径小的阈值个数，即不够精细的层数
+
+    def select(self, size, current=None):
+        """返回投影直径为size像素时的层次。current为当前层次，变粗时须满足滞后条件"""
+
+        level = self.level_for(size)
+        if current is None:
+            return level
+
+        coarser = self.level_for(np.asarray(size) * (1 + self.hysteresis))
+        return np.where(level > current, level, np.where(coarser < current, coarser, current))
+
+    def draw(self, level):
+        """以一次绘制调用绘制第level层"""
+
+        offset, count = self.levels[int(level)]
+        self.geometry.bind()
+        glDrawElements(self.gltype, count, self.geometry.index_type, ctypes.c_void_p(offset))
+        self.geometry.unbind()
+
+    def delete(self):
+        """删除VAO和VBO"""
+
+        self.geometry.delete()
+
+def benchmark(n=400, frames=10):
+    """n个球面沿视线方向由近及远排列：对比固定最高精度和按距离选择层次时每帧的三角形数和耗时，
+    以及投影直径在阈值附近抖动时有无滞后的层次切换次数"""
+
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+    from camera import Camera
+    from instancing import _loop_program
+    import meshes
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(640, 480)
+    glutCreateWindow('LOD benchmark')
+    glutHideWindow()
+    glViewport(0, 0, 640, 480)
+    glEnable(GL_DEPTH_TEST)
+
+    program = _loop_program()
+    levels = [{'rows':12, 'cols':24}, {'rows':23, 'cols':45}, {'rows':46, 'cols':90}, {'rows':90, 'cols':180}]
+    mesh = LodMesh(meshes.sphere, levels, program, {'a_Position':'vertices', 'a_Normal':'normals'}, r=1.0)
+
+    camera = Camera(haxis='z', dist=10.0, fovy=40.0, aspect=640/480)
+    forward = (camera.oecs - camera.cam) / np.linalg.norm(camera.oecs - camera.cam)
+    right = np.cross(forward, camera.up)
+    depth = np.linspace(5, 400, n)                              # 与相机的距离
+    offset = np.random.default_rng(0).uniform(-0.3, 0.3, (n, 2)) * depth[:, None]
+    centers = (camera.cam + forward*depth[:, None] + right*offset[:, :1] + camera.up*offset[:, 1:]).astype(np.float32)
+    matrices = np.tile(np.eye(4, dtype=np.float32), (n, 1, 1))
+    matrices[:, 3, :3] = centers
+
+    def run(select):
+        t, triangles = list(), 0
+        for i in range(frames):
+            t0 = time.perf_counter()
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            program.use()
+            program['u_ProjMatrix'] = camera.pmat
+            program['u_ViewMatrix'] = camera.vmat
+            program['u_LightDir'] = np.array([-1, -1, -1], dtype=np.float32)
+            program['u_AmbientColor'] = np.array([0.3, 0.3, 0.3], dtype=np.float32)
+            program['u_Color'] = np.array([0.8, 0.8, 1.0, 1.0], dtype=np.float32)
+            chosen = select()
+            for m, level in zip(matrices, chosen):
+                program['u_ModelMatrix'] = m
+                mesh.draw(level)
+            program.unuse()
+            glFinish()
+            t.append(time.perf_counter() - t0)
+            triangles = int(mesh.triangles[chosen].sum())
+        return np.median(t), triangles, np.bincount(chosen, minlength=len(levels))
+
+    sizes = screen_size(centers, mesh.radius, camera.vmat, camera.pmat, 640)
+    finest = np.full(n, len(levels) - 1)
+    print('球面数：%d，各层三角形数：%s，各层最大投影直径(像素)：%s' % (n, mesh.triangles.tolist(), np.round(mesh.thresholds).tolist()))
+    print('%-10s %12s %12s %20s' % ('方式', '每帧(ms)', '三角形数', '各层数量'))
+    for name, select in (('最高精度', lambda: finest), ('按距离', lambda: mesh.select(sizes))):
+        t, triangles, hist = run(select)
+        print('%-10s %12.2f %12d %20s' % (name, t*1e3, triangles, hist.tolist()))
+
+    size = mesh.thresholds[1] * (1 + 0.05 * np.sin(np.arange(200)))   # 投影直径在阈值附近抖动±5%
+    for name, h in (('无滞后', 0.0), ('滞后%d%%' % (mesh.hysteresis*100), mesh.hysteresis)):
+        mesh.hysteresis, level, switches = h, None, 0
+        for s in size:
+            new = mesh.select(s, level)
+            switches += level is not None and new != level
+            level = new
+        print('%-10s 200帧切换层次%d次' % (name, switches))
+
+    mesh.delete()
+    program.delete()
+
+if __name__ == '__main__':
+    benchmark()
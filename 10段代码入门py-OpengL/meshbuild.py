@@ -0,0 +1,346 @@
+"""在进程池中按行带生成大型网格，经共享内存返回并流式上传到预先分配的VBO
+
+StreamedMesh把经纬度球面或高度场的顶点网格按行切分为若干行带，提交给ProcessPoolExecutor并行
+生成。各工作进程把顶点数据和三角面索引直接写入主进程创建的multiprocessing.shared_memory，只返回
+行带的序号，不经pickle传递大数组。GL线程每帧调用update()，以glBufferSubData把已完成的行带从
+共享内存写入预先分配的顶点VBO和索引VBO，draw()只绘制已上传的行带，网格逐步出现。
+
+顶点按GL_T2F_N3F_V3F混合数组的布局保存（纹理坐标2、法向量3、顶点坐标3，共8个float32），
+未提供着色器程序时以固定管线的混合数组绘制。球面的顶点、索引和纹理坐标与meshes.sphere相同。
+
+行带的三角形要用到下一行的顶点，因此每个行带生成并上传的顶点行比三角形行多一行，相邻行带
+重叠的一行由两个进程写入相同的值。工作进程以spawn方式启动，首次使用进程池时有启动开销。
+
+某个行带生成失败（或进程池损坏）时，update()取消其余行带、释放共享内存，并抛出一次该异常，
+此后不再上传；异常保存在error中。未调用delete()而丢弃的网格在析构时释放共享内存，也可以用作
+with语句的上下文管理器。
+"""
+
+import os
+import time
+import ctypes
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import get_context, shared_memory
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.arrays import vbo
+from geometry import Geometry
+
+FLOATS = 8                                                      # 每个顶点的float32个数
+LAYOUT = {'texcoords':(2, 0), 'normals':(3, 8), 'vertices':(3, 20)}  # 顶点属性：(分量数, 字节偏移量)
+
+_executor = None                                                # 共享的进程池，首次使用时创建
+_executor_workers = 0
+
+def _pool(workers=None):
+    """返回共享的进程池，workers改变或工作进程异常退出使进程池损坏时重新创建"""
+
+    global _executor, _executor_workers
+
+    workers = workers or os.cpu_count() or 1
+    if _executor is None or _executor_workers != workers or _executor._broken:
+        if _executor is not None:
+            _executor.shutdown(wait=not _executor._broken)
+        _executor = ProcessPoolExecutor(workers, mp_context=get_context('spawn'))
+        _executor_workers = workers
+
+    return _executor
+
+def _sphere_rows(r0, r1, rows, cols, r=1.0):
+    """返回经纬度球面第r0至r1-1行顶点的(纹理坐标, 法向量, 顶点坐标)"""
+
+    gv = np.linspace(0.5*np.pi, -0.5*np.pi, rows)[r0:r1, None]
+    gu = np.linspace(0, 2*np.pi, cols)[None, :]
+    normals = np.dstack((np.cos(gv)*np.cos(gu), np.cos(gv)*np.sin(gu), np.broadcast_to(np.sin(gv), (r1-r0, cols))))
+    texcoords = np.dstack(np.meshgrid(np.linspace(0, 1, cols), np.linspace(0, 1, rows)[r0:r1]))
+
+    return texcoords, normals, r*normals
+
+def _heightfield_rows(r0, r1, rows, cols, heights, width=2.0, height=2.0, scale=1.0):
+    """返回高度场第r0至r1-1行顶点的(纹理坐标, 法向量, 顶点坐标)
+
+    heights为shape=(rows,cols)的高度数组，顶点位于xy平面上以原点为中心、宽width高height的矩形内，
+    z为高度乘以scale。法向量由中心差分计算，为此多读取行带上下各一行。
+    """
+
+    a, b = max(r0-1, 0), min(r1+1, rows)
+    dx, dy = width / (cols-1), -height / (rows-1)
+    z = np.asarray(heights[a:b], dtype=np.float64) * scale
+    gz_y, gz_x = np.gradient(z, dy, dx)
+    z, gz_x, gz_y = z[r0-a:r1-a], gz_x[r0-a:r1-a], gz_y[r0-a:r1-a]
+
+    gx = np.broadcast_to(np.linspace(-0.5*width, 0.5*width, cols), z.shape)
+    gy = np.broadcast_to(np.linspace(0.5*height, -0.5*height, rows)[r0:r1, None], z.shape)
+    normals = np.dstack((-gz_x, -gz_y, np.ones_like(z)))
+    normals /= np.linalg.norm(normals, axis=2)[..., None]
+    texcoords = np.dstack(np.meshgrid(np.linspace(0, 1, cols), np.linspace(0, 1, rows)[r0:r1]))
+
+    return texcoords, normals, np.dstack((gx, gy, z))
+
+SURFACES = {'sphere':_sphere_rows, 'heightfield':_heightfield_rows}
+
+def _build_band(kind, names, rows, cols, q0, q1, params):
+    """在工作进程中生成第q0至q1-1行三角形及第q0至q1行顶点，写入共享内存，返回(q0, q1)
+
+    names       - (顶点共享内存, 索引共享内存, 高度共享内存或None)的名称
+    """
+
+    blocks = [shared_memory.SharedMemory(name) for name in names if name]
+    try:
+        vertices = np.ndarray((rows, cols, FLOATS), dtype=np.float32, buffer=blocks[0].buf)
+        indices = np.ndarray(((rows-1)*(cols-1)*6,), dtype=np.uint32, buffer=blocks[1].buf)
+        if len(blocks) > 2:
+            params = dict(params, heights=np.ndarray((rows, cols), dtype=np.float32, buffer=blocks[2].buf))
+
+        texcoords, normals, positions = SURFACES[kind](q0, q1+1, rows, cols, **params)
+        band = vertices[q0:q1+1]
+        band[..., 0:2], band[..., 2:5], band[..., 5:8] = texcoords, normals, positions
+
+        idx = np.arange(q0*cols, (q1+1)*cols, dtype=np.uint32).reshape(-1, cols)
+        a, b, c, d = idx[:-1,:-1], idx[1:,:-1], idx[:-1,1:], idx[1:,1:]
+        indices[q0*(cols-1)*6:q1*(cols-1)*6] = np.dstack((a, b, c, c, b, d)).ravel()
+
+        del vertices, indices, band, params             # 关闭共享内存前须释放全部视图
+    finally:
+        for block in blocks:
+            block.close()
+
+    return q0, q1
+
+class StreamedMesh:
+    """由进程池分行带生成、逐步上传的网格"""
+
+    def __init__(self, kind, rows, cols, program=None, attribs=None, band_rows=None, workers=None, vao=True, **params):
+        """构造函数：分配共享内存和VBO，提交全部行带后立即返回
+
+        kind        - 'sphere'或'heightfield'
+        rows, cols  - 顶点网格的行数和列数
+        program     - ShaderProgram对象，None表示以固定管线的混合数组绘制
+        attribs     - 属性名称到'vertices'、'normals'、'texcoords'的字典，如{'a_Position':'vertices'}
+        band_rows   - 每个行带的三角形行数，默认使每个工作进程约有4个行带
+        workers     - 工作进程数，默认为CPU核数
+        params      - 曲面参数：球面为r；高度场为heights（shape=(rows,cols)的数组）、width、height、scale
+        """
+
+        workers = workers or os.cpu_count() or 1
+        band_rows = band_rows or max(1, -(-(rows-1) // (4*workers)))
+
+        self.rows, self.cols = rows, cols
+        self.count = (rows-1) * (cols-1) * 6                    # 索引总数
+        self.row_indices = (cols-1) * 6                         # 每行三角形的索引数
+        self.bands = [(q, min(q+band_rows, rows-1)) for q in range(0, rows-1, band_rows)]
+        self.uploaded = np.zeros(len(self.bands), dtype=bool)   # 各行带是否已上传
+        self.error = None                                       # 行带生成失败时的异常
+        self.futures = list()
+        self.stats = {'submit':time.perf_counter(), 'first':None, 'built':None, 'uploaded':None, 'upload_time':0.0}
+
+        # 共享内存：顶点、索引和高度场的输入高度
+        self._blocks = [
+            shared_memory.SharedMemory(create=True, size=rows*cols*FLOATS*4),
+            shared_memory.SharedMemory(create=True, size=self.count*4)
+        ]
+        if 'heights' in params:
+            heights = np.ascontiguousarray(params.pop('heights'), dtype=np.float32)
+            self._blocks.append(shared_memory.SharedMemory(create=True, size=heights.nbytes))
+            np.ndarray(heights.shape, dtype=np.float32, buffer=self._blocks[2].buf)[:] = heights
+        self._vertices = np.ndarray((rows*cols, FLOATS), dtype=np.float32, buffer=self._blocks[0].buf)
+        self._indices = np.ndarray((self.count,), dtype=np.uint32, buffer=self._blocks[1].buf)
+
+        # 预先分配VBO，数据由update()逐个行带写入
+        self.vbuf = vbo.VBO(np.empty(self._vertices.nbytes, dtype=np.uint8))
+        self.geometry = Geometry(GL_TRIANGLES, program, vao=vao and program is not None)
+        if program is None:
+            self.geometry.interleaved = (self.vbuf, GL_T2F_N3F_V3F)
+        else:
+            for name, key in attribs.items():
+                size, offset = LAYOUT[key]
+                self.geometry.attrib(name, self.vbuf, size=size, stride=FLOATS*4, offset=offset)
+        self.geometry.elements(np.empty(self.count, dtype=np.uint32), downcast=False)
+        self.geometry.prepare()
+
+        names = tuple(block.name for block in self._blocks) + (None,) * (3 - len(self._blocks))
+        executor = _pool(workers)
+        self.futures = [executor.submit(_build_band, kind, names, rows, cols, q0, q1, params) for q0, q1 in self.bands]
+
+    @property
+    def done(self):
+        """是否已全部上传"""
+
+        return bool(self.uploaded.all())
+
+    @property
+    def progress(self):
+        """已上传的三角形行的比例"""
+
+        return sum(q1 - q0 for (q0, q1), flag in zip(self.bands, self.uploaded) if flag) / max(1, self.rows - 1)
+
+    def update(self, limit=None):
+        """在GL线程中每帧调用：把已完成的行带写入VBO，返回本帧上传的字节数
+
+        limit       - 本帧最多上传的字节数（至少上传一个行带），None表示不限制
+        """
+
+        total = 0
+        if self.error is not None:
+            return total
+
+        for i, future in enumerate(self.futures):
+            if self.uploaded[i] or not future.done():
+                continue
+            if limit is not None and total >= limit:
+                break
+
+            try:
+                q0, q1 = future.result()
+            except Exception as e:
+                self._fail(e)
+                raise
+
+            t0 = time.perf_counter()
+            if self.stats['first'] is None:
+                self.stats['first'] = t0
+            self.stats['built'] = t0                            # 最近一个行带完成生成的时间
+
+            vertices = self._vertices[q0*self.cols:(q1+1)*self.cols]
+            indices = self._indices[q0*self.row_indices:q1*self.row_indices]
+            glBindVertexArray(0) # 绑定索引缓冲区不能改变VAO的状态
+            self.vbuf.bind()
+            glBufferSubData(GL_ARRAY_BUFFER, q0*self.cols*FLOATS*4, vertices.nbytes, vertices)
+            self.vbuf.unbind()
+            self.geometry.indices.bind()
+            glBufferSubData(GL_ELEMENT_ARRAY_BUFFER, q0*self.row_indices*4, indices.nbytes, indices)
+            self.geometry.indices.unbind()
+
+            self.uploaded[i] = True
+            total += vertices.nbytes + indices.nbytes
+            self.stats['upload_time'] += time.perf_counter() - t0
+
+        if total and self.done:
+            self.stats['uploaded'] = time.perf_counter()
+            self._release()
+
+        return total
+
+    def finish(self):
+        """等待全部行带生成完成并上传"""
+
+        wait(self.futures)
+        self.update(None)
+
+    def ranges(self):
+        """返回已上传的连续三角形行范围[(起始行, 结束行), ...]"""
+
+        result = list()
+        for (q0, q1), flag in zip(self.bands, self.uploaded):
+            if not flag:
+                continue
+            if result and result[-1][1] == q0:
+                result[-1] = (result[-1][0], q1)
+            else:
+                result.append((q0, q1))
+
+        return result
+
+    def draw(self):
+        """绘制已上传的行带，全部上传后为一次绘制调用"""
+
+        if not self.uploaded.any():
+            return
+
+        self.geometry.bind()
+        for q0, q1 in self.ranges():
+            glDrawElements(GL_TRIANGLES, (q1-q0)*self.row_indices, GL_UNSIGNED_INT, ctypes.c_void_p(q0*self.row_indices*4))
+        self.geometry.unbind()
+
+    def _fail(self, error):
+        """行带生成失败：取消其余行带并释放共享内存"""
+
+        self.error = error
+        for future in self.futures:
+            future.cancel()
+        self._release()
+
+    def _release(self):
+        """释放共享内存"""
+
+        if not getattr(self, '_blocks', None):
+            return
+
+        self._vertices = self._indices = None
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = list()
+
+    def delete(self):
+        """取消未完成的行带，删除VBO并释放共享内存"""
+
+        for future in self.futures:
+            future.cancel()
+        wait(self.futures)
+        self._release()
+        self.geometry.delete()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.delete()
+
+    def __del__(self):
+        """丢弃未删除的网格时释放共享内存（GL对象须在GL线程中以delete()删除）"""
+
+        self._release()
+
+def benchmark(rows=1000, cols=2000):
+    """对比在GL线程中一次生成rows x cols的球面与进程池分行带生成：首个行带可绘制的时间和全部上传的时间"""
+
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+    import meshes
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(320, 240)
+    glutCreateWindow('Mesh build benchmark')
+    glutHideWindow()
+
+    t0 = time.perf_counter()
+    mesh = meshes.sphere(rows=rows, cols=cols, cache=False)
+    built = time.perf_counter()
+    geometry = Geometry(GL_TRIANGLES, None, vao=False)
+    geometry.interleave(np.hstack((mesh['texcoords'], mesh['normals'], mesh['vertices'])), GL_T2F_N3F_V3F)
+    geometry.elements(mesh['indices'])
+    geometry.interleaved[0].bind()
+    geometry.indices.bind()
+    glFinish()
+    legacy = (built - t0, time.perf_counter() - t0)
+    geometry.indices.unbind()
+    geometry.interleaved[0].unbind()
+    geometry.delete()
+
+    print('球面：%dx%d，%d个顶点，%d个三角形，%d个CPU核' % (rows, cols, rows*cols, (rows-1)*(cols-1)*2, os.cpu_count() or 1))
+    print('%-14s %14s %14s %14s' % ('方式', '首个行带(ms)', '生成(ms)', '全部上传(ms)'))
+    print('%-14s %14.1f %14.1f %14.1f' % ('GL线程中生成', legacy[1]*1e3, legacy[0]*1e3, legacy[1]*1e3))
+
+    counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    for workers in counts:
+        wait([_pool(workers).submit(time.sleep, 0.01) for i in range(workers)])  # 预先启动工作进程
+        streamed = StreamedMesh('sphere', rows, cols, workers=workers)
+        while not streamed.done:
+            if not streamed.update():
+                time.sleep(0.001)
+        glFinish()
+        s = streamed.stats
+        if workers == counts[0]:
+            check = streamed.geometry.interleaved[0]
+            check.bind()
+            data = glGetBufferSubData(GL_ARRAY_BUFFER, 0, rows*cols*FLOATS*4).view(np.float32).reshape(-1, FLOATS)
+            check.unbind()
+            assert np.allclose(data[:, 5:], mesh['vertices'], atol=1e-6) and np.allclose(data[:, :2], mesh['texcoords'])
+        print('%-14s %14.1f %14.1f %14.1f' % ('进程池%d进程' % workers,
+            (s['first'] - s['submit'])*1e3, (s['built'] - s['submit'])*1e3, (s['uploaded'] - s['submit'])*1e3))
+        streamed.delete()
+
+if __name__ == '__main__':
+    benchmark()
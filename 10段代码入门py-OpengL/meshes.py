@@ -0,0 +1,237 @@
+"""参数化网格生成器及其磁盘缓存
+
+生成的网格是一个字典，包含可直接上传至VBO的数组：
+    vertices    - 顶点坐标，float32，shape=(n,3)
+    normals     - 顶点法向量，float32，shape=(n,3)
+    texcoords   - 纹理坐标，float32，shape=(n,2)
+    indices     - 三角面索引，uint32，shape=(m,)
+
+生成结果以.npy文件保存在缓存目录中，文件名由生成器名称和参数决定。再次调用时以
+np.load(mmap_mode='r')直接映射缓存文件，跳过全部生成计算。高度轴为z轴。
+
+各生成器以optimize=True调用时，由meshopt.optimize按顶点缓存重排三角形和顶点，优化结果一并缓存。
+
+参数化曲面的法向量由曲面方程直接求出（球面为单位化的顶点坐标），经度接缝和南北极点处重合的顶点
+法向量相同，不需要normals.vertex_normals的平均和焊接；平面的法向量由normals.face_normals求出。
+"""
+
+import os
+import time
+import hashlib
+import tempfile
+import numpy as np
+import meshopt
+import normals as _normals
+
+VERSION = 1                                                     # 生成算法版本，修改生成算法后须递增
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'meshes')
+KEYS = ('vertices', 'normals', 'texcoords', 'indices')
+
+def _cache_name(name, params):
+    """返回缓存文件名前缀"""
+
+    text = '%s-v%d-%s' % (name, VERSION, repr(sorted(params.items())))
+    return '%s-%s' % (name, hashlib.sha1(text.encode('utf-8')).hexdigest()[:16])
+
+def _load(prefix, cache_dir):
+    """以内存映射方式加载缓存的网格，缓存不完整时返回None"""
+
+    files = [os.path.join(cache_dir, '%s.%s.npy' % (prefix, key)) for key in KEYS]
+    if not all(os.path.isfile(f) for f in files):
+        return None
+
+    try:
+        return {key: np.load(f, mmap_mode='r') for key, f in zip(KEYS, files)}
+    except (ValueError, OSError):
+        return None
+
+def _save(prefix, cache_dir, mesh):
+    """将网格写入缓存目录。先写临时文件再改名，避免其他进程读到不完整的文件"""
+
+    os.makedirs(cache_dir, exist_ok=True)
+    for key in KEYS:
+        fd, tmp = tempfile.mkstemp(suffix='.npy', dir=cache_dir)
+        with os.fdopen(fd, 'wb') as fp:
+            np.save(fp, mesh[key])
+        os.replace(tmp, os.path.join(cache_dir, '%s.%s.npy' % (prefix, key)))
+
+def _finish(vertices, normals, texcoords, indices):
+    """转换为可直接上传的数据类型"""
+
+    return {
+        'vertices':     np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3),
+        'normals':      np.ascontiguousarray(normals, dtype=np.float32).reshape(-1, 3),
+        'texcoords':    np.ascontiguousarray(texcoords, dtype=np.float32).reshape(-1, 2),
+        'indices':      np.ascontiguousarray(indices, dtype=np.uint32).ravel()
+    }
+
+def _grid_indices(rows, cols, offset=0):
+    """返回rows行cols列顶点网格的三角面索引"""
+
+    idx = np.arange(rows*cols).reshape(rows, cols) + offset
+    idx_a, idx_b, idx_c, idx_d = idx[:-1,:-1], idx[1:,:-1], idx[:-1, 1:], idx[1:,1:]
+
+    return np.dstack((idx_a, idx_b, idx_c, idx_c, idx_b, idx_d)).ravel()
+
+def _build_sphere(rows, cols, r):
+    """生成经纬度球面，与地球示例的顶点、索引和纹理坐标布局相同"""
+
+    gv, gu = np.mgrid[0.5*np.pi:-0.5*np.pi:complex(0,rows), 0:2*np.pi:complex(0,cols)]
+    normals = np.dstack((np.cos(gv)*np.cos(gu), np.cos(gv)*np.sin(gu), np.sin(gv)))
+    u, v = np.linspace(0, 1, cols), np.linspace(0, 1, rows)
+    texcoords = np.dstack(np.meshgrid(u, v))
+
+    return _finish(r*normals, normals, texcoords, _grid_indices(rows, cols))
+
+def _build_cube(size):
+    """生成六面体，每个面4个顶点，以便使用各自的法向量和纹理坐标"""
+
+    vs = np.array([
+        [-1,  1,  1], [ 1,  1,  1], [ 1, -1,  1], [-1, -1,  1],
+        [-1,  1, -1], [ 1,  1, -1], [ 1, -1, -1], [-1, -1, -1]
+    ], dtype=np.float64) * size / 2
+
+    quads = np.array([
+        [0, 3, 2, 1], # v0-v1-v2-v3 (front)
+        [4, 0, 1, 5], # v4-v5-v1-v0 (top)
+        [3, 7, 6, 2], # v3-v2-v6-v7 (bottom)
+        [7, 4, 5, 6], # v5-v4-v7-v6 (back)
+        [1, 2, 6, 5], # v1-v5-v6-v2 (right)
+        [4, 7, 3, 0]  # v4-v0-v3-v7 (left)
+    ])
+
+    vertices = vs[quads]                                        # shape=(6,4,3)
+    normals = _normals.face_normals(vertices.reshape(-1, 3), 4*np.arange(6)[:,None] + [0, 1, 2])
+    normals = np.repeat(normals/np.linalg.norm(normals, axis=1)[:,None], 4, axis=0)
+    texcoords = np.tile([[0,0], [0,1], [1,1], [1,0]], (6, 1))
+    indices = (np.array([0, 1, 2, 0, 2, 3]) + 4*np.arange(6)[:,None]).ravel()
+
+    return _finish(vertices, normals, texcoords, indices)
+
+def _build_grid(rows, cols, width, height):
+    """生成xy平面上以原点为中心的矩形网格"""
+
+    gy, gx = np.mgrid[0.5*height:-0.5*height:complex(0,rows), -0.5*width:0.5*width:complex(0,cols)]
+    vertices = np.dstack((gx, gy, np.zeros_like(gx)))
+    normals = np.zeros_like(vertices)
+    normals[...,2] = 1
+    u, v = np.linspace(0, 1, cols), np.linspace(0, 1, rows)
+    texcoords = np.dstack(np.meshgrid(u, v))
+
+    return _finish(vertices, normals, texcoords, _grid_indices(rows, cols))
+
+def _build_revolution(slices, stacks, r0, r1, h, caps):
+    """生成绕z轴旋转的侧面（底面半径r0，顶面半径r1，高h）以及底面和顶面"""
+
+    gv, gu = np.mgrid[1:0:complex(0,stacks+1), 0:2*np.pi:complex(0,slices+1)]   # 与球面相同，从上到下逐行排列
+    radius = r0 + (r1-r0)*gv
+    vertices = [np.dstack((radius*np.cos(gu), radius*np.sin(gu), h*gv)).reshape(-1, 3)]
+
+    n = np.dstack((h*np.cos(gu), h*np.sin(gu), np.full_like(gu, r0-r1)))  # 侧面法向量
+    normals = [(n/np.linalg.norm(n, axis=2)[...,None]).reshape(-1, 3)]
+    texcoords = [np.dstack((gu/(2*np.pi), 1-gv)).reshape(-1, 2)]
+    indices = [_grid_indices(stacks+1, slices+1)]
+    count = (stacks+1) * (slices+1)
+
+    theta = np.linspace(0, 2*np.pi, slices+1)
+    for radius, z, nz, flag in ((r0, 0.0, -1.0, caps[0]), (r1, h, 1.0, caps[1])):
+        if not flag or radius == 0:
+            continue
+
+        ring = np.stack((radius*np.cos(theta), radius*np.sin(theta), np.full_like(theta, z)), axis=1)
+        vertices.append(np.vstack(([0, 0, z], ring)))
+        normals.append(np.tile([0, 0, nz], (slices+2, 1)))
+        texcoords.append(np.vstack(([0.5, 0.5], 0.5 + 0.5*np.stack((np.cos(theta), nz*np.sin(theta)), axis=1))))
+
+        a, b = count + 1 + np.arange(slices), count + 2 + np.arange(slices)
+        if nz < 0:
+            a, b = b, a
+        indices.append(np.stack((np.full(slices, count), a, b), axis=1).ravel())
+        count += slices + 2
+
+    return _finish(np.vstack(vertices), np.vstack(normals), np.vstack(texcoords), np.hstack(indices))
+
+def _build_cylinder(slices, stacks, r, h, caps):
+    """生成圆柱"""
+
+    return _build_revolution(slices, stacks, r, r, h, (caps, caps))
+
+def _build_cone(slices, stacks, r, h, cap):
+    """生成圆锥，锥尖指向z轴正方向"""
+
+    return _build_revolution(slices, stacks, r, 0.0, h, (cap, False))
+
+def _generate(name, builder, params, cache=True, cache_dir=None, optimize=False):
+    """调用生成器，cache为True时优先使用磁盘缓存，optimize为True时按顶点缓存重排三角形和顶点"""
+
+    build = (lambda **kwds: meshopt.optimize(builder(**kwds))[0]) if optimize else builder
+    if not cache:
+        return build(**params)
+
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    prefix = _cache_name(name, dict(params, optimize=True) if optimize else params)
+    mesh = _load(prefix, cache_dir)
+
+    if mesh is None:
+        mesh = build(**params)
+        try:
+            _save(prefix, cache_dir, mesh)
+        except OSError:
+            pass                                                # 缓存目录不可写时仅跳过缓存
+
+    return mesh
+
+def sphere(rows=90, cols=180, r=1.0, **kwds):
+    """经纬度球面，rows为纬线方向顶点数，cols为经线方向顶点数"""
+
+    return _generate('sphere', _build_sphere, {'rows':rows, 'cols':cols, 'r':r}, **kwds)
+
+def cube(size=2.0, **kwds):
+    """以原点为中心、边长为size的六面体"""
+
+    return _generate('cube', _build_cube, {'size':size}, **kwds)
+
+def grid(rows=2, cols=2, width=2.0, height=2.0, **kwds):
+    """xy平面上的矩形网格"""
+
+    return _generate('grid', _build_grid, {'rows':rows, 'cols':cols, 'width':width, 'height':height}, **kwds)
+
+def cylinder(slices=36, stacks=1, r=1.0, h=2.0, caps=True, **kwds):
+    """底面中心位于原点、沿z轴方向的圆柱"""
+
+    return _generate('cylinder', _build_cylinder, {'slices':slices, 'stacks':stacks, 'r':r, 'h':h, 'caps':caps}, **kwds)
+
+def cone(slices=36, stacks=1, r=1.0, h=2.0, cap=True, **kwds):
+    """底面中心位于原点、沿z轴方向的圆锥"""
+
+    return _generate('cone', _build_cone, {'slices':slices, 'stacks':stacks, 'r':r, 'h':h, 'cap':cap}, **kwds)
+
+def benchmark(repeat=5):
+    """报告各生成器冷启动（无缓存）和热启动（映射缓存）的耗时"""
+
+    cases = (
+        ('sphere', sphere, {'rows':90, 'cols':180}),
+        ('sphere', sphere, {'rows':720, 'cols':1440}),
+        ('cube', cube, {}),
+        ('grid', grid, {'rows':1000, 'cols':1000}),
+        ('cylinder', cylinder, {'slices':360, 'stacks':100}),
+        ('cone', cone, {'slices':360, 'stacks':100})
+    )
+
+    print('%-10s %-28s %10s %10s %10s' % ('生成器', '参数', '顶点数', '冷(ms)', '热(ms)'))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name, func, params in cases:
+            t0 = time.perf_counter()
+            mesh = func(cache_dir=cache_dir, **params)
+            cold = time.perf_counter() - t0
+
+            warm = list()
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                func(cache_dir=cache_dir, **params)
+                warm.append(time.perf_counter() - t0)
+
+            print('%-10s %-28s %10d %10.2f %10.2f' % (name, params, len(mesh['vertices']), cold*1e3, min(warm)*1e3))
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,167 @@
+"""索引优化：顶点缓存友好的三角形重排、按读取顺序的顶点重排和16位索引
+
+GPU把最近变换过的顶点保存在很小的变换后顶点缓存中，索引命中缓存的顶点不必再次运行顶点着色器。
+按行生成的网格（如经纬度球面）相邻两行的顶点相隔一整行，行较长时几乎每个三角形都要重新变换
+顶点。以平均缓存未命中率ACMR（每个三角形未命中的顶点数，理想值约0.5，最差为3）衡量：
+
+    tipsify()           Tipsify算法（Sander等，2007）：围绕一个顶点逐个输出其相邻的三角形（扇形），
+                        下一个扇形中心优先选择仍在缓存中、剩余三角形不会挤出缓存的顶点，无候选时
+                        回溯到最近输出的、仍有三角形的顶点
+    reorder_vertices()  按索引首次引用的先后重排顶点，读取顶点数据时顺序访问内存
+    downcast()          最大索引小于0xFFFF（保留为图元重启索引）时转换为uint16，索引内存减半
+
+optimize()对meshes中的网格字典依次执行以上步骤，返回新的网格和ACMR、索引字节数等统计。
+meshes的生成器以optimize=True调用时，优化结果与网格一起保存在磁盘缓存中；Geometry.elements()
+默认调用downcast()。
+"""
+
+import time
+from collections import deque
+import numpy as np
+
+RESTART = 0xFFFF                                                # 16位索引的图元重启索引，不用作顶点序号
+
+def index_dtype(n_vertices):
+    """返回n_vertices个顶点适用的最小索引类型"""
+
+    return np.uint16 if n_vertices <= RESTART else np.uint32
+
+def downcast(indices):
+    """最大索引小于0xFFFF时返回uint16的索引数组，否则原样返回"""
+
+    indices = np.ascontiguousarray(indices)
+    if indices.itemsize > 2 and indices.size and int(indices.max()) < RESTART:
+        return indices.astype(np.uint16)
+
+    return indices
+
+def acmr(indices, cache_size=16):
+    """模拟大小为cache_size的FIFO顶点缓存，返回平均每个三角形未命中的顶点数"""
+
+    cache, resident, misses = deque(), set(), 0
+    for v in np.asarray(indices).ravel().tolist():
+        if v in resident:
+            continue
+        misses += 1
+        cache.append(v)
+        resident.add(v)
+        if len(cache) > cache_size:
+            resident.discard(cache.popleft())
+
+    return misses / max(1, np.asarray(indices).size // 3)
+
+def tipsify(indices, n_vertices, cache_size=16):
+    """以Tipsify算法重排三角形，返回新的索引数组（三角形的集合和各三角形的顶点顺序不变）"""
+
+    tris = np.asarray(indices).reshape(-1, 3)
+    flat = tris.ravel()
+    counts = np.bincount(flat, minlength=n_vertices)
+    offsets = np.concatenate(([0], np.cumsum(counts))).tolist()
+    adjacent = (np.argsort(flat, kind='stable') // 3).tolist()  # 各顶点相邻的三角形，按offsets划分
+    triangles = tris.tolist()
+
+    live = counts.tolist()                                      # 各顶点尚未输出的相邻三角形数
+    stamp = [0] * n_vertices                                    # 顶点进入缓存的时间戳
+    emitted = [False] * len(triangles)
+    dead = list()                                               # 最近输出的顶点（回溯栈）
+    order = list()
+    clock, cursor, fan = cache_size + 1, 0, 0
+
+    while fan >= 0:
+        candidates = list()
+        for t in adjacent[offsets[fan]:offsets[fan+1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            order.append(t)
+            for v in triangles[t]:
+                dead.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if clock - stamp[v] > cache_size: # 未命中，进入缓存
+                    stamp[v] = clock
+                    clock += 1
+
+        # 下一个扇形中心：仍在缓存中且最早进入缓存的顶点，其剩余三角形须不会把它挤出缓存
+        fan, best = -1, -1
+        for v in candidates:
+            if live[v] > 0:
+                age = clock - stamp[v]
+                priority = age if age + 2*live[v] <= cache_size else 0
+                if priority > best:
+                    fan, best = v, priority
+
+        while fan < 0 and dead: # 无候选时回溯到最近输出的顶点
+            v = dead.pop()
+            if live[v] > 0:
+                fan = v
+        while fan < 0 and cursor < n_vertices: # 再按序号查找仍有三角形的顶点
+            if live[cursor] > 0:
+                fan = cursor
+            cursor += 1
+
+    return tris[order].ravel()
+
+def reorder_vertices(indices, n_vertices):
+    """按首次引用的先后重排顶点，返回(新的索引数组, 新顶点依次对应的原顶点序号)。未引用的顶点排在最后"""
+
+    indices = np.asarray(indices).ravel()
+    used, first = np.unique(indices, return_index=True)
+    order = np.concatenate((used[np.argsort(first)], np.setdiff1d(np.arange(n_vertices), used)))
+    remap = np.empty(n_vertices, dtype=np.int64)
+    remap[order] = np.arange(n_vertices)
+
+    return remap[indices], order
+
+def optimize(mesh, cache_size=16):
+    """优化meshes的网格字典（三角形图元），返回(新的网格, 统计)
+
+    新网格的各顶点属性按新顺序重排，indices仍为uint32，以保持meshes网格的约定。统计为字典：
+    acmr_before、acmr_after（cache_size的FIFO缓存），index_bytes（原索引字节数），
+    index_bytes_after（downcast后的字节数），time（耗时，秒）
+    """
+
+    t0 = time.perf_counter()
+    indices = np.asarray(mesh['indices']).ravel()
+    n = len(mesh['vertices'])
+
+    reordered = tipsify(indices, n, cache_size)
+    reordered, order = reorder_vertices(reordered, n)
+
+    result = {key: np.ascontiguousarray(value[order]) for key, value in mesh.items() if key != 'indices'}
+    result['indices'] = reordered.astype(np.uint32)
+    stats = {
+        'acmr_before': acmr(indices, cache_size),
+        'acmr_after': acmr(reordered, cache_size),
+        'index_bytes': indices.nbytes,
+        'index_bytes_after': downcast(result['indices']).nbytes,
+        'time': time.perf_counter() - t0
+    }
+
+    return result, stats
+
+def benchmark(cache_size=16):
+    """报告各网格优化前后的ACMR、索引字节数和优化耗时"""
+
+    import meshes
+
+    cases = (
+        ('sphere', meshes.sphere, {'rows':90, 'cols':180}),
+        ('sphere', meshes.sphere, {'rows':180, 'cols':360}),
+        ('sphere', meshes.sphere, {'rows':360, 'cols':720}),
+        ('grid', meshes.grid, {'rows':200, 'cols':200}),
+        ('cylinder', meshes.cylinder, {'slices':360, 'stacks':20}),
+        ('cube', meshes.cube, {})
+    )
+
+    print('FIFO顶点缓存大小：%d' % cache_size)
+    print('%-10s %-28s %8s %10s %10s %12s %12s %10s' % ('网格', '参数', '顶点数', 'ACMR前', 'ACMR后',
+        '索引前(KB)', '索引后(KB)', '耗时(ms)'))
+    for name, func, params in cases:
+        mesh = func(cache=False, **params)
+        result, s = optimize(mesh, cache_size)
+        print('%-10s %-28s %8d %10.3f %10.3f %12.1f %12.1f %10.1f' % (name, params, len(mesh['vertices']),
+            s['acmr_before'], s['acmr_after'], s['index_bytes']/1024, s['index_bytes_after']/1024, s['time']*1e3))
+
+if __name__ == '__main__':
+    benchmark()
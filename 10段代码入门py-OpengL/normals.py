@@ -0,0 +1,158 @@
+"""顶点法向量计算
+
+vertex_normals()按相邻三角面的法向量加权平均求出顶点法向量，适用于没有曲面方程的网格（如从文件
+加载或由高度数据生成的网格）。meshes中的参数化曲面直接使用解析法向量，地球示例也改用meshes.sphere，
+不再调用本模块。
+"""
+
+import time
+import numpy as np
+
+def face_normals(vs, indices):
+    """返回每个三角面的法向量（未单位化，模长等于三角形面积的2倍）"""
+
+    tri = vs[np.asarray(indices).reshape(-1, 3)]                # 三角面的三个顶点，shape=(F,3,3)
+    e1, e2 = tri[:,1]-tri[:,0], tri[:,2]-tri[:,0]
+
+    fn = np.empty_like(e1)                                      # 逐分量叉乘，比np.cross快
+    fn[:,0] = e1[:,1]*e2[:,2] - e1[:,2]*e2[:,1]
+    fn[:,1] = e1[:,2]*e2[:,0] - e1[:,0]*e2[:,2]
+    fn[:,2] = e1[:,0]*e2[:,1] - e1[:,1]*e2[:,0]
+
+    return fn
+
+def _corner_angles(vs, indices):
+    """返回每个三角面三个角的弧度，shape=(F,3)"""
+
+    tri = np.float64(vs[np.asarray(indices).reshape(-1, 3)])
+    angles = np.empty(tri.shape[:2], dtype=np.float64)
+
+    for k in range(3):
+        e1 = tri[:,(k+1)%3] - tri[:,k]
+        e2 = tri[:,(k+2)%3] - tri[:,k]
+        n1 = np.linalg.norm(e1, axis=1)
+        n2 = np.linalg.norm(e2, axis=1)
+        cos = np.einsum('ij,ij->i', e1, e2) / np.maximum(n1*n2, 1e-30)
+        angles[:,k] = np.arccos(np.clip(cos, -1.0, 1.0))
+
+    return angles
+
+def _scatter_add(idx, weights, n):
+    """将weights按idx累加到n个顶点上，shape=(n,3)"""
+
+    return np.stack([np.bincount(idx, weights=weights[:,k], minlength=n) for k in range(3)], axis=1)
+
+def weld_groups(vs, tol=1e-6):
+    """按位置对顶点分组，返回每个顶点所在组的序号。位置相同（在tol精度内）的顶点属于同一组"""
+
+    keys = np.int64(np.round(np.asarray(vs, dtype=np.float64) / tol))
+    order = np.lexsort(keys.T)                                  # 按坐标排序后重合的顶点相邻
+    keys = keys[order]
+
+    head = np.empty(len(keys), dtype=bool)                      # 每组第一个顶点的标志
+    head[:1] = True
+    np.any(keys[1:] != keys[:-1], axis=1, out=head[1:])
+
+    groups = np.empty(len(keys), dtype=np.int64)
+    groups[order] = np.cumsum(head) - 1
+
+    return groups
+
+def vertex_normals(vs, indices, weight='area', weld=False, tol=1e-6):
+    """计算平滑的顶点法向量
+
+    vs          - 顶点数组，shape=(n,3)
+    indices     - 三角面索引数组，长度为3的倍数
+    weight      - 面法向量的加权方式：'area'（面积加权）或'angle'（角度加权）
+    weld        - 是否焊接位置重合的顶点（如经度接缝、南北极点），使其共享同一个法向量
+    tol         - 焊接时判断顶点重合的精度
+    """
+
+    vs = np.asarray(vs)
+    indices = np.asarray(indices).ravel()
+    n = len(vs)
+
+    fn = np.float64(face_normals(vs, indices))
+    if weight == 'area':
+        corner = np.repeat(fn, 3, axis=0)
+    elif weight == 'angle':
+        fn /= np.maximum(np.linalg.norm(fn, axis=1), 1e-30)[:,None]
+        corner = (fn[:,None,:] * _corner_angles(vs, indices)[:,:,None]).reshape(-1, 3)
+    else:
+        raise ValueError('不支持的加权方式：%s' % weight)
+
+    normal = _scatter_add(indices, corner, n)
+
+    if weld:
+        groups = weld_groups(vs, tol)
+        normal = _scatter_add(groups, normal, groups.max()+1)[groups]
+
+    length = np.linalg.norm(normal, axis=1)
+    normal[length>0] /= length[length>0][:,None]
+
+    return np.float32(normal)
+
+def _loop_normals(vs, indices, rows, cols):
+    """原地球示例中逐顶点循环计算法向量的算法，仅供性能对比"""
+
+    primitive = vs[indices]
+    a = primitive[::3]
+    b = primitive[1::3]
+    c = primitive[2::3]
+    normal = np.repeat(np.cross(b-a, c-a), 3, axis=0)
+
+    idx_arg = np.argsort(indices)
+    rise = np.where(np.diff(indices[idx_arg])==1)[0]+1
+    rise = np.hstack((0, rise, len(indices)))
+
+    tmp = np.zeros((rows*cols, 3), dtype=np.float32)
+    for i in range(rows*cols):
+        tmp[i] = np.sum(normal[idx_arg[rise[i]:rise[i+1]]], axis=0)
+
+    normal = tmp.reshape(rows,cols,-1)
+    normal[:,0] += normal[:,-1]
+    normal[:,-1] = normal[:,0]
+    normal[0] = normal[0,0]
+    normal[-1] = normal[-1,0]
+
+    return normal.reshape(-1, 3)
+
+def _uv_sphere(rows, cols, r=1):
+    """生成与地球示例相同的球面顶点和索引"""
+
+    gv, gu = np.mgrid[0.5*np.pi:-0.5*np.pi:complex(0,rows), 0:2*np.pi:complex(0,cols)]
+    xs = r * np.cos(gv)*np.cos(gu)
+    ys = r * np.cos(gv)*np.sin(gu)
+    zs = r * np.sin(gv)
+    vs = np.float32(np.dstack((xs, ys, zs)).reshape(-1, 3))
+
+    idx = np.arange(rows*cols).reshape(rows, cols)
+    idx_a, idx_b, idx_c, idx_d = idx[:-1,:-1], idx[1:,:-1], idx[:-1, 1:], idx[1:,1:]
+    indices = np.int32(np.dstack((idx_a, idx_b, idx_c, idx_c, idx_b, idx_d)).ravel())
+
+    return vs, indices
+
+def benchmark(steps=(4, 2, 1, 0.5, 0.25), repeat=3):
+    """对比逐顶点循环和向量化算法在不同经纬度精度下的耗时"""
+
+    def best(func, *args, **kwds):
+        t = list()
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            func(*args, **kwds)
+            t.append(time.perf_counter() - t0)
+        return min(t)
+
+    print('%8s %10s %12s %12s %12s %8s' % ('精度', '顶点数', '循环(ms)', '面积(ms)', '角度(ms)', '加速比'))
+    for step in steps:
+        rows, cols = int(round(180/step)), int(round(360/step))
+        vs, indices = _uv_sphere(rows, cols)
+
+        t_loop = best(_loop_normals, vs, indices, rows, cols)
+        t_area = best(vertex_normals, vs, indices, weight='area', weld=True)
+        t_angle = best(vertex_normals, vs, indices, weight='angle', weld=True)
+
+        print('%7s° %10d %12.1f %12.1f %12.1f %7.1fx' % (step, rows*cols, t_loop*1e3, t_area*1e3, t_angle*1e3, t_loop/t_area))
+
+if __name__ == '__main__':
+    benchmark()
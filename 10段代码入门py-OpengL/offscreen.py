@@ -0,0 +1,337 @@
+"""无窗口的离屏渲染后端
+
+在没有显示器的机器上以EGL（surfaceless平台）或OSMesa创建OpenGL上下文，渲染到帧缓冲区
+对象（FBO）中，逐帧读回为NumPy数组。场景的prepare()、draw()、render()与GLUT窗口中的
+调用顺序相同，渲染期间示例模块中依赖GLUT窗口的函数被替换为空操作或等价实现，因此现有
+的场景类无需修改即可批量运行。
+
+PyOpenGL在首次导入时根据环境变量PYOPENGL_PLATFORM选择平台，因此须在导入OpenGL之前导入
+本模块（未设置时默认为egl），或者在命令行中设置PYOPENGL_PLATFORM=egl或osmesa。
+
+命令行：python offscreen.py 10-diffuse-specular-shine.py --frames 60 --size 640x480 --out earth.png
+"""
+
+import os
+import sys
+
+if 'OpenGL' not in sys.modules:
+    os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+os.environ.setdefault('EGL_PLATFORM', 'surfaceless')            # Mesa在无显示器时使用surfaceless平台
+
+import time
+import types
+import ctypes
+import argparse
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.GLU import *
+import textures
+
+class OffscreenContext:
+    """离屏OpenGL上下文和与之绑定的FBO"""
+
+    def __init__(self, size=(960, 640), backend=None):
+        """构造函数
+
+        size        - FBO的宽度和高度
+        backend     - 'egl'或'osmesa'，默认与PYOPENGL_PLATFORM相同
+        """
+
+        self.backend = (backend or os.environ.get('PYOPENGL_PLATFORM', '')).lower()
+        self.size = tuple(size)
+        self.fbo = None                                         # 帧缓冲区对象
+        self.renderbuffers = list()                             # 颜色和深度渲染缓冲区
+
+        if self.backend == 'egl':
+            self._create_egl()
+        elif self.backend == 'osmesa':
+            self._create_osmesa()
+        else:
+            raise RuntimeError('离屏渲染需要PYOPENGL_PLATFORM=egl或osmesa，当前为%r' % self.backend)
+
+        self.resize(self.size)
+
+    def _create_egl(self):
+        """创建不需要窗口表面的EGL上下文"""
+
+        from OpenGL import EGL
+
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        if not EGL.eglInitialize(self.display, None, None):
+            raise RuntimeError('EGL初始化失败')
+
+        config, n = EGL.EGLConfig(), EGL.EGLint()
+        attribs = (EGL.EGLint*3)(EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT, EGL.EGL_NONE)
+        EGL.eglChooseConfig(self.display, attribs, ctypes.pointer(config), 1, ctypes.pointer(n))
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+
+        # 示例中既有固定管线又有着色器，使用兼容模式的上下文
+        attribs = (EGL.EGLint*7)(
+            EGL.EGL_CONTEXT_MAJOR_VERSION, 3,
+            EGL.EGL_CONTEXT_MINOR_VERSION, 3,
+            EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_COMPATIBILITY_PROFILE_BIT,
+            EGL.EGL_NONE
+        )
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, attribs)
+        if not self.context or not EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, self.context):
+            raise RuntimeError('创建EGL上下文失败')
+
+    def _create_osmesa(self):
+        """创建OSMesa上下文。OSMesa要求绑定一块内存作为默认帧缓冲区，实际渲染仍在FBO中进行"""
+
+        from OpenGL import osmesa
+
+        self.context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+        if not self.context:
+            raise RuntimeError('创建OSMesa上下文失败')
+
+        self._osmesa_buffer = np.zeros((1, 1, 4), dtype=np.uint8)
+        osmesa.OSMesaMakeCurrent(self.context, self._osmesa_buffer, GL_UNSIGNED_BYTE, 1, 1)
+
+    def resize(self, size):
+        """重新创建指定大小的FBO并绑定"""
+
+        self._delete_fbo()
+        self.size = w, h = tuple(size)
+
+        self.fbo = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        for fmt, attachment in ((GL_RGBA8, GL_COLOR_ATTACHMENT0), (GL_DEPTH_COMPONENT24, GL_DEPTH_ATTACHMENT)):
+            rb = glGenRenderbuffers(1)
+            glBindRenderbuffer(GL_RENDERBUFFER, rb)
+            glRenderbufferStorage(GL_RENDERBUFFER, fmt, w, h)
+            glFramebufferRenderbuffer(GL_FRAMEBUFFER, attachment, GL_RENDERBUFFER, rb)
+            self.renderbuffers.append(rb)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError('FBO不完整')
+
+        glViewport(0, 0, w, h)
+
+    def read(self, out=None):
+        """读回当前帧，返回shape=(高,宽,3)的uint8数组，第0行为图像顶部"""
+
+        w, h = self.size
+        if out is None:
+            out = np.empty((h, w, 3), dtype=np.uint8)
+
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        pixels = glReadPixels(0, 0, w, h, GL_RGB, GL_UNSIGNED_BYTE)
+        out[:] = np.frombuffer(pixels, dtype=np.uint8).reshape(h, w, 3)[::-1]
+
+        return out
+
+    def _delete_fbo(self):
+        """删除FBO和渲染缓冲区"""
+
+        if self.fbo is not None:
+            glBindFramebuffer(GL_FRAMEBUFFER, 0)
+            glDeleteFramebuffers(1, [self.fbo])
+            glDeleteRenderbuffers(len(self.renderbuffers), self.renderbuffers)
+            self.fbo, self.renderbuffers = None, list()
+
+    def destroy(self):
+        """销毁上下文"""
+
+        self._delete_fbo()
+
+        if self.backend == 'egl':
+            from OpenGL import EGL
+            EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+            EGL.eglDestroyContext(self.display, self.context)
+        else:
+            from OpenGL import osmesa
+            osmesa.OSMesaDestroyContext(self.context)
+
+_context = None
+
+def context(size=(960, 640), backend=None):
+    """返回共享的离屏上下文，大小不同时重新创建FBO"""
+
+    global _context
+    if _context is None:
+        _context = OffscreenContext(size, backend)
+    elif _context.size != tuple(size):
+        _context.resize(size)
+
+    return _context
+
+_quadric = None
+_CUBE = (                                                       # 六面体各面的法向量和顶点
+    ((0, 0, 1), ((1, 1, 1), (-1, 1, 1), (-1, -1, 1), (1, -1, 1))),
+    ((0, 0, -1), ((1, 1, -1), (1, -1, -1), (-1, -1, -1), (-1, 1, -1))),
+    ((1, 0, 0), ((1, 1, 1), (1, -1, 1), (1, -1, -1), (1, 1, -1))),
+    ((-1, 0, 0), ((-1, 1, 1), (-1, 1, -1), (-1, -1, -1), (-1, -1, 1))),
+    ((0, 1, 0), ((1, 1, 1), (1, 1, -1), (-1, 1, -1), (-1, 1, 1))),
+    ((0, -1, 0), ((1, -1, 1), (-1, -1, 1), (-1, -1, -1), (1, -1, -1)))
+)
+
+def _quad(style):
+    """返回共享的二次曲面对象，设置绘制样式（GLU_FILL或GLU_LINE）"""
+
+    global _quadric
+    if _quadric is None:
+        _quadric = gluNewQuadric()
+        gluQuadricNormals(_quadric, GLU_SMOOTH)
+    gluQuadricDrawStyle(_quadric, style)
+
+    return _quadric
+
+def _sphere(style):
+    """返回以GLU实现的glutSolidSphere或glutWireSphere"""
+
+    def sphere(radius, slices, stacks):
+        gluSphere(_quad(style), radius, slices, stacks)
+
+    return sphere
+
+def _cone(style):
+    """返回以GLU实现的glutSolidCone或glutWireCone（含底面）"""
+
+    def cone(base, height, slices, stacks):
+        q = _quad(style)
+        gluCylinder(q, base, 0.0, height, slices, stacks)
+        gluQuadricOrientation(q, GLU_INSIDE)
+        gluDisk(q, 0.0, base, slices, 1)
+        gluQuadricOrientation(q, GLU_OUTSIDE)
+
+    return cone
+
+def _cube(mode):
+    """返回以glBegin/glEnd实现的glutSolidCube（GL_QUADS）或glutWireCube（GL_LINE_LOOP）"""
+
+    def cube(size):
+        h = size / 2
+        for normal, quad in _CUBE:
+            glBegin(mode)
+            glNormal3f(*normal)
+            for x, y, z in quad:
+                glVertex3f(x*h, y*h, z*h)
+            glEnd()
+
+    return cube
+
+class _NoGlut:
+    """渲染期间替换场景类各方法所在模块中依赖GLUT窗口的函数，退出时恢复
+
+    glutSwapBuffers和glutPostRedisplay替换为空操作；glutSolidSphere等几何体函数在未调用
+    glutInit时会使freeglut退出进程，替换为GLU二次曲面或glBegin/glEnd的等价实现。
+    """
+
+    SUBSTITUTES = {
+        'glutSwapBuffers':      lambda *args: None,
+        'glutPostRedisplay':    lambda *args: None,
+        'glutSolidSphere':      _sphere(GLU_FILL),
+        'glutWireSphere':       _sphere(GLU_LINE),
+        'glutSolidCone':        _cone(GLU_FILL),
+        'glutWireCone':         _cone(GLU_LINE),
+        'glutSolidCube':        _cube(GL_QUADS),
+        'glutWireCube':         _cube(GL_LINE_LOOP)
+    }
+
+    def __init__(self, scene):
+        self.namespaces = dict()                                # 模块全局变量字典，按id去重
+        attrs = [attr for cls in type(scene).__mro__ for attr in vars(cls).values()]
+        for attr in attrs + list(vars(scene).values()):
+            if isinstance(attr, types.ModuleType):              # 包装模块级函数示例的场景对象
+                self.namespaces[id(vars(attr))] = vars(attr)
+            elif callable(attr) and hasattr(attr, '__globals__'):
+                self.namespaces[id(attr.__globals__)] = attr.__globals__
+        self.saved = list()
+
+    def __enter__(self):
+        for namespace in self.namespaces.values():
+            for name, func in self.SUBSTITUTES.items():
+                if name in namespace:
+                    self.saved.append((namespace, name, namespace[name]))
+                    namespace[name] = func
+        return self
+
+    def __exit__(self, *exc):
+        for namespace, name, func in reversed(self.saved):
+            namespace[name] = func
+        self.saved = list()
+
+def prepare(scene, size=None, backend=None):
+    """创建（或复用）离屏上下文，首次使用时完成与show()相同的GL初始化并调用scene.prepare()，返回上下文"""
+
+    size = tuple(scene.csize if size is None else size)
+    ctx = context(size, backend)
+
+    with _NoGlut(scene):
+        if getattr(scene, '_offscreen_context', None) is not ctx:
+            glClearColor(*scene.bg, 1.0)
+            glEnable(GL_DEPTH_TEST)
+            glDepthFunc(GL_LEQUAL)
+            scene.prepare()
+            textures.manager().finish() # 批量渲染时不使用占位纹理，保证每帧结果确定
+            scene._offscreen_context = ctx
+
+        scene.reshape(*size)
+
+    return ctx
+
+def render(scene, n_frames=1, size=None, backend=None, before_frame=None):
+    """在离屏上下文中渲染场景，返回shape=(n_frames,高,宽,3)的uint8数组
+
+    scene           - BaseScene派生类的实例
+    n_frames        - 渲染帧数
+    size            - 画布宽度和高度，默认为场景的csize
+    backend         - 'egl'或'osmesa'
+    before_frame    - 每帧渲染前调用的函数before_frame(scene, i)，可用于转动相机等
+    """
+
+    ctx = prepare(scene, size, backend)
+    frames = np.empty((n_frames, ctx.size[1], ctx.size[0], 3), dtype=np.uint8)
+
+    with _NoGlut(scene):
+        for i in range(n_frames):
+            if before_frame is not None:
+                before_frame(scene, i)
+            scene.render()
+            ctx.read(frames[i])
+
+    return frames
+
+def find_scene_class(module):
+    """返回示例模块中定义的场景类，优先选择App"""
+
+    from baseScene import BaseScene
+
+    classes = [obj for obj in vars(module).values()
+        if isinstance(obj, type) and issubclass(obj, BaseScene) and obj.__module__ == module.__name__]
+    if not classes:
+        raise ValueError('%s中没有BaseScene的派生类' % module.__file__)
+
+    return next((cls for cls in classes if cls.__name__ == 'App'), classes[0])
+
+def main():
+    """命令行入口"""
+
+    from program import _load_demo
+
+    parser = argparse.ArgumentParser(description='离屏渲染示例场景')
+    parser.add_argument('demo', help='示例文件，如10-diffuse-specular-shine.py')
+    parser.add_argument('--frames', type=int, default=1, help='渲染帧数')
+    parser.add_argument('--size', default='960x640', help='画布大小，如640x480')
+    parser.add_argument('--haxis', default='y', help='高度轴')
+    parser.add_argument('--out', help='保存最后一帧的图像文件（.png）或全部帧（.npy）')
+    args = parser.parse_args()
+
+    size = tuple(int(v) for v in args.size.lower().split('x'))
+    app = find_scene_class(_load_demo(args.demo))(haxis=args.haxis, size=size)
+
+    t0 = time.perf_counter()
+    frames = render(app, args.frames, size)
+    t = time.perf_counter() - t0
+    print('%s：%d帧，%dx%d，%.1f ms/帧（含prepare）' % (args.demo, args.frames, size[0], size[1], t/args.frames*1e3))
+
+    if args.out and args.out.endswith('.npy'):
+        np.save(args.out, frames)
+    elif args.out:
+        from PIL import Image
+        Image.fromarray(frames[-1]).save(args.out)
+
+if __name__ == '__main__':
+    main()
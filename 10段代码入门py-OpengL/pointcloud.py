@@ -0,0 +1,442 @@
+"""内存映射.npy文件的外存点云：八叉树分块、按视椎体和投影大小流式上传
+
+点云文件为shape=(N,3)（坐标）或(N,6)（坐标和0至1的RGB颜色）的float32 .npy文件，以np.load(mmap_mode='r')
+映射，从不整体读入内存。首次打开时PointOctree分块读取文件，按包围立方体的八叉树将点重新排列到
+缓存目录中的新文件：
+
+    1. 计算包围盒，以深度depth的八叉树单元的Morton码为每个点编号并统计各单元的点数
+    2. 自顶向下合并：点数不超过chunk_points的八叉树节点成为一个块（Morton码相邻的单元在空间上
+       也相邻，一个节点的全部点在排列后的文件中连续）；单个单元点数过多时按chunk_points切分
+    3. 按Morton码把各批点分散写入新文件，再打乱每个块内的顺序，因此块的任意前缀都是均匀的子样本
+
+PointCloud每帧以视椎体剔除块的包围盒，由包围球的投影直径（像素）决定是否绘制以及绘制多少点
+（块的前缀，约density个点每平方像素）。可见的块按投影直径从大到小排列，未驻留显存的块在每帧
+upload_budget字节以内以glBufferData从映射文件直接上传；驻留字节数超过budget时淘汰最久未绘制的块。
+report()打印每秒绘制的点数、驻留显存和进程内存。
+"""
+
+import os
+import sys
+import time
+import hashlib
+import tempfile
+from collections import OrderedDict
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.arrays import vbo
+from scene import Scene
+from program import ShaderProgram
+from geometry import Geometry
+import culling
+import lod
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'pointclouds')
+BLOCK = 1 << 21                                                 # 分块读取源文件时每块的点数
+DEFAULT_BUDGET = 256 * 1024 * 1024                              # 默认显存预算（字节）
+DEFAULT_UPLOAD_BUDGET = 16 * 1024 * 1024                        # 每帧默认上传的字节数
+
+VSHADER = """
+    #version 330 core
+
+    in vec4 a_Position;
+    in vec3 a_Color;
+    uniform mat4 u_ProjMatrix;
+    uniform mat4 u_ViewMatrix;
+    uniform mat4 u_ModelMatrix;
+    uniform int u_HasColor;
+    uniform vec2 u_Height;
+    out vec3 v_Color;
+
+    void main() {
+        gl_Position = u_ProjMatrix * u_ViewMatrix * u_ModelMatrix * a_Position;
+        if (u_HasColor != 0) {
+            v_Color = a_Color;
+        } else { // 没有颜色时按高度（z）着色
+            float t = clamp((a_Position.z - u_Height.x) / max(u_Height.y - u_Height.x, 1e-6), 0.0, 1.0);
+            v_Color = mix(vec3(0.1, 0.3, 0.9), vec3(1.0, 0.9, 0.3), t);
+        }
+    }
+"""
+
+FSHADER = """
+    #version 330 core
+
+    in vec3 v_Color;
+
+    void main() {
+        gl_FragColor = vec4(v_Color, 1.0);
+    }
+"""
+
+def _rss():
+    """返回进程当前占用的物理内存字节数，不支持时返回0"""
+
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+def _morton(cells, depth):
+    """返回(N,3)的整数单元坐标在深度depth的八叉树中的Morton码"""
+
+    spread = np.zeros(1 << depth, dtype=np.int64)               # 各坐标值的二进制位间隔两位展开
+    for b in range(depth):
+        spread |= ((np.arange(1 << depth) >> b) & 1) << (3*b)
+
+    return spread[cells[:, 0]] | (spread[cells[:, 1]] << 1) | (spread[cells[:, 2]] << 2)
+
+class PointOctree:
+    """按八叉树分块并重新排列的点云文件"""
+
+    def __init__(self, path, chunk_points=65536, cache_dir=None):
+        """构造函数：缓存目录中有与源文件对应的排列结果时直接映射，否则分块读取源文件构建
+
+        path            - (N,3)或(N,6)的float32 .npy文件
+        chunk_points    - 每块最多的点数
+        cache_dir       - 缓存目录，默认为CACHE_DIR
+        """
+
+        cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+        st = os.stat(path)
+        text = '%s-%d-%d-%d' % (os.path.abspath(path), st.st_size, st.st_mtime_ns, chunk_points)
+        prefix = os.path.join(cache_dir, '%s-%s' % (os.path.splitext(os.path.basename(path))[0],
+            hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]))
+
+        self.build_time = 0.0                                   # 构建耗时（秒），使用缓存时为0
+        if not (os.path.isfile(prefix + '.points.npy') and os.path.isfile(prefix + '.index.npz')):
+            t0 = time.perf_counter()
+            self._build(np.load(path, mmap_mode='r'), prefix, chunk_points)
+            self.build_time = time.perf_counter() - t0
+
+        self.points = np.load(prefix + '.points.npy', mmap_mode='r')   # 按块排列的点
+        with np.load(prefix + '.index.npz') as index:
+            self.start = index['start']                         # 各块在points中的起始序号
+            self.count = index['count']                         # 各块的点数
+            self.lo = index['lo']                               # 各块的包围盒
+            self.hi = index['hi']
+            self.level = index['level']                         # 各块对应的八叉树节点深度
+
+        self.columns = self.points.shape[1]                     # 3或6
+        self.row_bytes = self.columns * 4
+        self.bounds = (self.lo.min(axis=0), self.hi.max(axis=0))
+        self.center = (self.lo + self.hi) / 2
+        self.radius = np.linalg.norm(self.hi - self.lo, axis=1) / 2
+
+    def __len__(self):
+        return len(self.start)
+
+    def _build(self, src, prefix, chunk_points):
+        """分块读取源文件，构建八叉树并写入排列后的点和块索引"""
+
+        if src.ndim != 2 or src.shape[1] not in (3, 6):
+            raise ValueError('点云数组的shape须为(N,3)或(N,6)，而不是%s' % (src.shape,))
+
+        n = len(src)
+        depth = int(np.clip(np.ceil(np.log(max(n / chunk_points, 1)) / np.log(8)) + 2, 1, 7))
+        side = 1 << depth
+
+        # 第1遍：包围立方体
+        lo, hi = np.full(3, np.inf), np.full(3, -np.inf)
+        for i in range(0, n, BLOCK):
+            xyz = np.asarray(src[i:i+BLOCK, :3], dtype=np.float64)
+            lo, hi = np.minimum(lo, xyz.min(axis=0)), np.maximum(hi, xyz.max(axis=0))
+        size = max(float((hi - lo).max()), 1e-12)
+
+        def codes(xyz):
+            cells = ((np.asarray(xyz, dtype=np.float64) - lo) / size * side).astype(np.int64)
+            return _morton(np.clip(cells, 0, side - 1), depth)
+
+        # 第2遍：各单元的点数
+        counts = np.zeros(side**3, dtype=np.int64)
+        for i in range(0, n, BLOCK):
+            counts += np.bincount(codes(src[i:i+BLOCK, :3]), minlength=side**3)
+        cum = np.concatenate(([0], np.cumsum(counts)))
+
+        # 自顶向下合并八叉树节点，块按Morton码（即在新文件中的位置）排列
+        chunks, stack = list(), [(0, 0)]
+        while stack:
+            d, code = stack.pop()
+            shift = 3 * (depth - d)
+            first, last = cum[code << shift], cum[(code + 1) << shift]
+            if first == last:
+                continue
+            if last - first <= chunk_points or d == depth:
+                chunks += [(s, min(s + chunk_points, last), d) for s in range(first, last, chunk_points)]
+            else:
+                stack += [(d + 1, (code << 3) | k) for k in range(7, -1, -1)]
+
+        # 第3遍：按Morton码分散写入新文件
+        os.makedirs(os.path.dirname(prefix), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix='.npy', dir=os.path.dirname(prefix))
+        os.close(fd)
+        out = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=src.shape)
+        cursor = cum[:-1].copy()
+        for i in range(0, n, BLOCK):
+            block = np.asarray(src[i:i+BLOCK], dtype=np.float32)
+            c = codes(block[:, :3])
+            order = np.argsort(c, kind='stable')
+            sc = c[order]
+            rank = np.arange(len(sc)) - np.searchsorted(sc, sc)  # 在同一单元的点中的序号
+            out[cursor[sc] + rank] = block[order]
+            cursor += np.bincount(c, minlength=side**3)
+
+        # 第4遍：打乱块内顺序，计算各块的包围盒
+        rng = np.random.default_rng(0)
+        lo_box, hi_box = np.empty((len(chunks), 3), dtype=np.float32), np.empty((len(chunks), 3), dtype=np.float32)
+        for j, (s, e, d) in enumerate(chunks):
+            block = out[s:e][rng.permutation(e - s)]
+            out[s:e] = block
+            lo_box[j], hi_box[j] = block[:, :3].min(axis=0), block[:, :3].max(axis=0)
+        out.flush()
+        del out
+        os.replace(tmp, prefix + '.points.npy')
+
+        chunks = np.array(chunks, dtype=np.int64).reshape(-1, 3)
+        fd, tmp = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(prefix))
+        with os.fdopen(fd, 'wb') as fp:
+            np.savez(fp, start=chunks[:, 0], count=chunks[:, 1] - chunks[:, 0], level=chunks[:, 2], lo=lo_box, hi=hi_box)
+        os.replace(tmp, prefix + '.index.npz')
+
+class PointCloud(Scene):
+    """外存点云场景"""
+
+    def __init__(self, path, **kwds):
+        """构造函数
+
+        path            - (N,3)或(N,6)的float32 .npy文件
+        budget          - 显存预算（字节），None表示不限制
+        upload_budget   - 每帧最多上传的字节数（至少上传一块），None表示不限制
+        chunk_points    - 每块最多的点数
+        density         - 每平方像素绘制的点数，inf表示绘制块的全部点
+        min_pixels      - 投影直径小于此像素数的块不绘制
+        point_size      - 点的大小（像素）
+        """
+
+        self.path = path
+        self.budget = kwds.pop('budget', DEFAULT_BUDGET)
+        self.upload_budget = kwds.pop('upload_budget', DEFAULT_UPLOAD_BUDGET)
+        self.chunk_points = kwds.pop('chunk_points', 65536)
+        self.density = kwds.pop('density', 1.0)
+        self.min_pixels = kwds.pop('min_pixels', 2.0)
+        self.point_size = kwds.pop('point_size', 1.0)
+        kwds.setdefault('haxis', 'z')
+
+        Scene.__init__(self, **kwds)
+
+        self.octree = None
+        self.resident = OrderedDict()                           # 驻留显存的块：序号 -> Geometry，按最近绘制的先后排列
+        self.resident_bytes = 0
+        self.stats = {'chunks':0, 'visible':0, 'drawn':0, 'points':0, 'uploads':0, 'uploaded_bytes':0,
+            'evictions':0, 'frames':0, 'total_points':0, 'pps':0.0}
+        self._last_draw = None                                  # 上一帧绘制开始的时间
+
+    def prepare(self):
+        """映射点云文件（首次打开时构建八叉树），编译着色器并以包围盒设置相机"""
+
+        self.octree = PointOctree(self.path, self.chunk_points)
+        self.program = ShaderProgram(VSHADER, FSHADER)
+        self.stats['chunks'] = len(self.octree)
+
+        lo, hi = self.octree.bounds
+        self._update_cam_and_up(oecs=(lo + hi) / 2, dist=float(np.linalg.norm(hi - lo)) * 1.2)
+        self.home['dist'] = self.dist
+        self.far = max(self.far, self.dist * 4)
+
+    def _upload(self, i):
+        """以glBufferData从映射文件直接上传第i块，返回Geometry"""
+
+        octree = self.octree
+        data = octree.points[octree.start[i]:octree.start[i] + octree.count[i]]
+        buf = vbo.VBO(data)
+        geometry = Geometry(GL_POINTS, self.program, vao=self.use_vao)
+        geometry.attrib('a_Position', buf, size=3, stride=octree.row_bytes)
+        if octree.columns == 6:
+            geometry.attrib('a_Color', buf, size=3, stride=octree.row_bytes, offset=12)
+        geometry.prepare()
+        buf.bind()                                              # 不使用VAO时在此上传，以便计入本帧的上传量
+        buf.unbind()
+        buf.data = None                                         # 上传后不再引用映射的数据
+
+        self.resident[i] = geometry
+        self.resident_bytes += data.nbytes
+        self.stats['uploads'] += 1
+        self.stats['uploaded_bytes'] += data.nbytes
+
+        return geometry
+
+    def _evict(self, need, keep):
+        """淘汰最久未绘制、且不在keep中的块，直至再上传need字节不超过预算。返回能否上传"""
+
+        if self.budget is None:
+            return True
+
+        for i in list(self.resident):
+            if self.resident_bytes + need <= self.budget:
+                break
+            if i in keep:
+                continue
+            self.resident.pop(i).delete()
+            self.resident_bytes -= int(self.octree.count[i]) * self.octree.row_bytes
+            self.stats['evictions'] += 1
+
+        return self.resident_bytes + need <= self.budget
+
+    def select(self):
+        """返回本帧要绘制的块序号（按投影直径从大到小）和各块绘制的点数"""
+
+        octree, mmat = self.octree, self.node.world
+        planes = culling.frustum_planes(np.dot(mmat, self.camera.vpmat))    # 模型坐标系中的视椎体
+        visible = culling.box_visible(octree.lo, octree.hi, planes)
+
+        centers = octree.center @ mmat[:3, :3] + mmat[3, :3]
+        scale = float(np.abs(mmat[:3, :3]).sum(axis=1).max())
+        size = lod.screen_size(centers, octree.radius * scale, self.camera.vmat, self.camera.pmat, self.csize[0])
+        wanted = np.flatnonzero(visible & (size >= self.min_pixels))
+        wanted = wanted[np.argsort(-size[wanted], kind='stable')]
+
+        count = octree.count[wanted]
+        if np.isinf(self.density): # 半径为0的块（如单独的离群点）投影直径为0，inf*0为nan
+            points = count
+        else:
+            points = np.minimum(count, np.ceil(self.density * np.maximum(size[wanted], 0)**2))
+        self.stats['visible'] = int(visible.sum())
+
+        return wanted, points.astype(np.int64)
+
+    def draw(self):
+        """流式上传可见的块并绘制"""
+
+        t = time.perf_counter()
+        if self._last_draw is not None and t > self._last_draw:
+            self.stats['pps'] = self.stats['points'] / (t - self._last_draw)
+        self._last_draw = t
+
+        wanted, points = self.select()
+        keep, uploaded = set(wanted.tolist()), 0
+        for i in wanted:
+            if i in self.resident:
+                continue
+            nbytes = int(self.octree.count[i]) * self.octree.row_bytes
+            if self.upload_budget is not None and uploaded and uploaded + nbytes > self.upload_budget:
+                break
+            if not self._evict(nbytes, keep):
+                break
+            self._upload(i)
+            uploaded += nbytes
+
+        self.program.use()
+        self.program['u_ProjMatrix'] = self.get_pmat()
+        self.program['u_ViewMatrix'] = self.get_vmat()
+        self.program['u_ModelMatrix'] = self.node.world
+        self.program['u_HasColor'] = int(self.octree.columns == 6)
+        self.program['u_Height'] = np.array([self.octree.bounds[0][2], self.octree.bounds[1][2]], dtype=np.float32)
+        glPointSize(self.point_size)
+
+        drawn, total = 0, 0
+        for i, n in zip(wanted, points):
+            geometry = self.resident.get(i)
+            if geometry is None:
+                continue
+            geometry.draw(int(n))
+            self.resident.move_to_end(i)
+            drawn += 1
+            total += int(n)
+
+        self.program.unuse()
+
+        self.stats['drawn'] = drawn
+        self.stats['points'] = total
+        self.stats['frames'] += 1
+        self.stats['total_points'] += total
+
+    def report(self):
+        """向标准输出打印统计"""
+
+        s = self.stats
+        print('块：%d，可见%d，绘制%d；点：%d（%.1f M点/秒）；驻留显存%.1f MB（上传%d次、淘汰%d次）；进程内存%.1f MB' % (
+            s['chunks'], s['visible'], s['drawn'], s['points'], s['pps']/1e6, self.resident_bytes/2**20,
+            s['uploads'], s['evictions'], _rss()/2**20))
+
+    def delete(self):
+        """删除全部驻留的块"""
+
+        for geometry in self.resident.values():
+            geometry.delete()
+        self.resident.clear()
+        self.resident_bytes = 0
+
+def _make_cloud(path, n, color=True, block=BLOCK):
+    """分块生成n个点的起伏地形点云并写入.npy文件，用于基准测试"""
+
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(n, 6 if color else 3))
+    rng = np.random.default_rng(0)
+    for i in range(0, n, block):
+        m = min(block, n - i)
+        x, y = rng.uniform(-100, 100, m), rng.uniform(-100, 100, m)
+        z = 8*np.sin(x/15)*np.cos(y/20) + rng.normal(0, 0.3, m)
+        out[i:i+m, :3] = np.stack((x, y, z), axis=1)
+        if color:
+            t = (z[:, None] + 8) / 16
+            out[i:i+m, 3:] = np.clip(t * [0.9, 0.8, 0.3] + (1 - t) * [0.1, 0.5, 0.2], 0, 1)
+    out.flush()
+    del out
+
+def benchmark(n=4000000, frames=20):
+    """生成n个点的点云：报告八叉树构建速度；在不同相机距离下以较小的显存预算绘制，报告绘制的点数、
+    每秒点数、驻留显存和进程内存；并与预算不限、绘制全部点的方式对比"""
+
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(640, 480)
+    glutCreateWindow('Point cloud benchmark')
+    glutHideWindow()
+    glViewport(0, 0, 640, 480)
+    glEnable(GL_DEPTH_TEST)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'terrain.npy')
+        _make_cloud(path, n)
+        rss = _rss()
+        octree = PointOctree(path, cache_dir=tmp)
+        print('点数：%d，块数：%d，八叉树构建%.2f s（%.1f M点/秒），构建后进程内存增加%.1f MB' % (
+            n, len(octree), octree.build_time, n / octree.build_time / 1e6, (_rss() - rss) / 2**20))
+
+        def run(dist, **kwds):
+            app = PointCloud(path, size=(640, 480), elev=30.0, **kwds)
+            app.octree = octree
+            app.program = ShaderProgram(VSHADER, FSHADER)
+            app.stats['chunks'] = len(octree)
+            lo, hi = octree.bounds
+            app._update_cam_and_up(oecs=(lo + hi) / 2, dist=dist)
+            app.far = 2000.0
+
+            t = list()
+            for i in range(frames):
+                t0 = time.perf_counter()
+                glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+                app.draw()
+                glFinish()
+                t.append(time.perf_counter() - t0)
+            result = (np.median(t[frames//2:]), dict(app.stats), app.resident_bytes, _rss())
+            app.delete()
+            app.program.delete()
+            return result
+
+        print('%-22s %8s %8s %10s %10s %12s %10s %12s %12s' % ('方式', '距离', '绘制块', '点数', '每帧(ms)',
+            'M点/秒', '上传次数', '显存(MB)', '进程内存(MB)'))
+        cases = [('预算32MB、按投影大小', dist, {'budget':32*2**20, 'upload_budget':8*2**20}) for dist in (30.0, 120.0, 480.0)]
+        cases.append(('不限预算、全部点', 120.0, {'budget':None, 'upload_budget':None, 'density':np.inf, 'min_pixels':0.0}))
+        for name, dist, kwds in cases:
+            t, s, resident, rss = run(dist, **kwds)
+            print('%-22s %8.0f %8d %10d %10.2f %12.1f %10d %12.1f %12.1f' % (name, dist, s['drawn'], s['points'],
+                t*1e3, s['points']/t/1e6, s['uploads'], resident/2**20, rss/2**20))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        PointCloud(sys.argv[1]).show()
+    else:
+        benchmark()
@@ -0,0 +1,265 @@
+"""缓存属性和uniform变量位置的着色器程序"""
+
+import os
+import time
+import importlib.util
+import numpy as np
+from OpenGL.GL import *
+import shadercache
+
+_FLOAT_VEC = {GL_FLOAT:1, GL_FLOAT_VEC2:2, GL_FLOAT_VEC3:3, GL_FLOAT_VEC4:4}
+_INT_VEC = {GL_INT:1, GL_INT_VEC2:2, GL_INT_VEC3:3, GL_INT_VEC4:4, GL_BOOL:1,
+            GL_SAMPLER_1D:1, GL_SAMPLER_2D:1, GL_SAMPLER_3D:1, GL_SAMPLER_CUBE:1}
+_FLOAT_MAT = {GL_FLOAT_MAT2:2, GL_FLOAT_MAT3:3, GL_FLOAT_MAT4:4}
+
+# glUniform*函数的名称，调用时在模块全局变量中查找，因此gltrace等替换的跟踪函数同样生效
+_UNIFORM_FV = {1:'glUniform1fv', 2:'glUniform2fv', 3:'glUniform3fv', 4:'glUniform4fv'}
+_UNIFORM_IV = {1:'glUniform1iv', 2:'glUniform2iv', 3:'glUniform3iv', 4:'glUniform4iv'}
+_UNIFORM_MAT = {2:'glUniformMatrix2fv', 3:'glUniformMatrix3fv', 4:'glUniformMatrix4fv'}
+
+class ShaderProgram:
+    """着色器程序
+
+    链接成功后一次性查询全部活动属性和uniform变量的位置、类型和数组长度。uniform变量
+    通过prog['u_Name'] = value赋值，使用缓存的位置调用类型匹配的glUniform*函数，
+    若新值与上次上传的值相同则跳过GL调用。赋值前须先调用use()使该程序成为当前程序。
+    """
+
+    def __init__(self, vshader_src, fshader_src):
+        """构造函数"""
+
+        self.program = shadercache.compile_program(vshader_src, fshader_src)   # 程序对象，优先从磁盘缓存加载
+        self.attribs = dict()                                       # 属性名 -> (位置, 类型, 数组长度)
+        self.uniforms = dict()                                      # uniform名 -> (位置, 类型, 数组长度)
+        self.values = dict()                                        # uniform名 -> 最近一次上传的值
+
+        self._reflect()
+
+    def _reflect(self):
+        """查询全部活动属性和uniform变量"""
+
+        for i in range(glGetProgramiv(self.program, GL_ACTIVE_ATTRIBUTES)):
+            name, size, gltype = glGetActiveAttrib(self.program, i)
+            name = name.decode('utf-8')
+            self.attribs[name] = (glGetAttribLocation(self.program, name), int(gltype), int(size))
+
+        for i in range(glGetProgramiv(self.program, GL_ACTIVE_UNIFORMS)):
+            name, size, gltype = glGetActiveUniform(self.program, i)
+            name = name.decode('utf-8')
+            if name.endswith('[0]'): # 数组类型的uniform变量
+                name = name[:-3]
+            self.uniforms[name] = (glGetUniformLocation(self.program, name), int(gltype), int(size))
+
+    def use(self):
+        """使该程序成为当前程序"""
+
+        glUseProgram(self.program)
+
+    def unuse(self):
+        """取消当前程序"""
+
+        glUseProgram(0)
+
+    def attrib(self, name):
+        """返回属性位置，着色器中不存在（或被编译器优化掉）的属性返回-1"""
+
+        return self.attribs[name][0] if name in self.attribs else -1
+
+    def uniform(self, name):
+        """返回uniform变量位置，不存在时返回-1"""
+
+        return self.uniforms[name][0] if name in self.uniforms else -1
+
+    def __contains__(self, name):
+        return name in self.uniforms
+
+    def __getitem__(self, name):
+        """返回uniform变量最近一次上传的值"""
+
+        return self.values.get(name)
+
+    def __setitem__(self, name, value):
+        """设置uniform变量，值未改变时不调用GL函数"""
+
+        if name not in self.uniforms: # 与位置为-1时glUniform*的行为一致，忽略不存在的变量
+            return
+
+        loc, gltype, size = self.uniforms[name]
+        last = self.values.get(name)
+
+        if gltype in _FLOAT_MAT:
+            n = _FLOAT_MAT[gltype]
+            value = np.ascontiguousarray(value, dtype=np.float32)
+            if last is not None and np.array_equal(last, value):
+                return
+            globals()[_UNIFORM_MAT[n]](loc, value.size//(n*n), GL_FALSE, value)
+        elif gltype in _FLOAT_VEC:
+            n = _FLOAT_VEC[gltype]
+            if n == 1 and size == 1 and np.isscalar(value):
+                if last == value:
+                    return
+                glUniform1f(loc, value)
+            else:
+                value = np.ascontiguousarray(value, dtype=np.float32)
+                if last is not None and np.array_equal(last, value):
+                    return
+                globals()[_UNIFORM_FV[n]](loc, value.size//n, value)
+        elif gltype in _INT_VEC:
+            n = _INT_VEC[gltype]
+            if n == 1 and size == 1 and np.isscalar(value):
+                if last == value:
+                    return
+                glUniform1i(loc, value)
+            else:
+                value = np.ascontiguousarray(value, dtype=np.int32)
+                if last is not None and np.array_equal(last, value):
+                    return
+                globals()[_UNIFORM_IV[n]](loc, value.size//n, value)
+        else:
+            raise TypeError('不支持的uniform类型：%s (0x%X)' % (name, gltype))
+
+        self.values[name] = value.copy() if isinstance(value, np.ndarray) else value
+
+    def delete(self):
+        """删除程序对象"""
+
+        glDeleteProgram(self.program)
+        self.program = 0
+
+def _legacy_draw(self):
+    """改造前地球示例的绘制流程：每帧按名称查询全部属性和uniform位置，仅供性能对比
+
+    顶点坐标、法向量、纹理坐标和索引使用改造前的独立float32 VBO和uint32索引VBO（self.vertices、
+    self.normal、self.texcoord、self.indices，由_legacy_buffers()创建），self.n为索引数
+    """
+
+    program = self.program.program
+    glUseProgram(program)
+
+    loc = glGetAttribLocation(program, 'a_Position')
+    self.vertices.bind()
+    glVertexAttribPointer(loc, 3, GL_FLOAT, GL_FALSE, 3*4, self.vertices)
+    glEnableVertexAttribArray(loc)
+    self.vertices.unbind()
+
+    loc = glGetAttribLocation(program, 'a_Normal')
+    self.normal.bind()
+    glVertexAttribPointer(loc, 3, GL_FLOAT, GL_FALSE, 3*4, self.normal)
+    glEnableVertexAttribArray(loc)
+    self.normal.unbind()
+
+    loc = glGetAttribLocation(program, 'a_Texcoord')
+    self.texcoord.bind()
+    glVertexAttribPointer(loc, 2, GL_FLOAT, GL_FALSE, 2*4, self.texcoord)
+    glEnableVertexAttribArray(loc)
+    self.texcoord.unbind()
+
+    loc = glGetUniformLocation(program, 'u_ProjMatrix')
+    glUniformMatrix4fv(loc, 1, GL_FALSE, self.get_pmat(), None)
+
+    loc = glGetUniformLocation(program, 'u_ViewMatrix')
+    glUniformMatrix4fv(loc, 1, GL_FALSE, self.get_vmat(), None)
+
+    loc = glGetUniformLocation(program, 'u_ModelMatrix')
+    glUniformMatrix4fv(loc, 1, GL_FALSE, self.mmat, None)
+
+    loc = glGetUniformLocation(program, 'u_CamPos')
+    glUniform3f(loc, *self.cam)
+
+    loc = glGetUniformLocation(program, 'u_Texture')
+    glActiveTexture(GL_TEXTURE0)
+    glBindTexture(GL_TEXTURE_2D, self.texture.tid)
+    glUniform1i(loc, 0)
+
+    loc = glGetUniformLocation(program, 'u_LightDir')
+    glUniform3f(loc, *self.light_dir)
+
+    loc = glGetUniformLocation(program, 'u_LightColor')
+    glUniform3f(loc, *self.light_color)
+
+    loc = glGetUniformLocation(program, 'u_AmbientColor')
+    glUniform3f(loc, *self.ambient)
+
+    loc = glGetUniformLocation(program, 'u_Shiny')
+    glUniform1f(loc, self.shiny)
+
+    loc = glGetUniformLocation(program, 'u_Specular')
+    glUniform1f(loc, self.specular)
+
+    loc = glGetUniformLocation(program, 'u_Diffuse')
+    glUniform1f(loc, self.diffuse)
+
+    loc = glGetUniformLocation(program, 'u_Pellucid')
+    glUniform1f(loc, self.pellucid)
+
+    self.indices.bind()
+    glDrawElements(GL_TRIANGLES, self.n, GL_UNSIGNED_INT, None)
+    self.indices.unbind()
+
+    glUseProgram(0)
+
+def _legacy_buffers(app, rows=90, cols=180):
+    """为_legacy_draw创建改造前地球示例的独立float32 VBO和uint32索引VBO"""
+
+    from OpenGL.arrays import vbo
+    import meshes
+
+    mesh = meshes.sphere(rows=rows, cols=cols)
+    app.vertices = vbo.VBO(np.ascontiguousarray(mesh['vertices'], dtype=np.float32))
+    app.normal = vbo.VBO(np.ascontiguousarray(mesh['normals'], dtype=np.float32))
+    app.texcoord = vbo.VBO(np.ascontiguousarray(mesh['texcoords'], dtype=np.float32))
+    app.indices = vbo.VBO(np.ascontiguousarray(mesh['indices'], dtype=np.uint32), target=GL_ELEMENT_ARRAY_BUFFER)
+    app.n = len(mesh['indices'])
+
+def _load_demo(filename, name='demo'):
+    """导入文件名以数字开头的示例模块"""
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+def _time_draw(app, draw, frames, orbit):
+    """返回每帧调用draw的CPU耗时（微秒）列表。orbit为True时每帧转动相机"""
+
+    t = list()
+    for i in range(frames):
+        if orbit:
+            app._update_cam_and_up(azim=app.azim+1)
+
+        t0 = time.perf_counter()
+        draw(app)
+        t.append((time.perf_counter()-t0)*1e6)
+
+    glFinish()
+    return t
+
+def benchmark(frames=500):
+    """对比地球示例改造前（逐帧查询位置、设置顶点属性）和当前每帧draw()的CPU耗时"""
+
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(320, 240)
+    glutCreateWindow('ShaderProgram benchmark')
+    glutHideWindow()
+
+    app = _load_demo('10-diffuse-specular-shine.py').App(haxis='z', size=(320, 240), async_textures=False)
+    app.prepare()
+    _legacy_buffers(app)
+    app.n = app.geometry.count = 0 # 不绘制三角面，只统计Python和驱动提交状态的CPU耗时，排除软件光栅化的干扰
+    app.earth.levels = [(offset, 0) for offset, count in app.earth.levels]
+
+    print('%-16s %-8s %10s %10s' % ('绘制方式', '相机', '中位数(us)', '平均(us)'))
+    for orbit in (False, True):
+        for name, draw in (('逐帧查询位置', _legacy_draw), ('当前draw()', type(app).draw)):
+            _time_draw(app, draw, 20, orbit) # 预热
+            t = _time_draw(app, draw, frames, orbit)
+            print('%-16s %-8s %10.1f %10.1f' % (name, '转动' if orbit else '静止', np.median(t), np.mean(t)))
+
+if __name__ == '__main__':
+    benchmark()
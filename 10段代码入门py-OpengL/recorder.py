@@ -0,0 +1,357 @@
+"""录制立即模式绘制，此后以一次绘制调用重放
+
+Recording首次执行一段使用glBegin/glVertex/glEnd或glutSolidSphere等函数的绘制代码时将其
+录制下来，此后draw()不再经过Python逐个提交顶点：
+
+    mode='vbo'  - 录制期间替换代码所在模块中的glBegin、glEnd、glVertex*、glColor*、
+                  glNormal*、glTexCoord*和glutSolid*/glutWire*，收集顶点及块内设置过的
+                  颜色、法向量和纹理坐标，按点、线、三角形各生成一个VBO和索引VBO（条带、
+                  扇形、四边形和多边形转换为三角形，线带和线环转换为线段）。块内没有设置的
+                  属性不写入VBO，重放时使用当前值，因此可以在块外设置颜色后重放同一录制。
+                  只录制几何数据，块内的矩阵变换和状态设置函数在录制时执行一次，不被录制。
+    mode='list' - 以显示列表录制（仅兼容模式上下文），矩阵变换和状态设置也被录制。
+
+用法：
+    rec = Recording()
+    with rec:                       # 录制并绘制一次
+        glBegin(GL_TRIANGLES); ...; glEnd()
+    rec.draw()                      # 此后每帧重放
+
+    或 rec.record(func, *args)，BaseScene.replay(key, func, *args)按键缓存录制。
+"""
+
+import re
+import sys
+import time
+import numpy as np
+from OpenGL.GL import *
+from geometry import Geometry
+import meshes
+
+_ATTRIB = re.compile(r'^gl(Vertex|Color|Normal|TexCoord)[234]?(b|s|i|f|d|ub|us|ui)?v?$')
+_COLUMNS = {'texcoord':slice(0, 2), 'color':slice(2, 6), 'normal':slice(6, 9), 'vertex':slice(9, 12)}
+
+# 块内设置过的属性 -> (混合数组类型, 列)
+_FORMATS = {
+    frozenset():                                (GL_V3F, [9, 10, 11]),
+    frozenset(['color']):                       (GL_C3F_V3F, [2, 3, 4, 9, 10, 11]),
+    frozenset(['normal']):                      (GL_N3F_V3F, [6, 7, 8, 9, 10, 11]),
+    frozenset(['color', 'normal']):             (GL_C4F_N3F_V3F, list(range(2, 12))),
+    frozenset(['texcoord']):                    (GL_T2F_V3F, [0, 1, 9, 10, 11]),
+    frozenset(['texcoord', 'color']):           (GL_T2F_C3F_V3F, [0, 1, 2, 3, 4, 9, 10, 11]),
+    frozenset(['texcoord', 'normal']):          (GL_T2F_N3F_V3F, [0, 1, 6, 7, 8, 9, 10, 11]),
+    frozenset(['texcoord', 'color', 'normal']): (GL_T2F_C4F_N3F_V3F, list(range(12)))
+}
+
+def _primitive(mode, n):
+    """返回glBegin(mode)块中n个顶点转换为点、线段或三角形后的(图元类型, 索引数组)"""
+
+    i = np.arange(n)
+    if mode == GL_POINTS:
+        return GL_POINTS, i
+    if mode == GL_LINES:
+        return GL_LINES, i[:n - n%2]
+    if mode in (GL_LINE_STRIP, GL_LINE_LOOP):
+        last = [[n-1, 0]] if mode == GL_LINE_LOOP and n > 2 else np.empty((0, 2), dtype=int)
+        return GL_LINES, np.vstack((np.stack((i[:-1], i[1:]), axis=1), last)).ravel()
+    if mode == GL_TRIANGLES:
+        return GL_TRIANGLES, i[:n - n%3]
+    if mode == GL_TRIANGLE_STRIP:
+        a, b, c = i[:-2], i[1:-1], i[2:]
+        odd = a % 2 == 1                                        # 奇数三角形交换前两个顶点，保持环绕方向
+        return GL_TRIANGLES, np.stack((np.where(odd, b, a), np.where(odd, a, b), c), axis=1).ravel()
+    if mode in (GL_TRIANGLE_FAN, GL_POLYGON):
+        return GL_TRIANGLES, np.stack((np.zeros(max(n-2, 0), dtype=int), i[1:-1], i[2:]), axis=1).ravel()
+    if mode == GL_QUADS:
+        q = i[:n - n%4].reshape(-1, 4)
+        return GL_TRIANGLES, q[:, [0, 1, 2, 0, 2, 3]].ravel()
+    if mode == GL_QUAD_STRIP:
+        a = i[0:n-3:2]
+        return GL_TRIANGLES, np.stack((a, a+1, a+3, a, a+3, a+2), axis=1).ravel()
+
+    raise ValueError('不支持的图元类型：%s' % mode)
+
+def _wire(rows, cols):
+    """返回rows行cols列顶点网格沿行和列的线段索引"""
+
+    idx = np.arange(rows*cols).reshape(rows, cols)
+    h = np.stack((idx[:, :-1], idx[:, 1:]), axis=-1).reshape(-1, 2)
+    v = np.stack((idx[:-1, :], idx[1:, :]), axis=-1).reshape(-1, 2)
+
+    return np.vstack((h, v)).ravel()
+
+class _Capture:
+    """mode='vbo'时替换立即模式函数的收集器"""
+
+    def __init__(self):
+        """构造函数，以当前颜色、法向量和纹理坐标为初始值"""
+
+        self.current = np.zeros(12, dtype=np.float32)           # 纹理坐标2、颜色4、法向量3、顶点3
+        self.current[_COLUMNS['color']] = glGetFloatv(GL_CURRENT_COLOR)
+        self.current[_COLUMNS['normal']] = glGetFloatv(GL_CURRENT_NORMAL)
+        self.current[_COLUMNS['texcoord']] = glGetFloatv(GL_CURRENT_TEXTURE_COORDS)[:2]
+        self.used = set()                                       # 块内设置过的属性
+        self.mode = None                                        # 当前glBegin的图元类型
+        self.block = list()                                     # 当前块的顶点
+        self.parts = {GL_POINTS:list(), GL_LINES:list(), GL_TRIANGLES:list()}   # 图元类型 -> [(顶点数组, 索引数组)]
+
+    def substitutes(self, namespace):
+        """返回namespace中需要替换的函数"""
+
+        subs = {'glBegin':self.begin, 'glEnd':self.end}
+        for name in namespace:
+            m = _ATTRIB.match(name)
+            if m:
+                subs[name] = self._setter(m.group(1).lower(), m.group(2) or '')
+
+        subs.update({
+            'glutSolidSphere':  lambda r, slices, stacks: self.shape(meshes.sphere(rows=stacks+1, cols=slices+1, r=r), (stacks+1, slices+1)),
+            'glutWireSphere':   lambda r, slices, stacks: self.shape(meshes.sphere(rows=stacks+1, cols=slices+1, r=r), (stacks+1, slices+1), True),
+            'glutSolidCone':    lambda r, h, slices, stacks: self.shape(meshes.cone(slices=slices, stacks=stacks, r=r, h=h), (stacks+1, slices+1)),
+            'glutWireCone':     lambda r, h, slices, stacks: self.shape(meshes.cone(slices=slices, stacks=stacks, r=r, h=h), (stacks+1, slices+1), True),
+            'glutSolidCube':    lambda size: self.shape(meshes.cube(size=size)),
+            'glutWireCube':     lambda size: self.shape(meshes.cube(size=size), None, True)
+        })
+
+        return {name:func for name, func in subs.items() if name in namespace}
+
+    def _setter(self, attr, suffix):
+        """返回glVertex*、glColor*等函数的替代函数"""
+
+        columns = _COLUMNS[attr]
+        scale = {'ub':255.0, 'us':65535.0, 'ui':4294967295.0}.get(suffix) if attr == 'color' else None
+
+        def setter(*args):
+            values = np.asarray(args[0] if len(args) == 1 else args, dtype=np.float64).ravel()
+            if scale:
+                values = values / scale
+            if attr == 'vertex':
+                v = self.current.copy()
+                v[9:12] = 0.0
+                v[9:9+min(len(values), 3)] = values[:3]
+                self.block.append(v)
+            else:
+                self.used.add(attr)
+                n = columns.stop - columns.start
+                self.current[columns.start:columns.start+min(len(values), n)] = values[:n]
+                if attr == 'color' and len(values) == 3:
+                    self.current[5] = 1.0
+
+        return setter
+
+    def begin(self, mode):
+        """glBegin的替代函数"""
+
+        self.mode, self.block = mode, list()
+
+    def end(self):
+        """glEnd的替代函数：将当前块转换为点、线段或三角形"""
+
+        if self.block:
+            kind, indices = _primitive(self.mode, len(self.block))
+            self.parts[kind].append((np.array(self.block, dtype=np.float32), indices))
+        self.mode, self.block = None, list()
+
+    def shape(self, mesh, grid=None, wire=False):
+        """添加GLUT几何体：法向量来自网格，颜色和纹理坐标为当前值"""
+
+        self.used.add('normal')
+        n = len(mesh['vertices'])
+        data = np.tile(self.current, (n, 1))
+        data[:, 6:9] = mesh['normals']
+        data[:, 9:12] = mesh['vertices']
+
+        if not wire:
+            self.parts[GL_TRIANGLES].append((data, mesh['indices']))
+        elif grid is not None:
+            self.parts[GL_LINES].append((data, _wire(*grid)))
+        else:
+            quads = mesh['indices'].reshape(-1, 6)[:, [0, 1, 2, 5]]   # 六面体每个面的4个顶点
+            self.parts[GL_LINES].append((data, quads[:, [0, 1, 1, 2, 2, 3, 3, 0]].ravel()))
+
+    def build(self, vao=True):
+        """生成各图元类型的几何体，返回[Geometry]"""
+
+        atype, columns = _FORMATS[frozenset(self.used)]
+        geometries = list()
+        for kind, parts in self.parts.items():
+            if not parts:
+                continue
+
+            vertices, indices, base = list(), list(), 0
+            for data, idx in parts:
+                vertices.append(data[:, columns])
+                indices.append(np.asarray(idx, dtype=np.uint32) + base)
+                base += len(data)
+
+            geom = Geometry(kind, vao=vao)
+            geom.interleave(np.vstack(vertices), atype)
+            geom.elements(np.concatenate(indices))
+            geom.prepare()
+            geometries.append(geom)
+
+        return geometries
+
+class Recording:
+    """一段立即模式绘制代码的录制"""
+
+    def __init__(self, mode='vbo', vao=True):
+        """构造函数
+
+        mode        - 'vbo'或'list'
+        vao         - mode='vbo'时是否使用VAO
+        """
+
+        if mode not in ('vbo', 'list'):
+            raise ValueError('mode须为vbo或list：%s' % mode)
+
+        self.mode = mode
+        self.vao = vao
+        self.geometries = list()                                # mode='vbo'时各图元类型的几何体
+        self.list_id = 0                                        # mode='list'时的显示列表
+        self.recorded = False                                   # 是否已录制
+        self.vertices = 0                                       # 录制的顶点数
+
+        self._capture = None
+        self._saved = list()
+
+    def _begin(self, namespace):
+        """开始录制"""
+
+        if self.recorded:
+            raise RuntimeError('已经录制过，重放请调用draw()')
+
+        if self.mode == 'list':
+            self.list_id = glGenLists(1)
+            glNewList(self.list_id, GL_COMPILE_AND_EXECUTE)
+            return
+
+        self._capture = _Capture()
+        for name, func in self._capture.substitutes(namespace).items():
+            self._saved.append((namespace, name, namespace[name]))
+            namespace[name] = func
+
+    def _end(self):
+        """结束录制，mode='vbo'时生成几何体并绘制一次"""
+
+        if self.mode == 'list':
+            glEndList()
+        else:
+            for namespace, name, func in reversed(self._saved):
+                namespace[name] = func
+            self._saved = list()
+
+            self.geometries = self._capture.build(self.vao)
+            self.vertices = sum(len(data) for parts in self._capture.parts.values() for data, idx in parts)
+            self._capture = None
+            self.draw()
+
+        self.recorded = True
+
+    def _abort(self):
+        """录制中发生异常：恢复被替换的函数，丢弃不完整的显示列表或捕获的数据"""
+
+        if self.mode == 'list':
+            glEndList()
+            glDeleteLists(self.list_id, 1)
+            self.list_id = 0
+        else:
+            for namespace, name, func in reversed(self._saved):
+                namespace[name] = func
+            self._saved = list()
+            self._capture = None
+
+    def __enter__(self):
+        self._begin(sys._getframe(1).f_globals)                 # 替换with语句所在模块中的函数
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self._end()
+        else:
+            self._abort()
+
+    def record(self, func, *args):
+        """录制并执行func(*args)，替换func所在模块中的函数"""
+
+        self._begin(getattr(func, '__globals__', {}))
+        try:
+            func(*args)
+        except BaseException:
+            self._abort()
+            raise
+        self._end()
+
+    def draw(self):
+        """重放录制的绘制"""
+
+        if self.list_id:
+            glCallList(self.list_id)
+        else:
+            for geom in self.geometries:
+                geom.draw()
+
+    def delete(self):
+        """删除显示列表或VAO和VBO"""
+
+        if self.list_id:
+            glDeleteLists(self.list_id, 1)
+            self.list_id = 0
+        for geom in self.geometries:
+            geom.delete()
+        self.geometries = list()
+        self.recorded = False
+
+def benchmark(frames=30):
+    """对比立即模式、VBO重放和显示列表重放绘制180x90球面的CPU耗时"""
+
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(320, 240)
+    glutCreateWindow('Recorder benchmark')
+    glutHideWindow()
+
+    theta = np.linspace(0, 2*np.pi, 181).tolist()
+    phi = np.linspace(-0.5*np.pi, 0.5*np.pi, 91).tolist()
+    rings = [(np.sin(p), np.cos(p)) for p in phi]
+
+    def sphere():
+        """与glutSolidSphere(1, 180, 90)相同的四边形带，每帧约3.3万次glNormal和glVertex调用"""
+
+        for i in range(90):
+            (z0, r0), (z1, r1) = rings[i], rings[i+1]
+            glBegin(GL_QUAD_STRIP)
+            for t in theta:
+                c, s = np.cos(t), np.sin(t)
+                glNormal3f(c*r1, s*r1, z1)
+                glVertex3f(c*r1, s*r1, z1)
+                glNormal3f(c*r0, s*r0, z0)
+                glVertex3f(c*r0, s*r0, z0)
+            glEnd()
+
+    def timed(draw):
+        t = list()
+        for i in range(frames):
+            t0 = time.perf_counter()
+            draw()
+            glFinish()
+            t.append(time.perf_counter() - t0)
+        return np.median(t)
+
+    t_immediate = timed(sphere)
+    print('%-10s %12s %12s %10s' % ('方式', '录制(ms)', '每帧(ms)', '加速比'))
+    print('%-10s %12s %12.2f %10s' % ('立即模式', '', t_immediate*1e3, ''))
+    for mode in ('vbo', 'list'):
+        rec = Recording(mode)
+        t0 = time.perf_counter()
+        rec.record(sphere)
+        t_record = time.perf_counter() - t0
+        t = timed(rec.draw)
+        print('%-10s %12.1f %12.2f %9.0fx' % (mode, t_record*1e3, t*1e3, t_immediate/t))
+        rec.delete()
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,292 @@
+"""保留模式场景图：节点的局部变换、缓存的世界矩阵和脏标记
+
+SceneGraph以连续的float32数组保存全部节点的局部矩阵local和世界矩阵world（shape=(容量,4,4)，
+与相机矩阵的约定相同：每行对应OpenGL矩阵的一列，可直接传给glUniformMatrix4fv或glMultMatrixf）。
+修改节点的局部变换只设置该节点的脏标记，读取世界矩阵时才按深度逐层更新：每层先从父节点继承
+脏标记，再以一次批量矩阵乘法world[i] = local[i] @ world[parent[i]]更新该层全部脏节点，因此移动
+一个节点只重新计算它的子树，各层的Python循环次数与节点数量无关。
+
+Node.translate/rotate/scale与glTranslate/glRotate/glScale的调用顺序和含义相同（右乘到局部变换），
+可以把glPushMatrix/glRotate/glTranslate/glPopMatrix链改写为节点：
+
+    node = graph.add(parent).rotate(90, 0, 1, 0).translate(0, 0, 0.8)
+    glMultMatrixf(node.world)
+
+添加节点可能使数组扩容，不要在add()之后继续使用此前取得的local、world数组或其视图。
+"""
+
+import math
+import time
+import numpy as np
+
+def translation(x, y, z):
+    """返回平移矩阵"""
+
+    m = np.eye(4, dtype=np.float32)
+    m[3, :3] = x, y, z
+
+    return m
+
+def rotation(angle, x, y, z):
+    """返回绕向量(x,y,z)旋转angle度的矩阵，与glRotate相同"""
+
+    axis = np.array([x, y, z], dtype=np.float64)
+    x, y, z = axis / np.linalg.norm(axis)
+    c, s = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+
+    return np.array([
+        [x*x*(1-c) + c,   y*x*(1-c) + z*s, x*z*(1-c) - y*s, 0],
+        [x*y*(1-c) - z*s, y*y*(1-c) + c,   y*z*(1-c) + x*s, 0],
+        [x*z*(1-c) + y*s, y*z*(1-c) - x*s, z*z*(1-c) + c,   0],
+        [0, 0, 0, 1]
+    ], dtype=np.float32)
+
+def scaling(x, y, z):
+    """返回缩放矩阵"""
+
+    return np.diag(np.array([x, y, z, 1], dtype=np.float32))
+
+class Node:
+    """场景图节点，只保存节点序号，矩阵保存在SceneGraph的数组中"""
+
+    __slots__ = ('graph', 'index')
+
+    def __init__(self, graph, index):
+        """构造函数"""
+
+        self.graph = graph
+        self.index = index
+
+    @property
+    def parent(self):
+        """父节点，根节点为None"""
+
+        i = self.graph.parent[self.index]
+        return None if i < 0 else Node(self.graph, int(i))
+
+    @property
+    def children(self):
+        """子节点列表"""
+
+        return [Node(self.graph, i) for i in self.graph._children[self.index]]
+
+    @property
+    def local(self):
+        """局部矩阵（只读视图，修改请赋值或调用transform等方法）"""
+
+        return self.graph.local[self.index]
+
+    @local.setter
+    def local(self, value):
+        self.graph.set_local(self.index, value)
+
+    @property
+    def world(self):
+        """世界矩阵，有脏节点时先更新场景图"""
+
+        self.graph.update()
+        return self.graph.world[self.index]
+
+    def transform(self, m):
+        """将矩阵m右乘到局部变换，返回节点本身"""
+
+        self.graph.set_local(self.index, np.dot(m, self.graph.local[self.index]))
+        return self
+
+    def translate(self, x, y, z):
+        """平移，与glTranslate相同"""
+
+        return self.transform(translation(x, y, z))
+
+    def rotate(self, angle, x, y, z):
+        """旋转，与glRotate相同"""
+
+        return self.transform(rotation(angle, x, y, z))
+
+    def scale(self, x, y, z):
+        """缩放，与glScale相同"""
+
+        return self.transform(scaling(x, y, z))
+
+    def reset(self):
+        """局部变换恢复为单位矩阵，返回节点本身"""
+
+        self.graph.set_local(self.index, np.eye(4, dtype=np.float32))
+        return self
+
+class SceneGraph:
+    """以连续数组保存节点矩阵的场景图"""
+
+    def __init__(self, capacity=64):
+        """构造函数
+
+        capacity    - 初始节点容量，不足时按2倍扩容
+        """
+
+        self.local = np.zeros((capacity, 4, 4), dtype=np.float32)  # 局部矩阵
+        self.world = np.zeros((capacity, 4, 4), dtype=np.float32)  # 世界矩阵
+        self.parent = np.full(capacity, -1, dtype=np.int32)     # 父节点序号，根节点为-1
+        self.depth = np.zeros(capacity, dtype=np.int32)         # 节点深度，根节点为0
+        self.dirty = np.zeros(capacity, dtype=bool)             # 脏标记
+        self.count = 0                                          # 节点数
+        self.version = 0                                        # 每次更新世界矩阵后加1
+        self.updated = np.empty(0, dtype=np.int64)              # 最近一次更新的节点序号
+
+        self._children = list()                                 # 各节点的子节点序号列表
+        self._levels = None                                     # 各深度的节点序号数组，结构改变后重建
+        self._any_dirty = False                                 # 是否有脏节点
+
+    def __len__(self):
+        return self.count
+
+    def _reserve(self, n):
+        """确保容量不小于n"""
+
+        if n <= len(self.local):
+            return
+
+        capacity = max(n, 2*len(self.local))
+        for name in ('local', 'world', 'parent', 'depth', 'dirty'):
+            old = getattr(self, name)
+            new = np.full((capacity,) + old.shape[1:], -1 if name == 'parent' else 0, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add(self, parent=None, matrix=None):
+        """添加节点，返回Node
+
+        parent      - 父节点（Node或序号），None表示根节点
+        matrix      - 初始局部矩阵，默认为单位矩阵
+        """
+
+        self._reserve(self.count + 1)
+        i = self.count
+        p = -1 if parent is None else int(getattr(parent, 'index', parent))
+
+        self.parent[i] = p
+        self.depth[i] = 0 if p < 0 else self.depth[p] + 1
+        self.local[i] = np.eye(4, dtype=np.float32) if matrix is None else matrix
+        self._children.append(list())
+        if p >= 0:
+            self._children[p].append(i)
+
+        self.count += 1
+        self._levels = None
+        self._mark(i)
+
+        return Node(self, i)
+
+    def node(self, index):
+        """返回序号为index的节点"""
+
+        return Node(self, index)
+
+    def set_local(self, index, matrix):
+        """设置节点的局部矩阵并设置脏标记"""
+
+        self.local[index] = matrix
+        self._mark(index)
+
+    def _mark(self, index):
+        """设置脏标记，子树的脏标记在update()中逐层继承"""
+
+        self.dirty[index] = True
+        self._any_dirty = True
+
+    def _build_levels(self):
+        """按深度对节点分层"""
+
+        depth = self.depth[:self.count]
+        order = np.argsort(depth, kind='stable')
+        bounds = np.searchsorted(depth[order], np.arange(depth.max() + 2))
+        self._levels = [order[bounds[d]:bounds[d+1]] for d in range(len(bounds) - 1)]
+
+    def update(self):
+        """更新全部脏节点及其子树的世界矩阵，返回被更新的节点序号数组"""
+
+        if not self._any_dirty:
+            return self.updated[:0]
+
+        if self._levels is None:
+            self._build_levels()
+
+        dirty, parent, updated = self.dirty, self.parent, list()
+        start = int(self.depth[:self.count][dirty[:self.count]].min())  # 比最浅的脏节点更浅的层不受影响
+        for d in range(start, len(self._levels)):
+            level = self._levels[d]
+            if d > 0:
+                dirty[level] |= dirty[parent[level]]            # 继承父节点的脏标记
+            sel = level[dirty[level]]
+            if len(sel) == 0:
+                continue
+
+            if d == 0:
+                self.world[sel] = self.local[sel]
+            else:
+                self.world[sel] = np.matmul(self.local[sel], self.world[parent[sel]])
+            updated.append(sel)
+
+        dirty[:self.count] = False
+        self._any_dirty = False
+        self.updated = np.concatenate(updated) if updated else self.updated[:0]
+        self.version += 1
+
+        return self.updated
+
+def _legacy_world(graph):
+    """逐节点递归计算世界矩阵，对应每帧由glPushMatrix/glMultMatrix/glPopMatrix链重新计算，仅供性能对比"""
+
+    world = np.empty_like(graph.world)
+
+    def visit(i, m):
+        world[i] = np.dot(graph.local[i], m)
+        for c in graph._children[i]:
+            visit(c, world[i])
+
+    for i in np.flatnonzero(graph.parent[:graph.count] < 0):
+        visit(i, np.eye(4, dtype=np.float32))
+
+    return world
+
+def benchmark(branching=10, depth=4, repeat=20):
+    """对比逐节点递归计算、全部节点批量更新和移动单个节点后只更新子树的耗时"""
+
+    graph = SceneGraph()
+    rng = np.random.default_rng(0)
+    level = [None] * branching
+    for d in range(depth):
+        level = [graph.add(p).translate(*rng.uniform(-1, 1, 3)).rotate(rng.uniform(0, 360), 0, 0, 1) for p in level
+            for i in range(branching if p is not None else 1)]
+    graph.update()
+    assert np.allclose(_legacy_world(graph)[:graph.count], graph.world[:graph.count], atol=1e-4)
+
+    def timed(func):
+        t = list()
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            n = func()
+            t.append(time.perf_counter() - t0)
+        return np.median(t), n
+
+    root, leaf = graph.node(0), graph.node(graph.count - 1)
+
+    def update_all():
+        graph.dirty[:graph.count] = True
+        graph._any_dirty = True
+        return len(graph.update())
+
+    cases = (
+        ('逐节点递归', lambda: _legacy_world(graph) is not None and graph.count),
+        ('批量更新全部', update_all),
+        ('移动根节点', lambda: len(root.translate(0.01, 0, 0) and graph.update())),
+        ('移动叶节点', lambda: len(leaf.translate(0.01, 0, 0) and graph.update()))
+    )
+
+    print('节点数：%d，深度：%d' % (graph.count, depth))
+    print('%-12s %10s %12s' % ('方式', '更新节点', '耗时(ms)'))
+    for name, func in cases:
+        t, n = timed(func)
+        print('%-12s %10d %12.3f' % (name, n, t*1e3))
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,189 @@
+"""按需渲染的帧调度器
+
+BaseScene的鼠标拖拽、滚轮等事件只累加输入量并调用request()请求重绘，不再每个事件都重新计算
+相机并调用glutPostRedisplay()。FrameScheduler合并两帧之间的全部请求：距上一帧开始不足一个帧
+间隔时以glutTimerFunc推迟到下一个帧间隔再请求重绘，因此帧率不超过目标帧率；fps为0时不限制，
+由驱动的垂直同步（glutSwapBuffers阻塞到下一次刷新）限制帧率。没有请求时不注册定时器和空闲
+函数，GLUT主循环阻塞等待事件，CPU占用为零。
+
+每帧开始时BaseScene一次性应用累加的输入量。begin_frame()/end_frame()记录帧间隔和帧耗时，
+stats()返回请求数、被合并的请求数、渲染帧数和帧时间统计，用于观察冗余渲染的减少。
+"""
+
+import time
+import numpy as np
+
+class FrameScheduler:
+    """合并重绘请求并限制帧率"""
+
+    def __init__(self, post, fps=60.0, history=600):
+        """构造函数
+
+        post        - 请求重绘的函数，如glutPostRedisplay
+        fps         - 目标帧率，0表示由垂直同步限制
+        history     - 保留最近多少帧的时间统计
+        """
+
+        self.post = post
+        self.fps = fps
+        self.interval = 1.0 / fps if fps else 0.0               # 最小帧间隔(秒)
+        self.history = history
+        self.timer = None                                       # 定时器函数timer(毫秒, 回调, 参数)，start()之前直接请求重绘
+
+        self.pending = False                                    # 已请求重绘、尚未开始渲染
+        self.requests = 0                                       # 请求数
+        self.coalesced = 0                                      # 与已有请求合并的请求数
+        self.delayed = 0                                        # 因限制帧率而推迟的请求数
+        self.frames = 0                                         # 渲染帧数
+        self.frame_times = list()                               # 最近各帧的耗时(秒)
+        self.intervals = list()                                 # 最近各帧与上一帧开始时间的间隔(秒)
+
+        self._frame_start = None                                # 当前帧的开始时间
+        self._last_start = None                                 # 上一帧的开始时间
+
+    def start(self, timer):
+        """GLUT初始化后调用，此后以timer（glutTimerFunc）推迟过早的重绘请求"""
+
+        self.timer = timer
+
+    def request(self):
+        """请求重绘，两帧之间的多次请求合并为一次"""
+
+        self.requests += 1
+        if self.pending:
+            self.coalesced += 1
+            return
+
+        self.pending = True
+        wait = 0.0 if self._last_start is None else self._last_start + self.interval - time.perf_counter()
+        if self.timer is not None and wait > 0.001:
+            self.delayed += 1
+            self.timer(int(wait * 1000 + 0.5), self._on_timer, 0)
+        else:
+            self.post()
+
+    def _on_timer(self, value):
+        """定时器回调：到达帧间隔后请求重绘"""
+
+        self.post()
+
+    def begin_frame(self):
+        """开始一帧：此后的请求属于下一帧"""
+
+        t = time.perf_counter()
+        self.pending = False
+        if self._last_start is not None:
+            self._append(self.intervals, t - self._last_start)
+        self._frame_start = self._last_start = t
+
+    def end_frame(self):
+        """结束一帧"""
+
+        if self._frame_start is not None:
+            self._append(self.frame_times, time.perf_counter() - self._frame_start)
+            self._frame_start = None
+        self.frames += 1
+
+    def _append(self, items, value):
+        """追加一项，只保留最近history项"""
+
+        items.append(value)
+        if len(items) > self.history:
+            del items[0]
+
+    def stats(self):
+        """返回请求和帧时间统计的字典，时间单位为毫秒"""
+
+        frame = np.array(self.frame_times) * 1e3
+        interval = np.array(self.intervals) * 1e3
+        pct = lambda a, q: float(np.percentile(a, q)) if len(a) else 0.0
+
+        return {
+            'requests': self.requests,
+            'coalesced': self.coalesced,
+            'delayed': self.delayed,
+            'frames': self.frames,
+            'frame_p50': pct(frame, 50),
+            'frame_p95': pct(frame, 95),
+            'interval_p50': pct(interval, 50),
+            'fps': 1e3 / interval.mean() if len(interval) else 0.0
+        }
+
+    def report(self):
+        """向标准输出打印统计"""
+
+        s = self.stats()
+        print('请求%d次，合并%d次，推迟%d次，渲染%d帧；帧耗时p50 %.2fms、p95 %.2fms，帧间隔p50 %.2fms（%.1f帧/秒）' % (
+            s['requests'], s['coalesced'], s['delayed'], s['frames'], s['frame_p50'], s['frame_p95'], s['interval_p50'], s['fps']))
+
+def benchmark(rate=1000, seconds=2.0, idle=1.0):
+    """模拟rate Hz的鼠标拖拽事件：对比每个事件都更新相机并立即请求重绘（GLUT只合并同一批事件的重绘请求，
+    渲染多快就重绘多快）与按需渲染（60帧/秒）的渲染帧数和CPU占用，以及事件停止后空闲idle秒的CPU占用"""
+
+    from OpenGL.GL import glFinish
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+    from program import _load_demo
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(320, 240)
+    glutCreateWindow('Scheduler benchmark')
+    glutHideWindow()
+
+    app = _load_demo('10-diffuse-specular-shine.py').App(haxis='z', size=(320, 240), async_textures=False)
+    app.prepare()
+
+    def run(coalesce):
+        """以简化的事件循环驱动场景：先处理全部已到达的事件，再触发到期的定时器，有重绘请求时渲染，否则休眠"""
+
+        posted, timers = list(), list()
+        app.scheduler = FrameScheduler(lambda: posted.append(True), fps=60.0)
+        if coalesce:
+            app.scheduler.start(lambda ms, func, value: timers.append((time.perf_counter() + ms/1000, func, value)))
+
+        def display():
+            posted.clear()
+            app.scheduler.begin_frame()
+            app.apply_input()
+            app.draw()
+            glFinish()
+            app.scheduler.end_frame()
+
+        app.left_down, app.mouse_pos = True, (0, 0)
+        start = time.perf_counter()
+        cpu0, events, x = time.process_time(), 0, 0
+        cpu_busy = None
+        while True:
+            now = time.perf_counter()
+            if now - start >= seconds + idle:
+                break
+            if cpu_busy is None and now - start >= seconds:
+                cpu_busy = time.process_time() - cpu0
+            while now - start < seconds and now >= start + events / rate:
+                x += 1
+                app.drag(x % 320, 120)
+                if not coalesce:                                # 原来的方式：每个事件都更新相机
+                    app.apply_input()
+                events += 1
+            due = [item for item in timers if item[0] <= now]
+            for item in due:
+                timers.remove(item)
+                item[1](item[2])
+            if posted:
+                display()
+                continue
+            wake = [start + events / rate] if now - start < seconds else [start + seconds + idle]
+            wake += [item[0] for item in timers]
+            time.sleep(max(0.0, min(wake) - time.perf_counter()))
+        cpu_idle = time.process_time() - cpu0 - cpu_busy
+
+        return events, app.scheduler.frames, cpu_busy / seconds, cpu_idle / idle, app.scheduler.stats()
+
+    print('%-10s %8s %8s %8s %10s %12s %12s' % ('方式', '事件数', '合并请求', '渲染帧', '帧/秒', '拖拽时CPU', '空闲时CPU'))
+    for name, coalesce in (('逐事件重绘', False), ('按需渲染', True)):
+        events, frames, busy, idle_cpu, s = run(coalesce)
+        print('%-10s %8d %8d %8d %10.1f %11.0f%% %11.0f%%' % (name, events, s['coalesced'], frames, frames / seconds, busy*100, idle_cpu*100))
+
+if __name__ == '__main__':
+    benchmark()
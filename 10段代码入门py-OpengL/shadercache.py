@@ -0,0 +1,198 @@
+"""着色器程序二进制的磁盘缓存
+
+首次链接后以glGetProgramBinary取出程序二进制，保存在缓存目录中；再次启动时以
+glProgramBinary直接加载，跳过GLSL编译和链接。缓存文件名由顶点着色器源码、片元着色器
+源码以及驱动的厂商、渲染器和版本字符串共同决定，更换驱动或修改源码后自动失效。驱动
+拒绝缓存的二进制时（如驱动升级后格式不兼容）退回正常编译，并覆盖缓存文件。
+"""
+
+import os
+import time
+import ctypes
+import struct
+import hashlib
+import tempfile
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.GL import shaders
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'programs')
+ENABLED = True                                                  # 全局开关，False时总是编译和链接
+
+_FORMAT = struct.Struct('<I')                                   # 缓存文件头：二进制格式
+
+stats = {'hits':0, 'misses':0, 'rejected':0, 'records':list()}  # records为(缓存键, 结果, 耗时ms)
+
+def _driver():
+    """返回驱动的厂商、渲染器和版本字符串"""
+
+    return b'\0'.join(glGetString(name) or b'' for name in (GL_VENDOR, GL_RENDERER, GL_VERSION))
+
+def cache_key(vshader_src, fshader_src):
+    """返回着色器源码和当前驱动对应的缓存键"""
+
+    sha1 = hashlib.sha1(_driver())
+    for src in (vshader_src, fshader_src):
+        sha1.update(b'\0')
+        sha1.update(src.encode('utf-8'))
+
+    return sha1.hexdigest()
+
+def _link(vshader_src, fshader_src):
+    """编译并链接着色器程序，链接前提示驱动保留程序二进制"""
+
+    vshader = shaders.compileShader(vshader_src, GL_VERTEX_SHADER)
+    fshader = shaders.compileShader(fshader_src, GL_FRAGMENT_SHADER)
+
+    program = glCreateProgram()
+    glAttachShader(program, vshader)
+    glAttachShader(program, fshader)
+    glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+    glLinkProgram(program)
+
+    glDetachShader(program, vshader)
+    glDetachShader(program, fshader)
+    glDeleteShader(vshader)
+    glDeleteShader(fshader)
+
+    if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+        log = glGetProgramInfoLog(program)
+        glDeleteProgram(program)
+        raise shaders.ShaderLinkError('着色器程序链接失败：%s' % log)
+
+    return program
+
+def _load(path):
+    """从缓存文件加载程序二进制，文件不存在或驱动拒绝时返回None"""
+
+    try:
+        with open(path, 'rb') as fp:
+            data = fp.read()
+    except OSError:
+        return None
+
+    if len(data) <= _FORMAT.size:
+        return None
+
+    fmt, = _FORMAT.unpack_from(data)
+    binary = np.frombuffer(data, dtype=np.uint8, offset=_FORMAT.size)
+
+    program = glCreateProgram()
+    try:
+        glProgramBinary(program, fmt, binary, binary.size)
+        if glGetProgramiv(program, GL_LINK_STATUS) == GL_TRUE:
+            return program
+    except GLError:
+        pass
+
+    glDeleteProgram(program)
+    stats['rejected'] += 1
+
+    return None
+
+def _save(program, path):
+    """将程序二进制写入缓存文件。先写临时文件再改名，避免其他进程读到不完整的文件"""
+
+    n = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+    if n <= 0:
+        return
+
+    binary = np.empty(n, dtype=np.uint8)
+    length, fmt = GLsizei(0), GLenum(0)
+    glGetProgramBinary(program, n, ctypes.byref(length), ctypes.byref(fmt), binary.ctypes.data_as(ctypes.c_void_p))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix='.bin', dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as fp:
+        fp.write(_FORMAT.pack(fmt.value))
+        fp.write(binary[:length.value].tobytes())
+    os.replace(tmp, path)
+
+def compile_program(vshader_src, fshader_src, cache=True, cache_dir=None):
+    """编译链接着色器程序或从缓存加载，返回程序对象
+
+    cache       - 是否使用磁盘缓存（驱动不支持程序二进制或ENABLED为False时不使用）
+    cache_dir   - 缓存目录，默认为CACHE_DIR
+    """
+
+    t0 = time.perf_counter()
+    cache = cache and ENABLED and glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+
+    if not cache:
+        program = _link(vshader_src, fshader_src)
+        stats['records'].append(('', '未缓存', (time.perf_counter()-t0)*1e3))
+        return program
+
+    key = cache_key(vshader_src, fshader_src)
+    path = os.path.join(CACHE_DIR if cache_dir is None else cache_dir, key + '.bin')
+
+    program = _load(path)
+    if program is None:
+        stats['misses'] += 1
+        program = _link(vshader_src, fshader_src)
+        try:
+            _save(program, path)
+        except OSError:
+            pass                                                # 缓存目录不可写时仅跳过缓存
+        result = '未命中'
+    else:
+        stats['hits'] += 1
+        result = '命中'
+
+    stats['records'].append((key[:12], result, (time.perf_counter()-t0)*1e3))
+
+    return program
+
+def report():
+    """打印缓存命中、未命中次数和每个程序的链接（或加载）耗时"""
+
+    print('程序缓存：命中%d次，未命中%d次，驱动拒绝%d次' % (stats['hits'], stats['misses'], stats['rejected']))
+    print('%-14s %-8s %10s' % ('缓存键', '结果', '耗时(ms)'))
+    for key, result, t in stats['records']:
+        print('%-14s %-8s %10.2f' % (key, result, t))
+
+def benchmark(rounds=5):
+    """模拟多次启动：调用各示例的prepare()，对比首次（编译链接）和此后（从缓存加载）的耗时"""
+
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+    from program import _load_demo
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(320, 240)
+    glutCreateWindow('Shader cache benchmark')
+    glutHideWindow()
+
+    global CACHE_DIR
+    default_dir = CACHE_DIR
+
+    demos = (
+        ('08-with-shader.py', None),
+        ('09-with-mvp-matrix.py', 'Scene'),
+        ('scene.py', 'Scene'),
+        ('10-diffuse-specular-shine.py', 'App')
+    )
+    preparers = list()
+    for i, (filename, cls) in enumerate(demos):
+        module = _load_demo(filename, 'shadercache_demo_%d' % i)
+        preparers.append(module.prepare if cls is None else getattr(module, cls)(size=(320, 240)).prepare)
+
+    print('%-8s %10s %10s %14s' % ('启动', '命中', '未命中', '链接耗时(ms)'))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        CACHE_DIR = cache_dir
+        try:
+            for i in range(rounds):
+                hits, misses, n = stats['hits'], stats['misses'], len(stats['records'])
+                for prepare in preparers:
+                    prepare()
+                t = sum(item[2] for item in stats['records'][n:])
+                print('%-8s %10d %10d %14.2f' % ('第%d次' % (i+1), stats['hits']-hits, stats['misses']-misses, t))
+        finally:
+            CACHE_DIR = default_dir
+
+    print()
+    report()
+
+if __name__ == '__main__':
+    benchmark()
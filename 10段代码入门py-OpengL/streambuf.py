@@ -0,0 +1,249 @@
+"""每帧更新的动态顶点缓冲区：环形分配、无同步映射和同步栅栏
+
+vbo.VBO适合静态数据：每帧以set_array()更新时，bind()以glBufferData重新分配并复制整个缓冲区；
+对GPU仍在读取的缓冲区调用glBufferSubData则可能等待GPU读取完毕。StreamBuffer在一个固定大小的
+缓冲区中环形分配空间，每次write()写入新的一段，不覆盖此前几帧GPU可能仍在读取的数据：
+
+    'map'       以glMapBufferRange映射要写入的区间（GL_MAP_UNSYNCHRONIZED_BIT，驱动不做同步；
+                GL_MAP_INVALIDATE_RANGE_BIT，不需要保留原有内容），np.copyto直接写入映射内存。
+                每帧绘制后调用fence()，以glFenceSync标记本帧写入的区间；环形回绕到仍有栅栏的
+                区间时以glClientWaitSync等待GPU读取完毕
+    'orphan'    不支持栅栏时的后备方式：以glBufferSubData写入，回绕时以glBufferData(None)重新
+                指定存储（orphaning），旧存储由驱动在GPU读取完毕后释放
+
+write()接受任意NumPy数组或切片，非连续的切片由np.copyto按步长直接写入映射内存，不产生中间副本。
+write()返回数据在缓冲区中的字节偏移量，默认按数组一行的字节数对齐，因此绘制时可以把顶点属性
+指针设置在偏移量0处，以glDrawArrays(mode, offset // 行字节数, 行数)绘制。
+"""
+
+import time
+import ctypes
+from collections import deque
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.arrays import vbo
+
+class StreamBuffer:
+    """环形分配的动态缓冲区"""
+
+    def __init__(self, capacity, target=GL_ARRAY_BUFFER, mode=None, timeout=1.0):
+        """构造函数
+
+        capacity    - 缓冲区字节数，应能容纳约3帧的数据
+        target      - 缓冲区目标，如GL_ARRAY_BUFFER
+        mode        - 'map'或'orphan'，默认在支持glMapBufferRange和glFenceSync时使用'map'
+        timeout     - 等待栅栏的最长时间（秒）
+        """
+
+        if mode is None:
+            mode = 'map' if bool(glMapBufferRange) and bool(glFenceSync) else 'orphan'
+
+        self.capacity = capacity
+        self.target = target
+        self.mode = mode
+        self.timeout = int(timeout * 1e9)                       # glClientWaitSync的超时（纳秒）
+        self.head = 0                                           # 下一次分配的起始位置
+        self.fences = deque()                                   # GPU可能仍在读取的区间：(起始, 结束, 栅栏)，按提交的先后排列
+        self.pending = list()                                   # 上一次fence()之后写入的区间：[起始, 结束]
+        self.stats = {'bytes':0, 'writes':0, 'syncs':0, 'waits':0, 'wait_time':0.0, 'orphans':0, 'wraps':0}
+
+        self.buffer = glGenBuffers(1)
+        glBindBuffer(target, self.buffer)
+        glBufferData(target, capacity, None, GL_STREAM_DRAW)
+        glBindBuffer(target, 0)
+
+    def bind(self):
+        """绑定缓冲区"""
+
+        glBindBuffer(self.target, self.buffer)
+
+    def unbind(self):
+        """解绑缓冲区"""
+
+        glBindBuffer(self.target, 0)
+
+    def __add__(self, offset):
+        """与vbo.VBO相同，buf+offset用作glVertexAttribPointer等函数的指针参数，因此可以传给Geometry.attrib"""
+
+        return ctypes.c_void_p(int(offset))
+
+    def write(self, data, align=None):
+        """写入数组，返回数据在缓冲区中的字节偏移量
+
+        data        - NumPy数组或切片，可以不连续
+        align       - 偏移量的对齐字节数，默认为数组一行的字节数
+        """
+
+        data = np.asarray(data)
+        nbytes = data.nbytes
+        if nbytes > self.capacity:
+            raise ValueError('数据大小%d字节超过缓冲区容量%d字节' % (nbytes, self.capacity))
+
+        align = align or (nbytes // len(data) if data.ndim and len(data) else data.itemsize)
+        offset = -(-self.head // align) * align
+        if offset + nbytes > self.capacity: # 回绕到缓冲区起始位置
+            offset = 0
+            self.stats['wraps'] += 1
+
+        glBindBuffer(self.target, self.buffer)
+        if self.mode == 'map':
+            self._wait(offset, offset + nbytes)
+            ptr = glMapBufferRange(self.target, offset, nbytes, GL_MAP_WRITE_BIT | GL_MAP_UNSYNCHRONIZED_BIT | GL_MAP_INVALIDATE_RANGE_BIT)
+            mapped = np.ctypeslib.as_array((ctypes.c_ubyte * nbytes).from_address(ptr))
+            np.copyto(mapped.view(data.dtype).reshape(data.shape), data)
+            glUnmapBuffer(self.target)
+        else:
+            if offset == 0 and self.head > 0: # 回绕时重新指定存储，不等待GPU读取旧数据
+                glBufferData(self.target, self.capacity, None, GL_STREAM_DRAW)
+                self.stats['orphans'] += 1
+            glBufferSubData(self.target, offset, nbytes, np.ascontiguousarray(data))
+        glBindBuffer(self.target, 0)
+
+        if self.pending and self.pending[-1][1] == offset:
+            self.pending[-1][1] = offset + nbytes
+        else:
+            self.pending.append([offset, offset + nbytes])
+        self.head = offset + nbytes
+        self.stats['bytes'] += nbytes
+        self.stats['writes'] += 1
+
+        return offset
+
+    def fence(self):
+        """在读取本帧写入数据的绘制调用之后调用：以栅栏标记上一次fence()之后写入的区间"""
+
+        if self.mode == 'map' and self.pending:
+            sync = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+            for start, end in self.pending:
+                self.fences.append((start, end, sync))
+        self.pending = list()
+
+    def _wait(self, start, end):
+        """等待与区间[start,end)重叠的最后一个栅栏，并删除它和此前提交的全部栅栏
+
+        回绕的一帧在同一栅栏下标记多个区间，须等待该栅栏后删除它标记的全部区间。GPU按提交的先后
+        完成命令，因此此前提交的栅栏也已完成，不必逐个等待。
+        """
+
+        hits = [i for i, (s, e, sync) in enumerate(self.fences) if s < end and start < e]
+        if not hits:
+            return
+
+        sync = self.fences[hits[-1]][2]
+        last = max(i for i, item in enumerate(self.fences) if item[2] is sync)
+
+        t0 = time.perf_counter()
+        self.stats['syncs'] += 1
+        result = glClientWaitSync(sync, 0, 0)
+        if result == GL_TIMEOUT_EXPIRED:
+            self.stats['waits'] += 1
+            glClientWaitSync(sync, GL_SYNC_FLUSH_COMMANDS_BIT, self.timeout)
+            self.stats['wait_time'] += time.perf_counter() - t0
+
+        done = [self.fences.popleft() for i in range(last + 1)]
+        for sync in {id(item[2]):item[2] for item in done}.values():
+            glDeleteSync(sync)
+
+    def delete(self):
+        """删除栅栏和缓冲区"""
+
+        for sync in {id(item[2]):item[2] for item in self.fences}.values():
+            glDeleteSync(sync)
+        self.fences.clear()
+        glDeleteBuffers(1, [self.buffer])
+
+def benchmark(n=65536, frames=300, capacity=4):
+    """每帧写入n个顶点的坐标并绘制为点：对比vbo.VBO.set_array、同一缓冲区glBufferSubData和StreamBuffer两种方式的
+    持续上传速度。MB/s按更新数据所用的时间计算，每帧耗时包括绘制
+
+    capacity    - StreamBuffer可容纳的帧数
+    """
+
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(320, 240)
+    glutCreateWindow('Stream buffer benchmark')
+    glutHideWindow()
+    glViewport(0, 0, 320, 240)
+
+    rng = np.random.default_rng(0)
+    source = rng.uniform(-1, 1, (n, 4)).astype(np.float32)    # 每帧取前3列，写入非连续的切片
+    row = 12
+
+    def draw(buf, first):
+        buf.bind()
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(3, GL_FLOAT, row, buf+0)
+        glDrawArrays(GL_POINTS, first, n)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        buf.unbind()
+
+    def run_legacy():
+        buf, t = vbo.VBO(np.ascontiguousarray(source[:, :3]), usage=GL_STREAM_DRAW), 0.0
+        for i in range(frames):
+            t0 = time.perf_counter()
+            buf.set_array(np.ascontiguousarray(source[:, :3]))
+            buf.bind()                                          # set_array()之后的bind()以glBufferData重新上传
+            buf.unbind()
+            t += time.perf_counter() - t0
+            draw(buf, 0)
+        buf.delete()
+        return t, dict()
+
+    def run_subdata():
+        buf, t = vbo.VBO(np.ascontiguousarray(source[:, :3]), usage=GL_STREAM_DRAW), 0.0
+        buf.bind()
+        buf.unbind()
+        for i in range(frames):
+            t0 = time.perf_counter()
+            buf.bind()
+            glBufferSubData(GL_ARRAY_BUFFER, 0, n*row, np.ascontiguousarray(source[:, :3]))
+            buf.unbind()
+            t += time.perf_counter() - t0
+            draw(buf, 0)
+        buf.delete()
+        return t, dict()
+
+    def run_stream(mode):
+        buf, t = StreamBuffer(capacity*n*row, mode=mode), 0.0
+        for i in range(frames):
+            t0 = time.perf_counter()
+            offset = buf.write(source[:, :3])
+            t += time.perf_counter() - t0
+            draw(buf, offset // row)
+            buf.fence()
+        stats = buf.stats
+        buf.delete()
+        return t, stats
+
+    cases = (
+        ('VBO.set_array', run_legacy),
+        ('glBufferSubData', run_subdata),
+        ('StreamBuffer(orphan)', lambda: run_stream('orphan')),
+        ('StreamBuffer(map)', lambda: run_stream('map'))
+    )
+
+    # 一帧中途回绕时同一栅栏标记两个区间(0,96)和(0,48)，此后写入(48,96)须等待该栅栏并删除它标记的全部区间
+    buf = StreamBuffer(120, mode='map')
+    for i in range(3):
+        buf.write(np.zeros(12, dtype=np.float32))
+    buf.fence()
+    offset = buf.write(np.ones(12, dtype=np.float32))
+    assert offset == 48 and buf.stats['syncs'] == 1 and not buf.fences, (offset, buf.stats, list(buf.fences))
+    buf.delete()
+
+    print('每帧%d个顶点（%.2f MB），%d帧' % (n, n*row/2**20, frames))
+    print('%-22s %12s %12s %10s %10s' % ('方式', '每帧(ms)', '上传MB/s', '等待栅栏', '重新分配'))
+    for name, func in cases:
+        glFinish()
+        t0 = time.perf_counter()
+        upload, stats = func()
+        glFinish()
+        t = time.perf_counter() - t0
+        print('%-22s %12.3f %12.1f %10d %10d' % (name, t/frames*1e3, n*row*frames/2**20/upload, stats.get('waits', 0), stats.get('orphans', 0)))
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,233 @@
+"""预解码、预生成mipmap的二进制纹理容器
+
+文件结构（小端序）：
+    文件头      - 魔数、宽度、高度、通道数、层级数
+    层级表      - 每个mip层级的数据偏移量、宽度、高度、行字节数
+    像素数据    - 各层级的原始像素，每行按4字节对齐（GL_UNPACK_ALIGNMENT的默认值），
+                  每个层级的起始位置按64字节对齐
+
+加载时以mmap映射整个文件，各层级的像素是映射内存上的数组视图，直接传给glTexImage2D，
+不需要解码、复制或调用glGenerateMipmap。
+
+转换命令：python texfile.py res/earth.jpg res/earth2.jpg ...（转换结果保存在缓存目录中，
+textures.TextureManager加载原图像时自动使用比原图像新的容器文件）；不带参数时运行性能对比。
+"""
+
+import os
+import sys
+import mmap
+import time
+import struct
+import hashlib
+import tempfile
+import numpy as np
+from PIL import Image
+from OpenGL.GL import *
+
+MAGIC = b'GLTEX\x00\x00\x01'                                     # 魔数，末字节为格式版本
+EXT = '.gltex'                                                  # 容器文件扩展名
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'textures')
+
+_HEADER = struct.Struct('<8sIIII')                              # 魔数、宽度、高度、通道数、层级数
+_LEVEL = struct.Struct('<QIII')                                 # 偏移量、宽度、高度、行字节数
+_FORMATS = {1:GL_LUMINANCE, 3:GL_RGB, 4:GL_RGBA}
+_MODES = {'L':1, 'RGB':3, 'RGBA':4}
+_ROW_ALIGN = 4
+_LEVEL_ALIGN = 64
+
+def _align(n, a):
+    """将n向上取整为a的倍数"""
+
+    return (n + a - 1) // a * a
+
+def cache_path(src, cache_dir=None):
+    """返回图像文件在缓存目录中对应的容器文件路径"""
+
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    name = os.path.splitext(os.path.basename(src))[0]
+    digest = hashlib.sha1(os.path.abspath(src).encode('utf-8')).hexdigest()[:16]
+
+    return os.path.join(cache_dir, '%s-%s%s' % (name, digest, EXT))
+
+def cached(src, cache_dir=None):
+    """返回图像文件已转换且未过期的容器文件路径，不存在时返回None"""
+
+    dst = cache_path(src, cache_dir)
+    if os.path.isfile(dst) and os.path.getmtime(dst) >= os.path.getmtime(src):
+        return dst
+
+    return None
+
+def _mip_chain(im):
+    """返回从原图到1x1的全部mip层级（PIL图像），使用2x2盒式滤波逐级缩小"""
+
+    levels = [im]
+    while im.width > 1 or im.height > 1:
+        im = im.resize((max(1, im.width//2), max(1, im.height//2)), Image.BOX)
+        levels.append(im)
+
+    return levels
+
+def convert(src, dst=None, mipmap=True):
+    """将图像文件转换为容器文件，返回容器文件路径
+
+    src         - 图像文件路径
+    dst         - 容器文件路径，默认保存在缓存目录中
+    mipmap      - 是否生成全部mip层级
+    """
+
+    dst = cache_path(src) if dst is None else dst
+
+    im = Image.open(src)
+    if im.mode not in _MODES:
+        im = im.convert('RGBA' if 'A' in im.mode or 'transparency' in im.info else 'RGB')
+    channels = _MODES[im.mode]
+    levels = _mip_chain(im) if mipmap else [im]
+
+    table, offset = list(), _align(_HEADER.size + _LEVEL.size*len(levels), _LEVEL_ALIGN)
+    for level in levels:
+        row_bytes = _align(level.width*channels, _ROW_ALIGN)
+        table.append((offset, level.width, level.height, row_bytes))
+        offset = _align(offset + row_bytes*level.height, _LEVEL_ALIGN)
+
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix=EXT, dir=os.path.dirname(os.path.abspath(dst)))
+    with os.fdopen(fd, 'wb') as fp:
+        fp.write(_HEADER.pack(MAGIC, im.width, im.height, channels, len(levels)))
+        for item in table:
+            fp.write(_LEVEL.pack(*item))
+
+        for level, (offset, w, h, row_bytes) in zip(levels, table):
+            pixels = np.asarray(level, dtype=np.uint8).reshape(h, w*channels)
+            if row_bytes > w*channels:
+                pixels = np.pad(pixels, ((0, 0), (0, row_bytes - w*channels)))
+            fp.seek(offset)
+            fp.write(pixels.tobytes())
+    os.replace(tmp, dst)                                        # 先写临时文件再改名，避免读到不完整的文件
+
+    return dst
+
+class TexFile:
+    """以mmap打开的容器文件
+
+    levels中的每个数组都是映射内存上的视图，shape=(高度, 行字节数)。上传完成后应调用close()。
+    """
+
+    def __init__(self, path):
+        """构造函数"""
+
+        self.path = path                                        # 容器文件路径
+        with open(path, 'rb') as fp:
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.width, self.height, self.channels, n = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError('不是纹理容器文件或版本不符：%s' % path)
+
+        self.format = _FORMATS[self.channels]                   # 像素格式
+        self.sizes = list()                                     # 各层级的宽度和高度
+        self.levels = list()                                    # 各层级的像素数组
+
+        for i in range(n):
+            offset, w, h, row_bytes = _LEVEL.unpack_from(self._mm, _HEADER.size + _LEVEL.size*i)
+            self.sizes.append((w, h))
+            self.levels.append(np.frombuffer(self._mm, dtype=np.uint8, count=row_bytes*h, offset=offset).reshape(h, row_bytes))
+
+    @property
+    def nbytes(self):
+        """全部层级的像素字节数"""
+
+        return sum(level.nbytes for level in self.levels)
+
+    def upload_level(self, i, target=GL_TEXTURE_2D):
+        """将第i个层级上传到当前绑定的纹理对象"""
+
+        w, h = self.sizes[i]
+        glPixelStorei(GL_UNPACK_ALIGNMENT, _ROW_ALIGN)
+        glTexImage2D(target, i, self.format, w, h, 0, self.format, GL_UNSIGNED_BYTE, self.levels[i])
+
+    def close(self):
+        """释放数组视图并关闭内存映射"""
+
+        self.levels = list()
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:                                 # 仍有数组引用映射内存时交给垃圾回收关闭
+                pass
+            self._mm = None
+
+def _legacy_load(path):
+    """PIL解码、手工检查行对齐并调用glGenerateMipmap的原加载方式，仅供性能对比"""
+
+    im = np.array(Image.open(path))
+    im_h, im_w = im.shape[:2]
+    im_mode = GL_LUMINANCE if im.ndim == 2 else (GL_RGB, GL_RGBA)[im.shape[-1]-3]
+
+    tid = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, tid)
+
+    if (im.size/im_h)%4 == 0:
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+    else:
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+
+    glTexImage2D(GL_TEXTURE_2D, 0, im_mode, im_w, im_h, 0, im_mode, GL_UNSIGNED_BYTE, im)
+    glGenerateMipmap(GL_TEXTURE_2D)
+    glBindTexture(GL_TEXTURE_2D, 0)
+
+    return tid
+
+def _packed_load(path):
+    """映射容器文件并逐层级上传"""
+
+    f = TexFile(path)
+    tid = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, tid)
+    for i in range(len(f.levels)):
+        f.upload_level(i)
+    glBindTexture(GL_TEXTURE_2D, 0)
+    f.close()
+
+    return tid
+
+def benchmark(repeat=5):
+    """对比PIL解码加glGenerateMipmap和映射容器文件两种方式加载res中各图像的耗时"""
+
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(320, 240)
+    glutCreateWindow('TexFile benchmark')
+    glutHideWindow()
+
+    def best(func, path):
+        t = list()
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            tid = func(path)
+            glFinish()
+            t.append(time.perf_counter() - t0)
+            glDeleteTextures(1, [tid])
+        return min(t)
+
+    res = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'res')
+    print('%-12s %12s %12s %12s %12s %10s' % ('图像', '原文件(KB)', '容器(KB)', 'PIL(ms)', '容器(ms)', '加速比'))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name in ('earth.jpg', 'earth2.jpg', 'earth.png', 'flower.jpg', 'flower.png'):
+            src = os.path.join(res, name)
+            dst = convert(src, cache_path(src, cache_dir))
+
+            t_pil, t_packed = best(_legacy_load, src), best(_packed_load, dst)
+            print('%-12s %12.1f %12.1f %12.2f %12.2f %9.1fx' % (name, os.path.getsize(src)/1024,
+                os.path.getsize(dst)/1024, t_pil*1e3, t_packed*1e3, t_pil/t_packed))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        for src in sys.argv[1:]:
+            print('%s -> %s' % (src, convert(src)))
+    else:
+        benchmark()
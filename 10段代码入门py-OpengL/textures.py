@@ -0,0 +1,470 @@
+"""按路径和采样参数去重、按显存预算LRU淘汰的纹理管理器"""
+
+import os
+import time
+import ctypes
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+from PIL import Image
+from OpenGL.GL import *
+import texfile
+
+DEFAULT_BUDGET = 256 * 1024 * 1024                              # 默认显存预算（字节）
+DEFAULT_UPLOAD_BUDGET = 1024 * 1024                             # 异步加载时每帧默认上传的字节数
+_TEXEL_BYTES = {GL_LUMINANCE:1, GL_RGB:4, GL_RGBA:4}            # 每个纹素的估计字节数，多数驱动将RGB8按RGBA8存储
+
+def _mip_bytes(width, height, texel, mipmap):
+    """估计纹理占用的显存字节数，mipmap为True时包括全部mip层级"""
+
+    total = width * height * texel
+    while mipmap and (width > 1 or height > 1):
+        width, height = max(1, width//2), max(1, height//2)
+        total += width * height * texel
+
+    return total
+
+def _decode(path):
+    """解码图像文件，返回像素数组。异步加载时在线程池中运行
+
+    path为容器文件，或者缓存目录中有比图像文件新的容器文件时，返回以mmap打开的texfile.TexFile
+    """
+
+    packed = path if path.endswith(texfile.EXT) else texfile.cached(path)
+    if packed:
+        return texfile.TexFile(packed)
+
+    return np.ascontiguousarray(np.array(Image.open(path)))
+
+def _pixel_format(im):
+    """返回像素数组对应的像素格式"""
+
+    return GL_LUMINANCE if im.ndim == 2 else (GL_RGB, GL_RGBA)[im.shape[-1]-3]
+
+class Texture:
+    """由TextureManager管理的二维纹理
+
+    被淘汰后tid为None，再次调用bind()时由管理器重新加载，因此模型可以长期持有Texture对象。
+    异步加载尚未完成时，bind()绑定管理器的1x1占位纹理。异步解码失败时error为异常对象，bind()
+    不再重新加载、始终绑定占位纹理，再次调用load()时重试。
+    """
+
+    def __init__(self, manager, key):
+        """构造函数"""
+
+        self.manager = manager          # 所属的纹理管理器
+        self.key = key                  # (绝对路径, 缩小滤波器, 放大滤波器, S方向铺贴, T方向铺贴, 是否生成mipmap)
+        self.path = key[0]              # 图像文件路径
+        self.tid = None                 # 纹理对象，未驻留显存时为None
+        self.size = (0, 0)              # 宽度和高度
+        self.nbytes = 0                 # 估计的显存字节数
+        self.future = None              # 正在后台解码时为concurrent.futures.Future
+        self.pixels = None              # 已解码、等待上传的像素数组
+        self.upload = None              # 分帧上传中：[纹理对象, 已上传的行数]
+        self.error = None               # 异步解码失败时的异常
+
+    @property
+    def resident(self):
+        """纹理是否驻留在显存中"""
+
+        return self.tid is not None
+
+    @property
+    def loading(self):
+        """纹理是否正在解码或上传"""
+
+        return self.future is not None or self.pixels is not None
+
+    def bind(self, unit=0):
+        """将纹理绑定到第unit个纹理单元，并标记为最近使用"""
+
+        self.manager.bind(self, unit)
+
+    def release(self):
+        """立即删除纹理对象"""
+
+        self.manager.release(self)
+
+class TextureManager:
+    """纹理管理器
+
+    load()以(路径, 采样参数)为键，重复加载同一纹理时直接返回已有的Texture对象。每个纹理
+    记录估计的显存字节数（含mip层级），驻留纹理的总字节数超过预算时，按最近一次绑定的
+    先后顺序删除最久未使用的纹理。管理器中的纹理对象属于创建它们时的当前GL上下文。
+
+    异步加载时load()立即返回，图像在线程池中解码，解码完成的像素由GL线程在每帧开始时
+    调用update()分块上传（可选经由像素缓冲区对象PBO），每帧上传的字节数不超过upload_budget。
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET, asynchronous=False, workers=4, upload_budget=DEFAULT_UPLOAD_BUDGET, pbo=False):
+        """构造函数
+
+        budget          - 显存预算（字节），None表示不限制
+        asynchronous    - load()默认是否异步加载
+        workers         - 解码线程数
+        upload_budget   - 异步加载时每帧上传的字节数，None表示不限制
+        pbo             - 是否经由像素缓冲区对象上传
+        """
+
+        self.budget = budget                    # 显存预算
+        self.asynchronous = asynchronous        # 默认是否异步加载
+        self.workers = workers                  # 解码线程数
+        self.upload_budget = upload_budget      # 每帧上传的字节数
+        self.use_pbo = pbo                      # 是否使用PBO
+        self.textures = dict()                  # 键 -> Texture，包括已被淘汰的纹理
+        self.lru = OrderedDict()                # 驻留显存的纹理，按最近使用的先后排列，末尾为最近使用
+        self.loading = OrderedDict()            # 正在解码或上传的纹理，按请求的先后排列
+        self.resident_bytes = 0                 # 驻留纹理的估计字节数之和
+        self.stats = {'hits':0, 'misses':0, 'uploads':0, 'evictions':0}
+
+        self._executor = None                   # 解码线程池，首次异步加载时创建
+        self._placeholder = None                # 1x1占位纹理
+        self._pbo = None                        # 像素缓冲区对象
+
+    def load(self, path, min_filter=GL_LINEAR, mag_filter=GL_LINEAR, wrap_s=GL_REPEAT, wrap_t=GL_REPEAT, mipmap=True, asynchronous=None):
+        """加载纹理，返回Texture对象。相同路径和采样参数的纹理只解码和上传一次
+
+        asynchronous    - 是否异步加载，None表示使用管理器的设置
+        """
+
+        key = (os.path.abspath(path), int(min_filter), int(mag_filter), int(wrap_s), int(wrap_t), bool(mipmap))
+        tex = self.textures.get(key)
+
+        if tex is None:
+            self.stats['misses'] += 1
+            tex = self.textures[key] = Texture(self, key)
+        else:
+            self.stats['hits'] += 1
+
+        if tex.resident:
+            self.lru.move_to_end(key)
+        elif not tex.loading:
+            tex.error = None
+            self._request(tex, asynchronous)
+
+        return tex
+
+    def _request(self, tex, asynchronous=None):
+        """开始加载纹理。同步加载时立即解码并上传全部像素"""
+
+        if asynchronous is None:
+            asynchronous = self.asynchronous
+
+        if asynchronous:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='texture')
+            tex.future = self._executor.submit(_decode, tex.path)
+            self.loading[tex.key] = tex
+        else:
+            tex.pixels = _decode(tex.path)
+            self.loading[tex.key] = tex
+            self._upload(tex)
+
+    @property
+    def placeholder(self):
+        """异步加载完成前代替纹理绑定的1x1白色纹理"""
+
+        if self._placeholder is None:
+            self._placeholder = glGenTextures(1)
+            glBindTexture(GL_TEXTURE_2D, self._placeholder)
+            glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, 1, 1, 0, GL_RGBA, GL_UNSIGNED_BYTE, np.full(4, 255, dtype=np.uint8))
+            glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            glBindTexture(GL_TEXTURE_2D, 0)
+
+        return self._placeholder
+
+    def update(self, limit=-1):
+        """在GL线程中每帧开始时调用：上传已解码的像素，返回本帧上传的字节数
+
+        解码失败的纹理从加载队列中移除，其异常在本次调用中抛出一次，此后该纹理绑定占位纹理。
+
+        limit       - 本帧上传的字节数，-1表示使用upload_budget，None表示不限制
+        """
+
+        limit = self.upload_budget if limit == -1 else limit
+        total = 0
+
+        for tex in list(self.loading.values()):
+            if limit is not None and total >= limit:
+                break
+
+            if tex.future is not None:
+                if not tex.future.done():
+                    continue
+                future, tex.future = tex.future, None
+                try:
+                    tex.pixels = future.result()
+                except Exception as e:
+                    del self.loading[tex.key]
+                    tex.error = e
+                    raise
+
+            total += self._upload(tex, None if limit is None else limit-total)
+
+        return total
+
+    def finish(self):
+        """等待全部异步加载的纹理解码完成并上传"""
+
+        wait([tex.future for tex in self.loading.values() if tex.future is not None])
+        self.update(None)
+
+    def _upload(self, tex, limit=None):
+        """上传纹理的下一块像素行，全部上传后生成mipmap并按预算淘汰其他纹理。返回上传的字节数
+
+        limit       - 最多上传的字节数（至少上传一行），None表示上传剩余的全部像素行
+        """
+
+        if isinstance(tex.pixels, texfile.TexFile):
+            return self._upload_levels(tex, limit)
+
+        im = tex.pixels
+        im_h, im_w = im.shape[:2]
+        im_mode = _pixel_format(im)
+        row_bytes = im.strides[0]
+
+        if tex.upload is None: # 第一块：创建纹理对象并分配存储空间
+            self._create(tex)
+            glTexImage2D(GL_TEXTURE_2D, 0, im_mode, im_w, im_h, 0, im_mode, GL_UNSIGNED_BYTE, None)
+        else:
+            glBindTexture(GL_TEXTURE_2D, tex.upload[0])
+
+        row = tex.upload[1]
+        n = im_h - row if limit is None else min(im_h - row, max(1, limit // row_bytes))
+        band = im[row:row+n]
+
+        if row_bytes%4 == 0:
+            glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        else:
+            glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+
+        if self.use_pbo:
+            if self._pbo is None:
+                self._pbo = glGenBuffers(1)
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, self._pbo)
+            glBufferData(GL_PIXEL_UNPACK_BUFFER, band.nbytes, band, GL_STREAM_DRAW)
+            glTexSubImage2D(GL_TEXTURE_2D, 0, 0, row, im_w, n, im_mode, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+        else:
+            glTexSubImage2D(GL_TEXTURE_2D, 0, 0, row, im_w, n, im_mode, GL_UNSIGNED_BYTE, band)
+
+        tex.upload[1] = row = row + n
+        if row == im_h: # 最后一块：生成mipmap，纹理开始驻留显存
+            if tex.key[-1]:
+                glGenerateMipmap(GL_TEXTURE_2D)
+            self._resident(tex, im_w, im_h, im_mode)
+
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+        return band.nbytes
+
+    def _upload_levels(self, tex, limit=None):
+        """逐层级上传容器文件中预先生成的mip层级（至少上传一个层级），返回上传的字节数"""
+
+        f = tex.pixels
+        last = len(f.levels) if tex.key[-1] else 1
+
+        if tex.upload is None:
+            self._create(tex)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, last-1)
+        else:
+            glBindTexture(GL_TEXTURE_2D, tex.upload[0])
+
+        level, total = tex.upload[1], 0
+        while level < last and (limit is None or total == 0 or total + f.levels[level].nbytes <= limit):
+            f.upload_level(level)
+            total += f.levels[level].nbytes
+            level += 1
+
+        tex.upload[1] = level
+        if level == last:
+            f.close()
+            self._resident(tex, f.width, f.height, f.format)
+
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+        return total
+
+    def _create(self, tex):
+        """创建并绑定纹理对象，设置采样参数"""
+
+        path, min_filter, mag_filter, wrap_s, wrap_t, mipmap = tex.key
+
+        tid = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, tid)
+        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, min_filter)
+        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, mag_filter)
+        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, wrap_s)
+        glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, wrap_t)
+        tex.upload = [tid, 0]
+
+    def _resident(self, tex, width, height, im_mode):
+        """上传完成：纹理开始驻留显存，并按预算淘汰其他纹理"""
+
+        tex.tid = tex.upload[0]
+        tex.size = (width, height)
+        tex.nbytes = _mip_bytes(width, height, _TEXEL_BYTES[im_mode], tex.key[-1])
+        tex.pixels = tex.upload = None
+        del self.loading[tex.key]
+
+        self.lru[tex.key] = tex
+        self.resident_bytes += tex.nbytes
+        self.stats['uploads'] += 1
+        self._evict(keep=tex)
+
+    def _evict(self, keep=None):
+        """删除最久未使用的纹理，直至驻留字节数不超过预算。keep为刚加载的纹理，不会被淘汰"""
+
+        if self.budget is None:
+            return
+
+        while self.resident_bytes > self.budget and len(self.lru) > 1:
+            key, tex = next(iter(self.lru.items()))
+            if tex is keep:
+                self.lru.move_to_end(key)
+                continue
+
+            self._delete(tex)
+            self.stats['evictions'] += 1
+
+    def _delete(self, tex):
+        """删除纹理对象，Texture对象保留在管理器中以便再次加载"""
+
+        glDeleteTextures(1, [tex.tid])
+        del self.lru[tex.key]
+        self.resident_bytes -= tex.nbytes
+        tex.tid = None
+
+    def bind(self, tex, unit=0):
+        """绑定纹理并标记为最近使用。已被淘汰的纹理重新加载，加载完成前绑定占位纹理"""
+
+        if tex.resident:
+            self.lru.move_to_end(tex.key)
+        elif not tex.loading and tex.error is None:
+            self._request(tex)
+
+        glActiveTexture(GL_TEXTURE0 + unit)
+        glBindTexture(GL_TEXTURE_2D, tex.tid if tex.resident else self.placeholder)
+
+    def release(self, tex):
+        """立即删除纹理对象，并从管理器中移除"""
+
+        if tex.future is not None:
+            tex.future.cancel()
+            tex.future = None
+        if tex.upload is not None:
+            glDeleteTextures(1, [tex.upload[0]])
+            tex.upload = None
+        if isinstance(tex.pixels, texfile.TexFile):
+            tex.pixels.close()
+        tex.pixels = None
+        self.loading.pop(tex.key, None)
+
+        if tex.resident:
+            self._delete(tex)
+        self.textures.pop(tex.key, None)
+
+    def clear(self):
+        """删除全部纹理对象"""
+
+        for tex in list(self.textures.values()):
+            self.release(tex)
+
+        if self._placeholder is not None:
+            glDeleteTextures(1, [self._placeholder])
+            self._placeholder = None
+        if self._pbo is not None:
+            glDeleteBuffers(1, [self._pbo])
+            self._pbo = None
+
+_manager = None
+
+def manager():
+    """返回全部场景共享的纹理管理器，默认异步加载"""
+
+    global _manager
+    if _manager is None:
+        _manager = TextureManager(asynchronous=True)
+
+    return _manager
+
+def load(path, **kwds):
+    """使用共享的纹理管理器加载纹理"""
+
+    return manager().load(path, **kwds)
+
+def _benchmark_cache(files, budget, rounds):
+    """反复轮换加载全部图像，对比不去重不释放的旧方式和纹理管理器的显存占用与耗时"""
+
+    print('%-12s %10s %10s %10s %10s %12s' % ('方式', '总耗时(s)', '上传次数', '命中次数', '淘汰次数', '显存(MB)'))
+    for name, limit in (('不去重不释放', None), ('无预算', None), ('预算%dMB' % (budget//2**20), budget)):
+        texmgr = TextureManager(limit)
+        t0 = time.perf_counter()
+        for i in range(rounds):
+            for f in files:
+                if name == '不去重不释放':
+                    texmgr.textures.clear()                     # 丢弃Texture对象但不删除纹理，相当于每次调用create_texture_2d
+                    texmgr.lru.clear()
+                texmgr.load(f).bind()
+        glFinish()
+        t = time.perf_counter() - t0
+
+        s = texmgr.stats
+        print('%-12s %10.2f %10d %10d %10d %12.1f' % (name, t, s['uploads'], s['hits'], s['evictions'], texmgr.resident_bytes/2**20))
+
+def _benchmark_async(files):
+    """对比同步加载和异步加载时load()阻塞的时间、上传帧数、单帧最长上传耗时和全部就绪的时间"""
+
+    cases = (
+        ('同步', False, None, False),
+        ('异步 不限', True, None, False),
+        ('异步 1MB/帧', True, DEFAULT_UPLOAD_BUDGET, False),
+        ('异步 1MB/帧+PBO', True, DEFAULT_UPLOAD_BUDGET, True)
+    )
+
+    print('%-16s %12s %10s %14s %12s' % ('方式', 'load阻塞(ms)', '上传帧数', '最长一帧(ms)', '就绪(ms)'))
+    for name, asynchronous, upload_budget, pbo in cases:
+        texmgr = TextureManager(None, asynchronous, upload_budget=upload_budget, pbo=pbo)
+
+        t0 = time.perf_counter()
+        for f in files:
+            texmgr.load(f)
+        glFinish()
+        t_load = time.perf_counter() - t0
+
+        frames = list()
+        while texmgr.loading:
+            t1 = time.perf_counter()
+            n = texmgr.update()
+            glFinish()
+            if n > 0:
+                frames.append(time.perf_counter() - t1)
+        t_ready = time.perf_counter() - t0
+
+        longest = max(frames + [t_load if not asynchronous else 0])
+        print('%-16s %12.1f %10d %14.1f %12.1f' % (name, t_load*1e3, len(frames), longest*1e3, t_ready*1e3))
+        texmgr.clear()
+
+def benchmark(budget=4*1024*1024, rounds=20):
+    """纹理去重与LRU淘汰、异步加载的性能对比"""
+
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(320, 240)
+    glutCreateWindow('TextureManager benchmark')
+    glutHideWindow()
+
+    res = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'res')
+    files = [os.path.join(res, name) for name in ('earth.jpg', 'earth2.jpg', 'earth.png', 'flower.jpg', 'flower.png')]
+
+    _benchmark_cache(files, budget, rounds)
+    print()
+    _benchmark_async(files)
+
+if __name__ == '__main__':
+    benchmark()
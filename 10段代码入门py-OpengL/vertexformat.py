@@ -0,0 +1,261 @@
+"""紧凑的混合顶点格式：多个顶点属性量化后交错存放在一个对齐的VBO中
+
+每个float32顶点属性分别保存在独立的VBO中时，顶点坐标、法向量和纹理坐标共32字节，绘制时分别绑定
+3个缓冲区。VertexFormat把各属性按指定的编码交错存放在一个缓冲区中，每个属性的偏移量和步长按4字节
+对齐，并自动以glVertexAttribPointer设置各属性的类型、分量数和归一化方式：
+
+    'float'             GL_FLOAT，每个分量4字节，不损失精度
+    'half'              GL_HALF_FLOAT，每个分量2字节，相对误差约2^-11
+    'ushort'            归一化的GL_UNSIGNED_SHORT，只能表示[0,1]，误差约1/65535，适合纹理坐标
+    'short'             归一化的GL_SHORT，只能表示[-1,1]
+    'int2_10_10_10'     GL_INT_2_10_10_10_REV，3个分量各10位（w分量2位）共4字节，适合单位法向量
+    'auto'              按数据选择：网格数组名称为'normals'的单位向量用'int2_10_10_10'，[0,1]内的数据
+                        用'ushort'，half的误差不超过tolerance乘以数据的范围时用'half'，否则用'float'
+                        （单位球面的顶点坐标也是单位向量，但10位的精度不够，因此按名称区分法向量）
+
+3个分量的'half'、'ushort'和'short'属性补齐为4个分量（第4个分量为1），以满足4字节对齐；作为顶点
+坐标时w=1，与着色器中vec4的默认值相同。以'half'顶点坐标、'int2_10_10_10'法向量和'ushort'纹理坐标
+存放的顶点为16字节，是3个float32缓冲区的一半。
+
+    fmt = VertexFormat([('a_Position', 'vertices', 'auto'), ('a_Normal', 'normals', 'auto'), ('a_Texcoord', 'texcoords', 'auto')])
+    fmt.attach(geometry, fmt.pack(mesh))            # geometry为Geometry对象
+"""
+
+import time
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.arrays import vbo
+
+ENCODINGS = {                                                   # 编码：(数据类型, 是否归一化, 每个分量的字节数)
+    'float':            (GL_FLOAT, False, 4),
+    'half':             (GL_HALF_FLOAT, False, 2),
+    'ushort':           (GL_UNSIGNED_SHORT, True, 2),
+    'short':            (GL_SHORT, True, 2),
+    'int2_10_10_10':    (GL_INT_2_10_10_10_REV, True, None)
+}
+
+def _pack_2_10_10_10(values):
+    """把[-1,1]内的(N,3)数组编码为GL_INT_2_10_10_10_REV的uint32数组，w分量为0"""
+
+    q = np.round(np.clip(values, -1, 1) * 511).astype(np.int32) & 0x3FF
+    return (q[:, 0] | (q[:, 1] << 10) | (q[:, 2] << 20)).astype(np.uint32)
+
+def _unpack_2_10_10_10(packed):
+    """把GL_INT_2_10_10_10_REV的uint32数组解码为(N,3)的float32数组"""
+
+    q = np.stack([(packed >> shift) & 0x3FF for shift in (0, 10, 20)], axis=1).astype(np.int32)
+    q = np.where(q >= 512, q - 1024, q)
+
+    return np.maximum(q / 511, -1).astype(np.float32)
+
+def encode(values, encoding):
+    """按编码量化(N,size)的数组，返回(编码后的数组, 分量数)"""
+
+    values = np.asarray(values, dtype=np.float32).reshape(len(values), -1)
+    size = values.shape[1]
+
+    if encoding == 'int2_10_10_10':
+        return _pack_2_10_10_10(values[:, :3])[:, None], 4
+
+    if encoding == 'float':
+        return values, size
+
+    if size == 3: # 补齐为4个分量，保持4字节对齐
+        values = np.hstack((values, np.ones((len(values), 1), dtype=np.float32)))
+    if encoding == 'half':
+        return values.astype(np.float16), values.shape[1]
+    if encoding == 'ushort':
+        return np.round(np.clip(values, 0, 1) * 65535).astype(np.uint16), values.shape[1]
+    if encoding == 'short':
+        return np.round(np.clip(values, -1, 1) * 32767).astype(np.int16), values.shape[1]
+
+    raise ValueError('未知的顶点属性编码：%s' % encoding)
+
+def decode(data, size, dtype, normalized, stride, offset, count=None):
+    """从混合数组的字节数据中解码一个属性，返回(N,size)的float32数组；GL_INT_2_10_10_10_REV返回(N,3)"""
+
+    raw = np.asarray(data).view(np.uint8).reshape(-1)
+    n = len(raw) // stride if count is None else count
+    rows = np.lib.stride_tricks.as_strided(raw[offset:], (n, stride), (stride, 1))
+
+    if dtype == GL_INT_2_10_10_10_REV:
+        return _unpack_2_10_10_10(np.ascontiguousarray(rows[:, :4]).view(np.uint32).ravel())
+
+    kind = {GL_FLOAT:np.float32, GL_HALF_FLOAT:np.float16, GL_UNSIGNED_SHORT:np.uint16, GL_SHORT:np.int16}[dtype]
+    itemsize = np.dtype(kind).itemsize
+    values = np.ascontiguousarray(rows[:, :size*itemsize]).view(kind).astype(np.float32)
+    if normalized:
+        values /= 65535 if kind is np.uint16 else 32767
+
+    return np.maximum(values, -1) if normalized and kind is np.int16 else values
+
+class VertexFormat:
+    """混合顶点格式"""
+
+    def __init__(self, attribs, tolerance=1e-3):
+        """构造函数
+
+        attribs     - [(属性名称, 网格数组名称, 编码), ...]，如[('a_Position', 'vertices', 'half'), ...]
+        tolerance   - 'auto'编码允许的最大误差，为数据范围（各分量绝对值的最大值）的比例
+        """
+
+        self.attribs = list(attribs)
+        self.tolerance = tolerance
+        self.layout = list()                                    # 各属性：(名称, 编码, 分量数, 数据类型, 是否归一化, 偏移量)
+        self.stride = 0                                         # 每个顶点的字节数
+        self.errors = dict()                                    # 各属性量化的最大绝对误差
+
+    def _choose(self, key, values):
+        """为'auto'编码选择编码"""
+
+        values = np.asarray(values, dtype=np.float32).reshape(len(values), -1)
+        if key == 'normals' and values.shape[1] == 3 and np.allclose(np.linalg.norm(values, axis=1), 1, atol=1e-3):
+            return 'int2_10_10_10'
+        if values.min() >= 0 and values.max() <= 1:
+            return 'ushort'
+
+        scale = float(np.abs(values).max()) or 1.0
+        half = values.astype(np.float16).astype(np.float32)
+        if np.isfinite(half).all() and np.abs(half - values).max() <= self.tolerance * scale:
+            return 'half'
+
+        return 'float'
+
+    def pack(self, mesh):
+        """按格式编码网格字典（或属性名称到数组的字典）中的属性，返回shape=(顶点数,stride)的uint8混合数组"""
+
+        encoded, self.layout, offset = list(), list(), 0
+        for name, key, encoding in self.attribs:
+            values = np.asarray(mesh[key], dtype=np.float32)
+            values = values.reshape(len(values), -1)
+            if encoding == 'auto':
+                encoding = self._choose(key, values)
+            gltype, normalized, _ = ENCODINGS[encoding]
+
+            data, size = encode(values, encoding)
+            encoded.append(data)
+            self.layout.append((name, encoding, size, gltype, normalized, offset))
+            offset += -(-data.itemsize * data.shape[1] // 4) * 4
+
+        self.stride = offset
+        n = len(encoded[0])
+        packed = np.zeros((n, self.stride), dtype=np.uint8)
+        for data, (name, encoding, size, gltype, normalized, offset) in zip(encoded, self.layout):
+            nbytes = data.itemsize * data.shape[1]
+            packed[:, offset:offset+nbytes] = np.ascontiguousarray(data).view(np.uint8).reshape(n, nbytes)
+
+        for (name, key, _), (_, encoding, size, gltype, normalized, offset) in zip(self.attribs, self.layout):
+            values = np.asarray(mesh[key], dtype=np.float32).reshape(n, -1)
+            restored = decode(packed, size, gltype, normalized, self.stride, offset)[:, :values.shape[1]]
+            self.errors[name] = float(np.abs(restored - values).max()) if n else 0.0
+
+        return packed
+
+    def attach(self, geometry, packed):
+        """把混合数组作为一个VBO添加到Geometry，并按格式设置各属性指针，返回VBO"""
+
+        buf = vbo.VBO(packed)
+        for name, encoding, size, gltype, normalized, offset in self.layout:
+            geometry.attrib(name, buf, size, gltype, normalized, self.stride, offset)
+        if geometry.indices is None:
+            geometry.count = len(packed)
+
+        return buf
+
+    def describe(self):
+        """返回格式的文字说明，如'a_Position:half*4@0 a_Normal:int2_10_10_10*4@8 (16字节)'"""
+
+        items = ['%s:%s*%d@%d' % (name, encoding, size, offset) for name, encoding, size, gltype, normalized, offset in self.layout]
+        return '%s (%d字节)' % (' '.join(items), self.stride)
+
+def benchmark(rows=720, cols=1440, frames=20):
+    """以rows x cols的球面对比3个float32 VBO、一个float32混合VBO和紧凑格式的每顶点字节数、绘制耗时和量化误差"""
+
+    from OpenGL.GLUT import glutInit, glutInitDisplayMode, glutInitWindowSize, glutCreateWindow, glutHideWindow
+    from OpenGL.GLUT import GLUT_DOUBLE, GLUT_DEPTH
+    from camera import Camera
+    from geometry import Geometry
+    from program import ShaderProgram
+    import meshes
+
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_DEPTH)
+    glutInitWindowSize(320, 240)
+    glutCreateWindow('Vertex format benchmark')
+    glutHideWindow()
+    glViewport(0, 0, 320, 240)
+    glEnable(GL_DEPTH_TEST)
+
+    vshader_src = """
+        #version 330 core
+
+        in vec4 a_Position;
+        in vec3 a_Normal;
+        in vec2 a_Texcoord;
+        uniform mat4 u_MVPMatrix;
+        out vec3 v_Color;
+
+        void main() {
+            gl_Position = u_MVPMatrix * a_Position;
+            v_Color = vec3(a_Texcoord, 0.5) * max(dot(normalize(a_Normal), vec3(0.0, 0.0, 1.0)), 0.2);
+        }
+    """
+
+    fshader_src = """
+        #version 330 core
+
+        in vec3 v_Color;
+
+        void main() {
+            gl_FragColor = vec4(v_Color, 1.0);
+        }
+    """
+
+    program = ShaderProgram(vshader_src, fshader_src)
+    camera = Camera(haxis='z', dist=4.0, fovy=40.0, aspect=320/240)
+    mesh = meshes.sphere(rows=rows, cols=cols, optimize=True)
+    names = (('a_Position', 'vertices'), ('a_Normal', 'normals'), ('a_Texcoord', 'texcoords'))
+
+    def separate():
+        geometry = Geometry(GL_TRIANGLES, program)
+        for name, key in names:
+            geometry.attrib(name, np.asarray(mesh[key], dtype=np.float32))
+        return geometry, 32, None
+
+    def interleaved(encoding):
+        geometry = Geometry(GL_TRIANGLES, program)
+        fmt = VertexFormat([(name, key, encoding) for name, key in names])
+        fmt.attach(geometry, fmt.pack(mesh))
+        return geometry, fmt.stride, fmt
+
+    def timed(geometry):
+        geometry.elements(mesh['indices'])
+        geometry.prepare()
+        program.use()
+        program['u_MVPMatrix'] = camera.vpmat
+        t = list()
+        for i in range(frames):
+            t0 = time.perf_counter()
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            geometry.draw()
+            glFinish()
+            t.append(time.perf_counter() - t0)
+        program.unuse()
+        geometry.delete()
+        return np.median(t[1:])
+
+    print('球面：%dx%d，%d个顶点' % (rows, cols, rows*cols))
+    print('%-16s %10s %12s %10s %12s %12s  %s' % ('格式', '缓冲区数', '每顶点字节', '顶点MB', '每帧(ms)', '最大误差', '布局'))
+    cases = (('3个float32 VBO', separate), ('float32混合', lambda: interleaved('float')), ('紧凑(auto)', lambda: interleaved('auto')))
+    for name, func in cases:
+        geometry, stride, fmt = func()
+        buffers = len({id(item[1]) for item in geometry.attribs})
+        t = timed(geometry)
+        error = max(fmt.errors.values()) if fmt else 0.0
+        print('%-16s %10d %12d %10.1f %12.2f %12.2g  %s' % (name, buffers, stride, stride*rows*cols/2**20, t*1e3, error,
+            fmt.describe() if fmt else ''))
+
+    program.delete()
+
+if __name__ == '__main__':
+    benchmark()